@@ -0,0 +1,11 @@
+"""
+    benchmarks measures pymm's performance. generate builds synthetic
+    mindmaps of any size from a seed, suite times read, write,
+    round-trip, traversal, query and mutation on them and compares the
+    results with a baseline, and startup times importing pymm.
+
+    usage: python -m benchmarks.suite [--preset NAME] [--output FILE]
+                                      [--baseline FILE]
+           python -m benchmarks.generate [--preset NAME] FILE
+           python benchmarks/startup.py
+"""
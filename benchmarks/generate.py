@@ -0,0 +1,236 @@
+"""
+    generate builds synthetic mindmaps for benchmarking. Maps are built
+    as xml.etree elements from a seed, so the same options always give
+    the same file, byte for byte. Each node has TEXT and timestamps, and
+    (depending on the options) extra attrib such as COLOR or FOLDED, a
+    user-defined style, rich-content notes or details, an attribute
+    table, an arrow to another node, an icon, edge, font or cloud.
+
+    usage: python -m benchmarks.generate [--preset NAME] [--seed N] FILE
+"""
+import argparse
+import random
+import xml.etree.ElementTree as ET
+
+#: named option sets, from a map you could draw by hand to a large one
+PRESETS = {
+    'small': {'depth': 3, 'fanout': 5},      # 156 nodes
+    'medium': {'depth': 4, 'fanout': 8},     # 4681 nodes
+    'large': {'depth': 5, 'fanout': 8},      # 37449 nodes
+}
+
+_words = (
+    'plan review design test release budget risk goal idea task note '
+    'meeting draft summary research customer feature issue owner metric '
+    'deadline scope question answer follow-up priority status'
+).split()
+_colors = ('#000000', '#cc3300', '#18898b', '#006699', '#669900', '#990099')
+_icons = ('idea', 'yes', 'button_ok', 'messagebox_warning', 'flag', 'bell')
+_edge_styles = ('linear', 'bezier', 'sharp_bezier', 'horizontal')
+_cloud_shapes = ('ARC', 'STAR', 'RECT', 'ROUND_RECT')
+_attribute_names = ('owner', 'status', 'cost', 'estimate', 'priority')
+
+#: milliseconds since the epoch of the first node's CREATED timestamp
+_epoch = 1400000000000
+
+
+def _sentence(rng, low=1, high=6):
+    return ' '.join(rng.choice(_words) for _ in range(rng.randint(low, high)))
+
+
+def _rich_content(rng, kind):
+    """return richcontent element of TYPE kind holding a short html
+    document
+    """
+    rich = ET.Element('richcontent', TYPE=kind)
+    html = ET.SubElement(rich, 'html')
+    ET.SubElement(html, 'head')
+    body = ET.SubElement(html, 'body')
+    for _ in range(rng.randint(1, 3)):
+        ET.SubElement(body, 'p').text = _sentence(rng, 3, 12)
+    return rich
+
+
+def _map_styles(rng, styles):
+    """return MapStyle hook defining user styles named 'style 0' to
+    'style <styles - 1>'
+    """
+    hook = ET.Element('hook', NAME='MapStyle')
+    ET.SubElement(hook, 'properties', show_icon_for_attributes='true',
+                  show_note_icons='true', show_notes_in_map='true')
+    map_styles = ET.SubElement(hook, 'map_styles')
+    root = ET.SubElement(map_styles, 'stylenode',
+                         LOCALIZED_TEXT='styles.root_node')
+    predefined = ET.SubElement(root, 'stylenode', POSITION='right',
+                               LOCALIZED_TEXT='styles.predefined')
+    default = ET.SubElement(predefined, 'stylenode', LOCALIZED_TEXT='default',
+                            COLOR='#000000', STYLE='as_parent')
+    ET.SubElement(default, 'font', NAME='SansSerif', SIZE='10',
+                  BOLD='false', ITALIC='false')
+    user = ET.SubElement(root, 'stylenode', POSITION='right',
+                         LOCALIZED_TEXT='styles.user-defined')
+    for number in range(styles):
+        style = ET.SubElement(user, 'stylenode', TEXT='style ' + str(number),
+                              COLOR=rng.choice(_colors), STYLE='fork')
+        ET.SubElement(style, 'font', NAME='SansSerif',
+                      SIZE=str(rng.choice((10, 12, 14))),
+                      BOLD=rng.choice(('true', 'false')))
+    return hook
+
+
+def _decorate(rng, node, number, depth, options, ids):
+    """add attrib and children to node, the number-th node generated,
+    according to options
+    """
+    density = options['attrib_density']
+    attrib = node.attrib
+    if rng.random() < density:
+        attrib['COLOR'] = rng.choice(_colors)
+    if rng.random() < density / 2:
+        attrib['BACKGROUND_COLOR'] = rng.choice(_colors)
+    if depth == 1:
+        attrib['POSITION'] = rng.choice(('left', 'right'))
+    if depth < options['depth'] and rng.random() < density / 4:
+        attrib['FOLDED'] = 'true'
+    if rng.random() < density / 4:
+        attrib['LINK'] = 'https://example.com/' + str(number)
+    if rng.random() < density / 4:
+        attrib['HGAP'] = str(rng.randint(0, 40))
+        attrib['VSHIFT'] = str(rng.randint(-20, 20))
+    if options['styles'] and rng.random() < options['style_ratio']:
+        attrib['STYLE'] = 'style ' + str(rng.randrange(options['styles']))
+    if rng.random() < options['rich_ratio']:
+        del attrib['TEXT']
+        node.append(_rich_content(rng, 'NODE'))
+    if rng.random() < options['rich_ratio']:
+        node.append(_rich_content(rng, rng.choice(('NOTE', 'DETAILS'))))
+    if rng.random() < options['attribute_ratio']:
+        for name in rng.sample(_attribute_names, rng.randint(1, 4)):
+            ET.SubElement(node, 'attribute', NAME=name,
+                          VALUE=str(rng.randint(0, 1000)))
+    if ids and rng.random() < options['arrow_ratio']:
+        ET.SubElement(node, 'arrowlink', DESTINATION=rng.choice(ids),
+                      ENDARROW='Default', STARTARROW='None')
+    if rng.random() < density / 2:
+        ET.SubElement(node, 'icon', BUILTIN=rng.choice(_icons))
+    if rng.random() < density / 4:
+        ET.SubElement(node, 'edge', STYLE=rng.choice(_edge_styles),
+                      COLOR=rng.choice(_colors), WIDTH=str(rng.randint(1, 4)))
+    if rng.random() < density / 8:
+        ET.SubElement(node, 'font', NAME='SansSerif', BOLD='true',
+                      SIZE=str(rng.choice((10, 12, 14))))
+    if rng.random() < density / 8:
+        ET.SubElement(node, 'cloud', COLOR=rng.choice(_colors),
+                      SHAPE=rng.choice(_cloud_shapes))
+
+
+def generate(depth=4, fanout=6, attrib_density=0.3, rich_ratio=0.05,
+             attribute_ratio=0.2, arrow_ratio=0.03, style_ratio=0.2,
+             styles=6, seed=0):
+    """return xml.etree map element of a synthetic mindmap. The root
+    node has fanout children, each of which has fanout children, and so
+    on, depth levels below the root (so the map has
+    1 + fanout + ... + fanout ** depth nodes)
+
+    :param attrib_density: 0 to 1. Probability of a node having COLOR;
+                           other optional attrib, icons, edges, fonts
+                           and clouds are rarer in proportion
+    :param rich_ratio: probability of a node having rich-content text,
+                       and (separately) of it having a note or details
+    :param attribute_ratio: probability of a node having an attribute
+                            table (of 1 to 4 attributes)
+    :param arrow_ratio: probability of a node having an arrow to an
+                        earlier node
+    :param style_ratio: probability of a node using a user style
+    :param styles: number of user styles defined in the map
+    :param seed: random seed. Equal options give identical maps
+    """
+    options = {
+        'depth': depth, 'attrib_density': attrib_density,
+        'rich_ratio': rich_ratio, 'attribute_ratio': attribute_ratio,
+        'arrow_ratio': arrow_ratio, 'style_ratio': style_ratio,
+        'styles': styles,
+    }
+    rng = random.Random(seed)
+    mindmap = ET.Element('map', version='freeplane 1.3.0')
+    ET.SubElement(mindmap, 'attribute_registry', SHOW_ATTRIBUTES='all')
+    ids = []
+    timestamp = _epoch
+    root = None
+    stack = [(mindmap, 0)]  # parent, depth of children to add
+    while stack:
+        parent, level = stack.pop()
+        for _ in range(1 if root is None else fanout):
+            number = len(ids)
+            timestamp += rng.randint(1000, 100000)
+            modified = timestamp + rng.randint(0, 10 ** 8)
+            node = ET.SubElement(parent, 'node', ID='ID_' + str(number),
+                                 CREATED=str(timestamp),
+                                 MODIFIED=str(modified), TEXT=_sentence(rng))
+            if root is None:
+                root = node
+                node.append(_map_styles(rng, styles))
+                ET.SubElement(node, 'hook', NAME='AutomaticEdgeColor',
+                              COUNTER=str(fanout))
+            else:
+                _decorate(rng, node, number, level, options, ids)
+            ids.append(node.attrib['ID'])
+            if level < depth:
+                stack.append((node, level + 1))
+    return mindmap
+
+
+def generate_bytes(**options):
+    """return a synthetic mindmap (see generate) as .mm file contents"""
+    return ET.tostring(generate(**options), encoding='utf-8')
+
+
+def write(file_or_filename, **options):
+    """write a synthetic mindmap (see generate) to file_or_filename"""
+    ET.ElementTree(generate(**options)).write(file_or_filename,
+                                              encoding='utf-8')
+
+
+def options_for(preset=None, **overrides):
+    """return generate() options of preset, updated with overrides that
+    are not None
+    """
+    options = dict(PRESETS[preset]) if preset else {}
+    options.update((k, v) for k, v in overrides.items() if v is not None)
+    return options
+
+
+def add_arguments(parser, preset='small'):
+    """add generate() options to argparse parser"""
+    parser.add_argument('--preset', choices=sorted(PRESETS), default=preset,
+                        help='named map size (default: ' + preset + ')')
+    parser.add_argument('--depth', type=int, help='levels below the root')
+    parser.add_argument('--fanout', type=int, help='children per node')
+    for name in ('attrib_density', 'rich_ratio', 'attribute_ratio',
+                 'arrow_ratio', 'style_ratio'):
+        parser.add_argument('--' + name.replace('_', '-'), type=float,
+                            dest=name)
+    parser.add_argument('--styles', type=int, help='user styles defined')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def options_from(args):
+    """return generate() options from arguments parsed by a parser set up
+    with add_arguments
+    """
+    names = ('depth', 'fanout', 'attrib_density', 'rich_ratio',
+             'attribute_ratio', 'arrow_ratio', 'style_ratio', 'styles',
+             'seed')
+    return options_for(args.preset, **{n: getattr(args, n) for n in names})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_arguments(parser)
+    parser.add_argument('file', help='.mm file to write')
+    args = parser.parse_args(argv)
+    write(args.file, **options_from(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+    startup measures how long a fresh python process takes to import
+    pymm, and then to create its first Mindmap (which decodes the default
+    hierarchy and builds the factories). Each run uses a new interpreter
+    so that nothing is cached in memory.
+
+    usage: python benchmarks/startup.py [--runs N] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+#: code run in each fresh interpreter. Prints timings in milliseconds
+_probe = '''
+import json, time
+start = time.perf_counter()
+import pymm
+imported = time.perf_counter()
+pymm.Mindmap()
+created = time.perf_counter()
+print(json.dumps({
+    'import': (imported - start) * 1000,
+    'first_mindmap': (created - imported) * 1000,
+    'total': (created - start) * 1000,
+}))
+'''
+
+
+def measure(runs=20):
+    """return {measurement: [milliseconds of each run]}"""
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')])
+    )
+    results = {}
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _probe], env=env, cwd=root,
+        )
+        for name, value in json.loads(output).items():
+            results.setdefault(name, []).append(value)
+    return results
+
+
+def summarize(results):
+    """return {measurement: {'min', 'median', 'max'}} in milliseconds"""
+    return {
+        name: {
+            'min': min(values),
+            'median': statistics.median(values),
+            'max': max(values),
+        } for name, values in results.items()
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=20,
+                        help='number of fresh interpreters to time')
+    parser.add_argument('--json', action='store_true',
+                        help='print summary as json')
+    args = parser.parse_args(argv)
+    summary = summarize(measure(args.runs))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print('%-15s %10s %10s %10s' % ('ms', 'min', 'median', 'max'))
+    for name, stats in summary.items():
+        print('%-15s %10.2f %10.2f %10.2f' % (
+            name, stats['min'], stats['median'], stats['max']
+        ))
+
+
+if __name__ == '__main__':
+    main()
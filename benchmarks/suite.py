@@ -0,0 +1,310 @@
+"""
+    suite times pymm on a synthetic mindmap (see benchmarks.generate):
+    reading, writing, a read/write round-trip, traversal, queries,
+    validation, building a tree and mutation. Building and mutation are
+    also timed on hashed trees (see BaseElement.content_hash), whose
+    changes are tracked. Results are saved as json, and may be
+    compared against a baseline saved earlier; a benchmark whose median
+    time grew by more than its threshold is reported as slower, and
+    makes the exit status non-zero.
+
+    usage: python -m benchmarks.suite [--preset NAME] [--runs N]
+                                      [--only NAME ...] [--output FILE]
+                                      [--baseline FILE] [--threshold T]
+"""
+import argparse
+import collections
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import pymm
+from . import generate
+from .startup import summarize
+
+#: {name: (function, prepare)} of registered benchmarks, in run order
+benchmarks = collections.OrderedDict()
+
+#: default allowed slowdown of a benchmark's median, as a fraction
+THRESHOLD = 0.10
+
+
+def benchmark(name, prepare=None):
+    """register decorated function as benchmark name. Each run calls
+    function(workload, state), and only that call is timed. If given,
+    prepare(workload) is called (untimed) before each run, and its
+    result passed as state; otherwise state is None
+    """
+    def register(function):
+        benchmarks[name] = (function, prepare)
+        return function
+    return register
+
+
+class Workload:
+    """synthetic mindmap that benchmarks run against: its .mm file
+    (path), file contents (data), and decoded tree (mindmap). out_path
+    is a file benchmarks may write to
+    """
+
+    def __init__(self, directory, **options):
+        self.options = options
+        self.data = generate.generate_bytes(**options)
+        self.path = os.path.join(directory, 'benchmark.mm')
+        self.out_path = os.path.join(directory, 'benchmark-out.mm')
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+        self.mindmap = pymm.read(self.path)
+        self.nodes = sum(1 for _ in self.mindmap.iter_preorder(tag='node'))
+
+
+@benchmark('read')
+def _read(workload, state):
+    pymm.read(workload.path)
+
+
+@benchmark('write')
+def _write(workload, state):
+    pymm.write(workload.out_path, workload.mindmap)
+
+
+@benchmark('round_trip')
+def _round_trip(workload, state):
+    pymm.write(workload.out_path, pymm.read(workload.path))
+
+
+@benchmark('traversal')
+def _traversal(workload, state):
+    for _ in workload.mindmap.iter_preorder():
+        pass
+
+
+@benchmark('query')
+def _query(workload, state):
+    """scan for nodes by attrib, and look up nodes by attribute with an
+    AttributeIndex
+    """
+    mindmap = workload.mindmap
+    for _, node, _ in mindmap.iter_preorder(tag='node'):
+        if node.attrib.get('COLOR') == '#cc3300' and 'LINK' in node.attrib:
+            pass
+    for node in mindmap.root.nodes:
+        node.findall(tag_regex=r'node', attrib_regex={r'COLOR': r'#cc.*'})
+    index = pymm.AttributeIndex(mindmap)
+    index.find('status', '500')
+    index.find_range('cost', 100, 400)
+    index.find_having('owner')
+
+
+@benchmark('validate')
+def _validate(workload, state):
+    pymm.validate(workload.mindmap)
+
+
+def _grow(top, count):
+    """append count new nodes beneath top, ten to a branch"""
+    for number in range(count):
+        if number % 10 == 0:
+            branch = pymm.Node(TEXT='branch ' + str(number))
+            top.children.append(branch)
+        branch.children.append(pymm.Node(TEXT='node ' + str(number)))
+
+
+def _prepare_hashed_top(workload):
+    """return a new node whose content_hash has been computed"""
+    top = pymm.Node()
+    top.content_hash()
+    return top
+
+
+@benchmark('build')
+def _build(workload, state):
+    """create as many nodes as the workload has, in a new tree"""
+    _grow(pymm.Node(), workload.nodes)
+
+
+@benchmark('build_hashed', prepare=_prepare_hashed_top)
+def _build_hashed(workload, state):
+    """create as many nodes as the workload has, beneath a hashed node"""
+    _grow(state, workload.nodes)
+
+
+def _prepare_mutation(workload):
+    """return a copy of the workload's tree, and its (parent, node)
+    pairs
+    """
+    mindmap = workload.mindmap.clone(new_ids=False)
+    nodes = [(parent, node) for parent, node, _ in
+             mindmap.iter_preorder(tag='node')]
+    return mindmap, nodes
+
+
+def _prepare_hashed_mutation(workload):
+    """return the state of _prepare_mutation, with the tree hashed"""
+    mindmap, nodes = _prepare_mutation(workload)
+    mindmap.content_hash()
+    return mindmap, nodes
+
+
+@benchmark('mutation', prepare=_prepare_mutation)
+def _mutation(workload, state):
+    """edit text, attrib and attributes of one node in ten, add a child
+    to one in twenty, and remove one leaf node in twenty
+    """
+    mindmap, nodes = state
+    rng = random.Random(0)
+    for number, (parent, node) in enumerate(nodes[1:], 1):
+        choice = rng.random()
+        if choice < 0.1:
+            node.text = 'edited ' + str(number)
+            node.attrib['COLOR'] = '#ff0000'
+            node['status'] = str(number)
+        elif choice < 0.15:
+            node.nodes.append(pymm.Node(TEXT='added ' + str(number)))
+        elif choice < 0.2 and not node.nodes:
+            parent.children.remove(node)
+
+
+@benchmark('mutation_hashed', prepare=_prepare_hashed_mutation)
+def _mutation_hashed(workload, state):
+    """mutation, on a hashed tree"""
+    _mutation(workload, state)
+
+
+def time_benchmark(workload, name, runs=5, warmup=1):
+    """return list of milliseconds taken by each run of benchmark name.
+    Garbage is collected before each run, so one run's garbage is not
+    collected during the next
+    """
+    function, prepare = benchmarks[name]
+    times = []
+    for run in range(warmup + runs):
+        state = prepare(workload) if prepare is not None else None
+        gc.collect()
+        start = time.perf_counter()
+        function(workload, state)
+        elapsed = time.perf_counter() - start
+        if run >= warmup:
+            times.append(elapsed * 1000)
+    return times
+
+
+def run(names=None, runs=5, warmup=1, **options):
+    """run benchmarks names (default: all) on a map generated with
+    options (see benchmarks.generate.generate) and return results as a
+    json-serialisable dict of 'meta' (environment, map options and size)
+    and 'benchmarks' ({name: {'min', 'median', 'max'}} in milliseconds)
+    """
+    names = list(benchmarks) if names is None else names
+    with tempfile.TemporaryDirectory() as directory:
+        workload = Workload(directory, **options)
+        times = {name: time_benchmark(workload, name, runs, warmup)
+                 for name in names}
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'options': options,
+            'nodes': workload.nodes,
+            'bytes': len(workload.data),
+            'runs': runs,
+        },
+        'benchmarks': summarize(times),
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD, thresholds=None):
+    """compare median times of results with baseline (both as returned
+    by run) and return list of (name, baseline ms, ms, change, verdict).
+    change is the relative change in median time (0.25 is 25% slower).
+    verdict is 'slower' or 'faster' if change exceeds the benchmark's
+    threshold (from thresholds {name: fraction}, else threshold), 'new'
+    if the benchmark is not in baseline, else 'same'
+    """
+    thresholds = thresholds or {}
+    rows = []
+    for name, summary in results['benchmarks'].items():
+        current = summary['median']
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            rows.append((name, None, current, None, 'new'))
+            continue
+        change = (current - before['median']) / before['median']
+        allowed = thresholds.get(name, threshold)
+        if change > allowed:
+            verdict = 'slower'
+        elif change < -allowed:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        rows.append((name, before['median'], current, change, verdict))
+    return rows
+
+
+def _parse_thresholds(values):
+    """return (default, {name: threshold}) from --threshold arguments,
+    each either a fraction or name=fraction
+    """
+    default, thresholds = THRESHOLD, {}
+    for value in values or ():
+        name, _, fraction = value.rpartition('=')
+        if name:
+            thresholds[name] = float(fraction)
+        else:
+            default = float(fraction)
+    return default, thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    generate.add_arguments(parser, preset='medium')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='timed runs per benchmark')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='untimed runs per benchmark')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--output', help='save results as json to file')
+    parser.add_argument('--baseline', help='compare with json results')
+    parser.add_argument('--threshold', action='append', metavar='T',
+                        help='allowed slowdown as fraction (default 0.1), '
+                             'or NAME=fraction for one benchmark')
+    args = parser.parse_args(argv)
+    options = generate.options_from(args)
+    results = run(args.only, args.runs, args.warmup, **options)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    meta = results['meta']
+    print(str(meta['nodes']) + ' nodes, ' + str(meta['bytes']) + ' bytes')
+    if not args.baseline:
+        print('%-15s %10s %10s %10s' % ('ms', 'min', 'median', 'max'))
+        for name, summary in results['benchmarks'].items():
+            print('%-15s %10.2f %10.2f %10.2f' % (
+                name, summary['min'], summary['median'], summary['max']
+            ))
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['meta']['options'] != meta['options']:
+        print('warning: baseline was run on a different map',
+              file=sys.stderr)
+    default, thresholds = _parse_thresholds(args.threshold)
+    rows = compare(results, baseline, default, thresholds)
+    print('%-15s %10s %10s %8s' % ('median ms', 'baseline', 'now', 'change'))
+    for name, before, current, change, verdict in rows:
+        print('%-15s %10s %10.2f %8s  %s' % (
+            name, '-' if before is None else '%.2f' % before, current,
+            '-' if change is None else '%+.1f%%' % (change * 100), verdict,
+        ))
+    return 1 if any(row[-1] == 'slower' for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
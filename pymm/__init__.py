@@ -1 +1,60 @@
-from .pymm import *
+"""
+    pymm's public names are loaded on first access rather than when pymm
+    is imported, so that "import pymm" is cheap. Accessing a name (such
+    as pymm.Mindmap or pymm.read) imports the submodule it lives in (and
+    the modules that needs); factories are built on the first read or
+    write. encode, decode and validate share their names with submodules
+    and are light, so they are imported here.
+"""
+import importlib
+from .convert import decode, encode
+from .validate import validate, ValidationError
+
+#: exported names that are loaded on first access, and their submodule
+_lazy_names = {
+    'read': 'pymm', 'write': 'pymm', 'fromstring': 'pymm',
+    'tostring': 'pymm', 'file_locked': 'pymm', 'ET': 'pymm',
+    'Mindmap': 'pymm', 'Node': 'pymm', 'Cloud': 'pymm', 'Icon': 'pymm',
+    'Edge': 'pymm', 'Arrow': 'pymm',
+    'diff': 'diff', 'patch': 'diff',
+    'merge': 'merge', 'Conflict': 'merge',
+    'AttributeIndex': 'index', 'TimestampIndex': 'index',
+    'ConversionStats': 'stats',
+    'memory_report': 'memory', 'MemoryReport': 'memory',
+    'FileLock': 'lock', 'LockTimeout': 'lock',
+    'aread': 'aio', 'awrite': 'aio', 'aread_many': 'aio', 'aopen': 'aio',
+    'SharedTree': 'transport',
+    'ReadCache': 'cache',
+    'SharedMindmap': 'shared', 'Snapshot': 'shared',
+}
+
+#: submodules that are imported on first access (such as pymm.index)
+_submodules = frozenset((
+    'access', 'aio', 'batch', 'cache', 'convert', 'element', 'factory',
+    'flat', 'index', 'lock', 'memory', 'observe', 'parallel', 'pymm',
+    'registry', 'serialize', 'shared', 'stats', 'transport', 'units',
+))
+
+__all__ = ['decode', 'encode', 'validate', 'ValidationError', *_lazy_names]
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        module_name = _lazy_names[name]
+        module = importlib.import_module('.' + module_name, __name__)
+        # export all of the module's names at once, since importing it
+        # set pymm.<module_name>, which hides pymm.diff and pymm.merge
+        names = globals()
+        for lazy_name, lazy_module_name in _lazy_names.items():
+            if lazy_module_name == module_name:
+                names[lazy_name] = getattr(module, lazy_name)
+        return names[name]
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        "module '" + __name__ + "' has no attribute '" + name + "'"
+    )
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names) | _submodules)
@@ -0,0 +1,27 @@
+"""
+    command line interface of pymm.
+
+    usage: python -m pymm batch PATH [PATH ...] [options]
+           (see pymm.batch, or python -m pymm batch --help)
+"""
+import argparse
+import sys
+
+from . import batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pymm')
+    commands = parser.add_subparsers(dest='command', required=True)
+    batch_parser = commands.add_parser(
+        'batch', help='apply a function to many mindmaps in parallel',
+        description=batch.__doc__.split('\n\n')[0],
+    )
+    batch.add_arguments(batch_parser)
+    batch_parser.set_defaults(main=batch.main)
+    args = parser.parse_args(argv)
+    return args.main(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -70,15 +70,23 @@ class ChildSubsetSimplified(ChildSetupVerify):
         """Return getter and setter methods for self, such that returned
         functions can be used in defining a property of an element
         """
-        self = cls(None, **identifier)
+        template = cls(None, **identifier)
 
-        def getter(parent):
+        def bound(parent):
+            """return subset of parent's children. A new subset is made
+            each time, so that threads reading different elements do not
+            rebind each other's subset
+            """
+            self = object.__new__(cls)
+            self.__dict__.update(template.__dict__)
             self.parent = parent
             return self
 
+        def getter(parent):
+            return bound(parent)
+
         def setter(parent, iterable):
-            self.parent = parent
-            self[:] = iterable
+            bound(parent)[:] = iterable
 
         return getter, setter
 
@@ -0,0 +1,228 @@
+"""
+    aio reads and writes mindmaps from asyncio code without blocking the
+    event loop. asyncio has no non-blocking file I/O, so files are read
+    a chunk at a time in an executor, and each chunk is fed to an
+    incremental xml parser on the event loop; the loop is never busy for
+    longer than one chunk takes to parse. Decoding and encoding, the
+    CPU-heavy part of reading and writing, run in the executor.
+
+    The executor is the event loop's default executor, unless another is
+    set with set_executor or passed as executor=. It must run functions
+    in threads of this process (such as a ThreadPoolExecutor), since the
+    decoded tree is returned by reference.
+
+        mindmap = await pymm.aread('input.mm')
+        await pymm.awrite('output.mm', mindmap)
+        async with pymm.aopen('output.mm', 'w') as mindmap:
+            ...
+        # mindmap written to output.mm
+        mindmaps = await pymm.aread_many(filenames, concurrency=4)
+"""
+import asyncio
+import functools
+import xml.etree.ElementTree as ET
+
+from . import element
+from . import lock as pymm_lock
+from . import serialize
+from . import stats as pymm_stats
+from .pymm import Mindmap, decode, encode, file_locked, _write_locked
+
+#: number of bytes read from file, and fed to the parser, at once
+CHUNK_SIZE = 1 << 16
+
+_executor = None
+
+
+def set_executor(executor):
+    """use executor for file I/O, decoding and encoding when none is
+    passed to aread or awrite. None uses the event loop's default
+    executor
+    """
+    global _executor
+    _executor = executor
+
+
+def _run(executor, function, *args):
+    """return future of function(*args) run in executor"""
+    loop = asyncio.get_running_loop()
+    if executor is None:
+        executor = _executor
+    return loop.run_in_executor(executor, functools.partial(function, *args))
+
+
+def _open_locked(path, timeout):
+    """open path for reading once no writer holds it. The open file is
+    not changed by a later pymm.write, which replaces the file instead
+    """
+    with pymm_lock.FileLock(path, False, timeout):
+        return open(path, 'rb')
+
+
+async def _parse(file_or_filename, timeout, executor, chunk_size):
+    """return xml.etree element parsed from file_or_filename, which is
+    read in chunks in executor
+    """
+    if pymm_lock.is_path(file_or_filename):
+        file = await _run(executor, _open_locked, file_or_filename, timeout)
+    else:
+        file = file_or_filename
+    try:
+        parser = ET.XMLParser()
+        while True:
+            chunk = await _run(executor, file.read, chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        return parser.close()
+    finally:
+        if file is not file_or_filename:
+            file.close()
+
+
+def _decode(et_elem, stats, validation, timestamps):
+    """decode et_elem as pymm.read does"""
+    # must lock default_mindmap_filename (see pymm.read)
+    with file_locked(Mindmap.default_mindmap_filename):
+        pymm_elem = decode(et_elem, stats, validation)
+    if timestamps:
+        from .index import TimestampIndex
+        pymm_elem.timestamps = TimestampIndex(pymm_elem)
+    return pymm_elem
+
+
+async def aread(file_or_filename, timestamps=False, stats=None,
+                validation='lenient', timeout=None, executor=None,
+                chunk_size=CHUNK_SIZE):
+    """decode the file/filename into a pymm tree, as pymm.read does,
+    without blocking the event loop.
+
+    :param file_or_filename: string path to file or binary file
+                             instance of mindmap
+    :param timestamps: build a TimestampIndex (see pymm.read)
+    :param stats: optional pymm.ConversionStats (see pymm.read)
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+    :param timeout: seconds to wait for a writer of the file to finish
+                    before raising pymm.LockTimeout (see pymm.read)
+    :param executor: executor for file reads and decoding (see
+                     set_executor)
+    :param chunk_size: number of bytes read and parsed at once
+    :return: Mindmap instance, or the top-level pymm element
+    """
+    with pymm_stats.conversion(stats):
+        with pymm_stats.phase(stats, 'parse'):
+            et_elem = await _parse(file_or_filename, timeout, executor,
+                                   chunk_size)
+        return await _run(executor, _decode, et_elem, stats, validation,
+                          timestamps)
+
+
+def _serialise(pymm_element, stats, validation):
+    """return pymm_element encoded to bytes, as pymm.write writes it"""
+    et_elem = encode(pymm_element, stats, validation)
+    with pymm_stats.phase(stats, 'serialise'):
+        return serialize.tostring(et_elem)
+
+
+async def awrite(file_or_filename, pymm_element, stats=None,
+                 validation='lenient', timeout=None, executor=None,
+                 chunk_size=CHUNK_SIZE):
+    """write mindmap/element to file, as pymm.write does, without
+    blocking the event loop. The element is encoded in the executor, so
+    it should not be changed until awrite returns.
+
+    :param file_or_filename: string path to file or binary file
+                             instance of mindmap (.mm)
+    :param pymm_element: Mindmap or other pymm element
+    :param stats: optional pymm.ConversionStats (see pymm.write)
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+    :param timeout: seconds to wait for readers and writers of the file
+                    before raising pymm.LockTimeout (see pymm.write)
+    :param executor: executor for encoding and file writes (see
+                     set_executor)
+    :param chunk_size: number of bytes written at once to a file
+                       instance. Files written by name are written whole
+    """
+    if not isinstance(pymm_element, element.BaseElement):
+        raise ValueError(
+            'pymm.awrite requires file/filename, then pymm element'
+        )
+    with pymm_stats.conversion(stats):
+        data = await _run(executor, _serialise, pymm_element, stats,
+                          validation)
+        if pymm_lock.is_path(file_or_filename):
+            await _run(executor, _write_locked, file_or_filename,
+                       lambda file: file.write(data), stats, timeout)
+            return
+        with pymm_stats.phase(stats, 'serialise'):
+            view = memoryview(data)
+            for start in range(0, len(view), chunk_size):
+                await _run(executor, file_or_filename.write,
+                           view[start:start + chunk_size])
+
+
+async def aread_many(files, concurrency=4, return_exceptions=False,
+                     **kwargs):
+    """read several files at once, with at most concurrency of them
+    being read at any time, and return list of their pymm trees in the
+    order of files.
+
+    :param files: iterable of filenames or file instances
+    :param concurrency: most files read at once
+    :param return_exceptions: if True, a file that fails to read gives
+                              its exception in the list, instead of
+                              raising it
+    :param kwargs: passed to aread
+    """
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read_one(file_or_filename):
+        async with semaphore:
+            return await aread(file_or_filename, **kwargs)
+    return await asyncio.gather(
+        *(read_one(file) for file in files),
+        return_exceptions=return_exceptions
+    )
+
+
+class aopen:
+    """async context manager that works like a Mindmap opened with a
+    filename and mode, without blocking the event loop. In read mode
+    ('r') the file is read with aread; in write mode ('w') a default
+    hierarchy is loaded, and written to file with awrite on exit, even if
+    an error occurs (as Mindmap does).
+
+        async with pymm.aopen(filename, 'w') as mindmap:
+            mindmap.root.text = 'written on exit'
+
+    :param kwargs: passed to aread and awrite, as is executor
+    """
+
+    def __init__(self, filename, mode='r', executor=None, **kwargs):
+        if 'r' in mode and 'w' in mode:
+            raise ValueError('must have exactly one of read/write mode')
+        if 'r' not in mode and 'w' not in mode:
+            raise ValueError('unknown mode: ' + str(mode))
+        self.filename = filename
+        self.mode = mode
+        self.executor = executor
+        self.kwargs = kwargs
+        self.mindmap = None
+
+    async def __aenter__(self):
+        if 'r' in self.mode:
+            mindmap = await aread(self.filename, executor=self.executor,
+                                  **self.kwargs)
+        else:
+            mindmap = await _run(self.executor, Mindmap)
+        mindmap.filename = self.filename
+        mindmap.mode = self.mode
+        self.mindmap = mindmap
+        return mindmap
+
+    async def __aexit__(self, *error):
+        if 'w' in self.mode:
+            await awrite(self.filename, self.mindmap, executor=self.executor,
+                         **self.kwargs)
@@ -0,0 +1,354 @@
+"""
+    batch applies a function to many mindmaps at once, using a process
+    per cpu. Each file is read with pymm.read in a worker process, the
+    function is called with the decoded mindmap, and its results are
+    collected (or reduced) in the calling process. A file that fails to
+    read, or that the function fails on, is recorded in the result's
+    errors and does not stop the others.
+
+    Workers are warmed once when they start: the factories and the
+    default hierarchy are built then, rather than for each file. Files
+    are sent to workers in chunks, and only a few chunks are in flight
+    at once, so that a batch of 100k files does not queue 100k tasks.
+
+        def count_nodes(mindmap):
+            return sum(1 for _ in mindmap.iter_preorder(tag='node'))
+
+        result = pymm.batch.run(count_nodes, pymm.batch.find_files('maps'),
+                                reduce=operator.add, initial=0)
+        print(result.value, result.stats)
+
+    usage: python -m pymm batch PATH [PATH ...] [--task NAME]
+                                [--function MODULE:NAME] [--workers N]
+"""
+import collections
+import concurrent.futures
+import fnmatch
+import functools
+import importlib
+import json
+import operator
+import os
+import sys
+import time
+import traceback
+
+#: default number of files sent to a worker at once
+CHUNKSIZE = 16
+
+#: state of a worker process, set by _warm: function and read options
+_worker = {}
+
+#: default of run's initial: reduce starts from the first result
+_no_initial = object()
+
+
+class BatchStats:
+    """progress and throughput of a batch.
+
+    files: number of files to process
+    done: number processed so far (including failures)
+    failed: number of files that failed
+    bytes: size of the files processed
+    seconds: wall time since the batch started
+    worker_seconds: time workers spent reading files and calling the
+                    function, summed over workers
+    """
+
+    def __init__(self, files=0):
+        self.files = files
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.worker_seconds = 0.0
+        self._start = time.perf_counter()
+
+    def add(self, size, seconds, failed):
+        """count one processed file"""
+        self.done += 1
+        self.failed += failed
+        self.bytes += size
+        self.worker_seconds += seconds
+        self.seconds = time.perf_counter() - self._start
+
+    @property
+    def files_per_second(self):
+        return self.done / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        """return stats as a json-serialisable dict"""
+        return {
+            'files': self.files, 'done': self.done, 'failed': self.failed,
+            'bytes': self.bytes, 'seconds': self.seconds,
+            'worker_seconds': self.worker_seconds,
+            'files_per_second': self.files_per_second,
+            'bytes_per_second': self.bytes_per_second,
+        }
+
+    def __str__(self):
+        return '%d/%d files (%d failed), %.1f files/s, %.1f MB/s' % (
+            self.done, self.files, self.failed, self.files_per_second,
+            self.bytes_per_second / 1e6,
+        )
+
+
+class BatchResult:
+    """outcome of a batch.
+
+    value: reduced value, if reduce was given; otherwise None
+    results: {path: function's result} of files that succeeded, in the
+             order of files, if reduce was not given; otherwise empty
+    errors: {path: formatted traceback} of files that failed
+    stats: BatchStats
+    """
+
+    def __init__(self, value, results, errors, stats):
+        self.value = value
+        self.results = results
+        self.errors = errors
+        self.stats = stats
+
+    def as_dict(self):
+        """return result as a dict, json-serialisable if the function's
+        results (or reduced value) are
+        """
+        return {'value': self.value, 'results': self.results,
+                'errors': self.errors, 'stats': self.stats.as_dict()}
+
+
+def find_files(paths, pattern='*.mm'):
+    """return sorted list of files matching pattern in paths. Each path
+    is a file (included whatever its name) or a directory (searched
+    recursively)
+    """
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(os.fspath(path))
+            continue
+        for directory, _, names in os.walk(path):
+            files.extend(os.path.join(directory, name) for name in names
+                         if fnmatch.fnmatch(name, pattern))
+    return sorted(files)
+
+
+def _warm(function, read_options):
+    """initialise worker: keep function and read options, and build the
+    factories and default hierarchy once for all its files
+    """
+    import pymm
+    from . import factory
+    factory.registry.snapshot()
+    pymm.Mindmap()
+    _worker['function'] = function
+    _worker['read_options'] = read_options
+
+
+def _process(path):
+    """return (path, succeeded, result or formatted traceback, size,
+    seconds) of applying the worker's function to the map at path
+    """
+    from .pymm import read
+    start = time.perf_counter()
+    size = 0
+    try:
+        size = os.path.getsize(path)
+        result = _worker['function'](read(path, **_worker['read_options']))
+        succeeded = True
+    except Exception:
+        result = traceback.format_exc()
+        succeeded = False
+    return path, succeeded, result, size, time.perf_counter() - start
+
+
+def _process_chunk(paths):
+    """return list of _process results of each path"""
+    return [_process(path) for path in paths]
+
+
+def run(function, files, reduce=None, initial=_no_initial, workers=None,
+        chunksize=CHUNKSIZE, progress=None, **read_options):
+    """apply function to the mindmap read from each of files, in worker
+    processes, and return a BatchResult.
+
+    :param function: called with each decoded mindmap. Its result must
+                     be picklable, and so must function (it must be
+                     defined at the top level of a module)
+    :param files: list of filenames (see find_files)
+    :param reduce: optional reduce(accumulated, result) combining the
+                   results as they arrive, as functools.reduce does.
+                   Results arrive in no particular order. If None, all
+                   results are kept in BatchResult.results
+    :param initial: first accumulated value given to reduce. If not
+                    given, the first result is
+    :param workers: number of worker processes (default: one per cpu).
+                    0 processes files in this process, which helps when
+                    debugging function
+    :param chunksize: number of files sent to a worker at once
+    :param progress: optional function called with BatchStats after each
+                     chunk completes
+    :param read_options: passed to pymm.read, such as validation='off'
+    """
+    files = [os.fspath(file) for file in files]
+    stats = BatchStats(len(files))
+    value = initial
+    outcomes = {}
+    errors = {}
+    chunks = [files[start:start + chunksize]
+              for start in range(0, len(files), chunksize)]
+
+    def collect(chunk_results):
+        nonlocal value
+        for path, succeeded, result, size, seconds in chunk_results:
+            stats.add(size, seconds, not succeeded)
+            if not succeeded:
+                errors[path] = result
+            elif reduce is None:
+                outcomes[path] = result
+            elif value is _no_initial:
+                value = result
+            else:
+                value = reduce(value, result)
+        if progress is not None:
+            progress(stats)
+
+    if workers == 0:
+        _warm(function, read_options)
+        for chunk in chunks:
+            collect(_process_chunk(chunk))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_warm,
+                initargs=(function, read_options)) as executor:
+            chunks = iter(chunks)
+            pending = {}  # future: its chunk
+            while True:
+                # keep a couple of chunks queued per worker
+                while len(pending) < 2 * workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending[executor.submit(_process_chunk, chunk)] = chunk
+                if not pending:
+                    break
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        chunk_results = future.result()
+                    except Exception:
+                        # the chunk's results were lost (its worker died,
+                        # or a result could not be pickled): every file
+                        # of it failed
+                        error = traceback.format_exc()
+                        chunk_results = [(path, False, error, 0, 0.0)
+                                         for path in chunk]
+                    collect(chunk_results)
+    if value is _no_initial:
+        value = None
+    results = collections.OrderedDict(
+        (path, outcomes[path]) for path in files if path in outcomes
+    )
+    return BatchResult(value, results, errors, stats)
+
+
+def read_only(mindmap):
+    """return None: reading each file checks that it can be read"""
+    return None
+
+
+def count_elements(mindmap):
+    """return Counter of elements in mindmap, per tag"""
+    return collections.Counter(
+        elem.tag for _, elem, _ in mindmap.iter_preorder()
+    )
+
+
+def check_spec(mindmap):
+    """return number of attrib values in mindmap not matching spec"""
+    from .validate import validate
+    return validate(mindmap).count
+
+
+#: tasks available from the command line, as {name: (function, reduce)}
+TASKS = {
+    'read': (read_only, None),
+    'count': (count_elements, operator.add),
+    'validate': (check_spec, None),
+}
+
+
+def _import(name):
+    """return object named 'module:attribute'"""
+    module_name, _, attribute = name.partition(':')
+    if not attribute:
+        raise ValueError(name + ' must be given as module:name')
+    return functools.reduce(getattr, attribute.split('.'),
+                            importlib.import_module(module_name))
+
+
+def add_arguments(parser):
+    """add batch options to argparse parser"""
+    parser.add_argument('paths', nargs='+',
+                        help='.mm files, or directories to search')
+    parser.add_argument('--pattern', default='*.mm',
+                        help='names of files in directories (default *.mm)')
+    parser.add_argument('--task', choices=sorted(TASKS), default='read',
+                        help='built-in function to apply (default: read)')
+    parser.add_argument('--function', metavar='MODULE:NAME',
+                        help='function to apply to each mindmap')
+    parser.add_argument('--reduce', metavar='MODULE:NAME',
+                        help='function combining results of --function')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: one per cpu)')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE,
+                        help='files sent to a worker at once')
+    parser.add_argument('--validation', default='off',
+                        choices=('strict', 'lenient', 'off'))
+    parser.add_argument('--output', help='save results as json to file')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not report progress')
+
+
+def main(args):
+    """run batch with arguments parsed by a parser set up with
+    add_arguments, and return exit status: 1 if any file failed
+    """
+    function, reduce = TASKS[args.task]
+    if args.function:
+        function, reduce = _import(args.function), None
+    if args.reduce:
+        reduce = _import(args.reduce)
+    progress = None
+    if not args.quiet:
+        def progress(stats):
+            print('\r' + str(stats), end='', file=sys.stderr, flush=True)
+    result = run(function, find_files(args.paths, args.pattern), reduce,
+                 workers=args.workers, chunksize=args.chunksize,
+                 progress=progress, validation=args.validation)
+    if not args.quiet:
+        print(file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result.as_dict(), file, indent=2, default=str)
+    else:
+        summary = result.value if reduce is not None else {
+            path: value for path, value in result.results.items()
+            if value is not None
+        }
+        if summary:
+            print(json.dumps(summary, indent=2, default=str))
+    for path, error in result.errors.items():
+        print(path + ': ' + error.strip().splitlines()[-1], file=sys.stderr)
+    print(result.stats)
+    return 1 if result.errors else 0
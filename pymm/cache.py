@@ -0,0 +1,187 @@
+"""
+    cache keeps recently read mindmaps in memory, so that reading a
+    popular file again does not decode it again. A ReadCache holds each
+    decoded tree as a prototype and returns a clone of it on each read
+    (as Mindmap.default_mindmap does), so callers may change what they
+    are given without changing the cache. An entry is used only while
+    its file keeps the same size, modification time and inode; a file
+    that was changed or replaced is read again.
+
+    Entries are evicted least recently used first, once the cache holds
+    more than max_entries trees or (if max_bytes is given) more than
+    max_bytes of them, as estimated by pymm.memory_report. Threads that
+    read the same file at once, when it is not cached, share one read.
+
+        cache = pymm.ReadCache(max_entries=32)
+        mindmap = cache.read('popular.mm')
+        print(cache.hits, cache.misses, cache.evictions)
+"""
+import collections
+import os
+import threading
+
+from .pymm import read
+
+
+def _identity(path):
+    """return what identifies the content of file at path: its device,
+    inode, size and modification time
+    """
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class _Entry:
+    """cached prototype of a file, with the identity of the file it was
+    read from and its estimated size in bytes
+    """
+
+    def __init__(self, identity, prototype, size):
+        self.identity = identity
+        self.prototype = prototype
+        self.size = size
+
+
+class _Flight:
+    """a read of a file in progress, waited on by other threads reading
+    the same file
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.prototype = None
+        self.error = None
+
+
+class ReadCache:
+    """LRU cache of decoded mindmaps, keyed by path and validation mode.
+    Safe to use from several threads at once.
+
+    :param max_entries: most trees kept
+    :param max_bytes: optional most bytes of trees kept, as estimated by
+                      pymm.memory_report when each is read
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None):
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0  # entries dropped because their file changed
+        self.bytes = 0
+        self._entries = collections.OrderedDict()  # key: _Entry
+        self._flights = {}  # key: _Flight
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        path = os.path.realpath(os.fsdecode(path))
+        with self._lock:
+            return any(key[0] == path for key in self._entries)
+
+    def read(self, filename, timestamps=False, validation='lenient',
+             timeout=None):
+        """return a clone of the mindmap at filename, reading it with
+        pymm.read if it is not cached or its file changed.
+
+        :param filename: path to mindmap (.mm)
+        :param timestamps: build a TimestampIndex of the clone (see
+                           pymm.read)
+        :param validation: 'lenient', 'strict' or 'off' (see pymm.read).
+                           Trees are cached separately per mode
+        :param timeout: seconds to wait for a writer of the file (see
+                        pymm.read)
+        """
+        key = (os.path.realpath(os.fsdecode(filename)), validation)
+        identity = _identity(key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.identity == identity:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._copy(entry.prototype, timestamps)
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._copy(flight.prototype, timestamps)
+        try:
+            prototype = read(key[0], validation=validation, timeout=timeout)
+            flight.prototype = prototype
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        # a file changed while being read is not cached
+        if _identity(key[0]) == identity:
+            self._add(key, _Entry(identity, prototype, self._size(prototype)))
+        return self._copy(prototype, timestamps)
+
+    def _size(self, prototype):
+        if self.max_bytes is None:
+            return 0
+        from .memory import memory_report
+        return memory_report(prototype).total
+
+    def _add(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and
+                    self.bytes > self.max_bytes and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """forget entry of key. Caller must hold the lock"""
+        self.bytes -= self._entries.pop(key).size
+
+    @staticmethod
+    def _copy(prototype, timestamps):
+        copy = prototype.clone(new_ids=False)
+        if timestamps:
+            from .index import TimestampIndex
+            copy.timestamps = TimestampIndex(copy)
+        return copy
+
+    def discard(self, filename):
+        """forget cached trees of filename, if any"""
+        path = os.path.realpath(os.fsdecode(filename))
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                self._remove(key)
+
+    def clear(self):
+        """forget all cached trees. Counters are kept"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def as_dict(self):
+        """return counters and size of the cache as a dict"""
+        with self._lock:
+            return {
+                'entries': len(self._entries), 'bytes': self.bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,81 @@
+"""
+    convert holds pymm.decode and pymm.encode, which convert between
+    xml.etree and pymm elements when called, and register decorated
+    functions (in pymm/decode.py and pymm/encode.py) otherwise. They are
+    kept apart from pymm.pymm so that "import pymm" can export them
+    without importing elements or building factories.
+"""
+import importlib
+
+# the registries share these functions' names, so pymm.decode and
+# pymm.encode name the functions, not the modules
+_decode_registry = importlib.import_module('.decode', __package__)
+_encode_registry = importlib.import_module('.encode', __package__)
+
+
+class decode:
+    """function-like class that allows decorating of functions to
+    configure a pymm element post-decode. If called with an element,
+    instead decode the supplied element and return it's decoded state
+    """
+
+    def __new__(cls, et_element, stats=None, validation='lenient'):
+        """decode ElementTree Element to pymm Element.
+
+        :param et_element: Element Tree Element -> generally an element
+                           from python's xml.etree.ElementTree module
+        :param stats: optional pymm.ConversionStats to record in
+        :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+        :return: Pymm hierarchical tree. Usually Mindmap instance but
+                 may return BaseElement-inheriting element if
+                 et_element was not complete mindmap hierarchy.
+        """
+        from . import element, factory  # imported on first use
+        if isinstance(et_element, element.BaseElement):
+            raise ValueError('cannot decode a pymm element')
+        return factory.decode(et_element, stats, validation)
+
+    @staticmethod
+    def post_decode(fxn):
+        _decode_registry.post_decode(fxn)
+        return fxn
+
+
+class encode:
+    """function-like class that allows decorating of functions to
+    configure a pymm element post-decode. If called with an element,
+    instead decode the supplied element and return it's decoded state
+    """
+
+    def __new__(cls, pymm_element, stats=None, validation='lenient'):
+        """encode pymm Element to ElementTree Element
+
+        :param mm_element: pymm Element from pymm.Elements module
+        :param stats: optional pymm.ConversionStats to record in
+        :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+        :return: xml.etree version of passed pymm tree
+        """
+        from . import element, factory  # imported on first use
+        if not isinstance(pymm_element, element.BaseElement):
+            raise ValueError('encoding requires a pymm element')
+        return factory.encode(pymm_element, stats, validation)
+
+    @staticmethod
+    def pre_encode(fxn):
+        _encode_registry.pre_encode(fxn)
+        return fxn
+
+    @staticmethod
+    def post_encode(fxn):
+        _encode_registry.post_encode(fxn)
+        return fxn
+
+    @staticmethod
+    def get_attrib(fxn):
+        _encode_registry.get_attrib(fxn)
+        return fxn
+
+    @staticmethod
+    def get_children(fxn):
+        _encode_registry.get_children(fxn)
+        return fxn
@@ -7,10 +7,31 @@
     allowed is limited but powerful enough to allow custom exporting
     and importing of mindmaps
 """
+import threading
 
-# decorated is the dictionary of functions decorated, and their
-# keyword-used in decorating them. For example, 'post_decode': fxn
-unclaimed = {}
+
+class Unclaimed(threading.local):
+    """functions decorated, and the keyword used in decorating them
+    (for example, fxn: 'post_decode'), that no element class has claimed
+    yet. Each thread has its own, since a function is claimed by the
+    next element class declared in the thread that decorated it
+    """
+
+    def __init__(self):
+        self.functions = {}
+
+    def __setitem__(self, fxn, event_name):
+        self.functions[fxn] = event_name
+
+    def claim(self):
+        """return {fxn: event name} of unclaimed functions, and forget
+        them
+        """
+        functions, self.functions = self.functions, {}
+        return functions
+
+
+unclaimed = Unclaimed()
 
 
 def post_decode(fxn):
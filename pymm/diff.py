@@ -0,0 +1,632 @@
+"""
+    diff computes a compact edit script between two versions of a pymm
+    tree, and patch applies such a script to a tree. Nodes are matched by
+    their ID attrib first, and by structure (tag and TEXT, in order,
+    beneath matched parents) second. Subtrees whose content_hash is equal
+    in both versions are skipped entirely, so diffing two large, mostly
+    identical maps only visits the parts that changed.
+
+    Within a diff, a "unit" is a node with an ID that is a child of the
+    root or of another unit. Every other element (edge, cloud,
+    richcontent, hook, etc.) is a "detail" of the unit that holds it.
+    The edit script is a list of json-serialisable dicts, applied in
+    order. Units are referenced by ID (the root by None):
+    {'op': 'insert', 'parent': ID, 'index': i, 'node': payload}
+        insert new node (with its details, but no child nodes) as the
+        i-th child node of parent
+    {'op': 'move', 'id': ID, 'parent': ID, 'index': i}
+        move node to be the i-th child node of parent
+    {'op': 'delete', 'id': ID}
+        remove node and its sub-children
+    {'op': 'details', 'id': ID, 'children': [[k, payload], ...]}
+        replace the details of a unit. Each detail is placed after k
+        child nodes
+    {'op': 'attributes', 'id': ID, 'items': [[name, value], ...]}
+        replace the node attributes (see Node[name] = value)
+    {'op': 'attrib', 'id': ID, 'set': {key: value}, 'delete': [key]}
+        change attrib of a unit. Applied last, since it may change an ID
+    A payload is a dict of an element's tag, attrib, text, tail,
+    attributes, and children payloads. Payloads are decoded through the
+    normal factories when patched.
+"""
+import bisect
+import xml.etree.ElementTree as ET
+from . import factory
+from . import observe
+from .units import _is_unit, _unit_id, _node_children, _text
+
+
+def _details(elem):
+    return [child for child in elem.children if not _is_unit(child)]
+
+
+def dump(elem, nodes=True):
+    """return json-serialisable payload of element and its children. If
+    nodes is False, child units are left out of the top element
+    """
+    top = None
+    stack = [(elem, None)]
+    while stack:
+        elem, parent_payload = stack.pop()
+        payload = {
+            'tag': elem.tag,
+            'attrib': {_text(k): _text(v) for k, v in elem.attrib.items()
+                       if v is not None},
+            'text': elem._text, 'tail': elem._tail, 'children': [],
+        }
+        attributes = getattr(elem, '_attribute', None)
+        if attributes:
+            payload['attributes'] = [
+                [_text(k), _text(v)] for k, v in attributes.items()
+            ]
+        if parent_payload is None:
+            top = payload
+            children = elem.children if nodes else _details(elem)
+        else:
+            parent_payload['children'].append(payload)
+            children = elem.children
+        stack.extend((child, payload) for child in reversed(children))
+    return top
+
+
+def _et_element(payload):
+    """return xml.etree element hierarchy of payload created by dump"""
+    top = None
+    stack = [(payload, None)]
+    while stack:
+        payload, parent = stack.pop()
+        et_elem = ET.Element(payload['tag'], payload['attrib'])
+        et_elem.text = payload.get('text')
+        et_elem.tail = payload.get('tail')
+        if parent is None:
+            top = et_elem
+        else:
+            parent.append(et_elem)
+        stack.extend(
+            (child, et_elem) for child in reversed(payload['children'])
+        )
+        for name, value in payload.get('attributes', ()):
+            attribute = ET.Element('attribute', NAME=name, VALUE=value)
+            attribute.tail = '\n'
+            et_elem.append(attribute)
+    return top
+
+
+def load(payload):
+    """return pymm element decoded (through the normal factories) from
+    payload created by dump
+    """
+    return factory.decode(_et_element(payload))
+
+
+#: tag of the element that payloads decoded together are placed under
+_BATCH = 'pymm_batch'
+
+
+def _load_all(payloads):
+    """return list of pymm elements decoded from payloads in a single
+    conversion, rather than one conversion each
+    """
+    if len(payloads) < 2:
+        return [load(payload) for payload in payloads]
+    batch = ET.Element(_BATCH)
+    batch.extend(_et_element(payload) for payload in payloads)
+    top = factory.decode(batch)
+    elements = list(top.children)
+    if len(elements) != len(payloads):  # a factory dropped an element
+        return [load(payload) for payload in payloads]
+    top.children.clear()
+    return elements
+
+
+class _Children:
+    """children of a unit, held as its units in order, each with the
+    details that follow it, and the details before the first unit.
+    Units are kept in blocks of about sqrt(n), so that finding,
+    inserting or removing one does not take n steps, and many moves or
+    inserts beneath one parent do not cost n squared.
+
+    Units are inserted and removed as the edit script defines: a unit
+    inserted as the index-th unit goes right before the unit currently
+    at index, or right after the last unit, or at the end if there are
+    no units. A removed unit's details stay where they were, after the
+    unit before it.
+    """
+
+    def __init__(self, children, is_unit):
+        self.leading = []  # details before the first unit
+        self.following = {}  # unit: details after it
+        units = []
+        for child in children:
+            if is_unit(child):
+                units.append(child)
+                self.following[child] = []
+            elif units:
+                self.following[units[-1]].append(child)
+            else:
+                self.leading.append(child)
+        self.size = max(32, int(len(units) ** 0.5))
+        self.blocks = [units[i:i + self.size]
+                       for i in range(0, len(units), self.size)] or [[]]
+        self.block_of = {}  # unit: block holding it
+        for block in self.blocks:
+            for unit in block:
+                self.block_of[unit] = block
+        self.count = len(units)
+
+    def __iter__(self):
+        """yield units, in order"""
+        for block in self.blocks:
+            yield from block
+
+    def _locate(self, index):
+        """return block holding the index-th unit, and its offset"""
+        for block in self.blocks:
+            if index < len(block):
+                return block, index
+            index -= len(block)
+        raise IndexError('unit index out of range')
+
+    def rank(self, unit):
+        """return index of unit among the units"""
+        block = self.block_of[unit]
+        index = 0
+        for other in self.blocks:
+            if other is block:
+                return index + block.index(unit)
+            index += len(other)
+
+    def insert(self, index, unit):
+        """insert unit as the index-th unit"""
+        following = self.following
+        if index < self.count:
+            block, offset = self._locate(index)
+            following[unit] = []
+        else:
+            for block in reversed(self.blocks):
+                if block:
+                    break
+            offset = len(block)
+            if block:  # the last unit's details now follow unit
+                last = block[-1]
+                following[unit], following[last] = following[last], []
+            else:
+                following[unit] = []
+        block.insert(offset, unit)
+        self.block_of[unit] = block
+        self.count += 1
+        if len(block) > 2 * self.size:
+            self._split(block)
+
+    def _split(self, block):
+        half = block[len(block) // 2:]
+        del block[len(block) // 2:]
+        for position, other in enumerate(self.blocks):
+            if other is block:
+                self.blocks.insert(position + 1, half)
+                break
+        for unit in half:
+            self.block_of[unit] = half
+
+    def remove(self, unit):
+        """remove unit. Its details stay, after the unit before it"""
+        index = self.rank(unit)
+        details = self.following.pop(unit)
+        if details and index:
+            block, offset = self._locate(index - 1)
+            self.following[block[offset]].extend(details)
+        elif details:
+            self.leading.extend(details)
+        self.block_of.pop(unit).remove(unit)
+        self.count -= 1
+
+    def children(self):
+        """return list of units and details, in order"""
+        children = list(self.leading)
+        following = self.following
+        for unit in self:
+            children.append(unit)
+            children.extend(following[unit])
+        return children
+
+    def layout(self):
+        """return list of (k, detail) for each detail, where k is the
+        number of units before it
+        """
+        layout = [(0, detail) for detail in self.leading]
+        following = self.following
+        for k, unit in enumerate(self, 1):
+            layout.extend((k, detail) for detail in following[unit])
+        return layout
+
+
+def _lay_out(units, details):
+    """return children list of units with each (k, detail) placed after
+    k units
+    """
+    children = []
+    details = sorted(enumerate(details), key=lambda x: (x[1][0], x[0]))
+    details = [detail for _, detail in details]
+    d = 0
+    for k in range(len(units) + 1):
+        while d < len(details) and (details[d][0] <= k or
+                                    k == len(units)):
+            children.append(details[d][1])
+            d += 1
+        if k < len(units):
+            children.append(units[k])
+    return children
+
+
+def _layout_of(children, is_unit, describe):
+    """return list of (k, description) for each detail in children,
+    where k is the number of units before the detail
+    """
+    layout = []
+    k = 0
+    for child in children:
+        if is_unit(child):
+            k += 1
+        else:
+            layout.append((k, describe(child)))
+    return layout
+
+
+def _is_entry_unit(entry):
+    """return whether entry of a simulated children list is a unit"""
+    return entry[0] == 'unit'
+
+
+def _stable(sequence):
+    """return set of items forming the longest increasing subsequence
+    of sequence, a list of (key, item)
+    """
+    tails, tail_items, previous = [], [], {}
+    for key, item in sequence:
+        i = bisect.bisect_left(tails, key)
+        previous[item] = tail_items[i - 1] if i else None
+        if i == len(tails):
+            tails.append(key)
+            tail_items.append(item)
+        else:
+            tails[i] = key
+            tail_items[i] = item
+    stable = set()
+    item = tail_items[-1] if tail_items else None
+    while item is not None:
+        stable.add(item)
+        item = previous[item]
+    return stable
+
+
+class Matching:
+    """Match the units of new tree to units of old tree: by ID first,
+    then by structure. Subtrees with equal content_hash are matched
+    implicitly and not visited.
+    """
+
+    def __init__(self, old, new):
+        self.old, self.new = old, new
+        self.pairs = {new: old}  # new unit -> old unit
+        self.identical = set()  # new units whose subtree is unchanged
+        self.deleted = []  # old units with no match in new
+        self._match_by_id()
+        self._match_by_structure()
+
+    def _match_by_id(self):
+        old_loose, new_loose = [], []
+        stack = [(self.old, self.new)]
+        while stack:
+            old, new = stack.pop()
+            if old.content_hash() == new.content_hash():
+                self.identical.add(new)
+                continue
+            old_children = {_unit_id(c): c for c in _node_children(old)}
+            for child in _node_children(new):
+                match = old_children.pop(_unit_id(child), None)
+                if match is None:
+                    new_loose.append(child)
+                else:
+                    self.pairs[child] = match
+                    stack.append((match, child))
+            old_loose.extend(old_children.values())
+        # units that moved, were inserted, or were deleted. Index every
+        # unit beneath them, and match those by ID
+        old_index = {}
+        for unit in self._units_beneath(old_loose):
+            old_index[_unit_id(unit)] = unit
+        for unit in self._units_beneath(new_loose):
+            match = old_index.pop(_unit_id(unit), None)
+            if match is not None:
+                self.pairs[unit] = match
+        self._unmatched_old = set(old_index.values())
+
+    def _match_by_structure(self):
+        """pair unmatched new units with unmatched old units beneath
+        matched parents, if their tag and TEXT are the same
+        """
+        queue = list(self.pairs.items())
+        while queue:
+            new, old = queue.pop()
+            if new in self.identical:
+                continue
+            candidates = [
+                c for c in _node_children(old) if c in self._unmatched_old
+            ]
+            for child in _node_children(new):
+                if child in self.pairs or not candidates:
+                    continue
+                key = (child.tag, child.attrib.get('TEXT'))
+                for candidate in candidates:
+                    if (candidate.tag, candidate.attrib.get('TEXT')) == key:
+                        candidates.remove(candidate)
+                        self._unmatched_old.discard(candidate)
+                        self.pairs[child] = candidate
+                        queue.append((child, candidate))
+                        break
+        matched_old = set(self.pairs.values())
+        for old in self._unmatched_old:
+            if old._parent in matched_old:
+                self.deleted.append(old)
+
+    @staticmethod
+    def _units_beneath(units):
+        stack = list(units)
+        while stack:
+            unit = stack.pop()
+            yield unit
+            stack.extend(_node_children(unit))
+
+    def changed_units(self):
+        """yield new units in changed part of new tree, parents first"""
+        stack = [self.new]
+        while stack:
+            unit = stack.pop()
+            if unit in self.identical:
+                continue
+            yield unit
+            stack.extend(reversed(_node_children(unit)))
+
+    def ref(self, new_unit):
+        """return ID by which new_unit is known in the old tree"""
+        old = self.pairs.get(new_unit)
+        if old is self.old:
+            return None
+        if old is not None:
+            return _unit_id(old)
+        return _unit_id(new_unit)
+
+
+class _Differ:
+    """build the edit script turning old into new"""
+
+    def __init__(self, old, new):
+        self.matching = Matching(old, new)
+        self.old_units = {None: old}  # ref -> old element
+        self.layouts = {}  # ref -> _Children of (kind, value) entries
+        self.parent_of = {}  # ref -> ref of current (simulated) parent
+        self.structure, self.deletes, self.contents = [], [], []
+
+    def script(self):
+        matching = self.matching
+        changed = list(matching.changed_units())
+        for new in changed:
+            self._place_children(new)
+        for old in matching.deleted:
+            ref = _unit_id(old)
+            parent = self.parent_of.get(ref, self._old_ref(old._parent))
+            self._layout(parent).remove(('unit', ref))
+            self.deletes.append({'op': 'delete', 'id': ref})
+        attrib_ops = []
+        for new in changed:
+            old = matching.pairs.get(new)
+            self._compare_details(new)
+            if old is None or old.content_hash() == new.content_hash():
+                continue
+            self._compare_attributes(old, new)
+            attrib_op = self._compare_attrib(old, new)
+            if attrib_op:
+                attrib_ops.append(attrib_op)
+        return self.structure + self.deletes + self.contents + attrib_ops
+
+    def _old_ref(self, old):
+        if old is self.matching.old:
+            return None
+        return _unit_id(old)
+
+    def _layout(self, ref):
+        """return simulated children of unit ref, creating it from the
+        old tree if needed
+        """
+        if ref not in self.layouts:
+            old = self.old_units[ref]
+            self.layouts[ref] = _Children([
+                ('unit', _unit_id(c)) if _is_unit(c) else ('detail', c)
+                for c in old.children
+            ], _is_entry_unit)
+        return self.layouts[ref]
+
+    def _place_children(self, new):
+        matching = self.matching
+        parent = matching.ref(new)
+        old = matching.pairs.get(new)
+        if old is None:
+            self.layouts[parent] = _Children(
+                [('detail', c) for c in _details(new)], _is_entry_unit
+            )
+        else:
+            self.old_units[parent] = old
+        layout = self._layout(parent)
+        children = _node_children(new)
+        target = [matching.ref(child) for child in children]
+        index_in_target = {ref: i for i, ref in enumerate(target)}
+        stable = _stable([
+            (index_in_target[ref], ref) for _, ref in layout
+            if ref in index_in_target
+        ])
+        for i, (ref, child) in enumerate(zip(target, children)):
+            if ref in stable:
+                continue
+            if child in matching.pairs:
+                source = self.parent_of.get(ref)
+                if source is None and ref not in self.parent_of:
+                    source = self._old_ref(matching.pairs[child]._parent)
+                    self.old_units.setdefault(
+                        source, matching.pairs[child]._parent
+                    )
+                self._layout(source).remove(('unit', ref))
+            index = layout.rank(('unit', target[i - 1])) + 1 if i else 0
+            layout.insert(index, ('unit', ref))
+            self.parent_of[ref] = parent
+            stable.add(ref)
+            if child in matching.pairs:
+                self.old_units[ref] = matching.pairs[child]
+                self.structure.append({
+                    'op': 'move', 'id': ref, 'parent': parent, 'index': index
+                })
+            else:
+                self.old_units[ref] = child
+                self.structure.append({
+                    'op': 'insert', 'parent': parent, 'index': index,
+                    'node': dump(child, nodes=False),
+                })
+
+    def _compare_details(self, new):
+        ref = self.matching.ref(new)
+        if ref not in self.layouts:
+            return  # children of unit were never touched
+        current = [(k, entry[1].content_hash())
+                   for k, entry in self.layouts[ref].layout()]
+        describe = lambda child: child.content_hash()
+        wanted = _layout_of(new.children, _is_unit, describe)
+        if current == wanted:
+            return
+        children = [[k, dump(detail)] for k, detail in
+                    _layout_of(new.children, _is_unit, lambda c: c)]
+        self.contents.append({'op': 'details', 'id': ref,
+                              'children': children})
+
+    def _compare_attributes(self, old, new):
+        old_items = [[_text(k), _text(v)] for k, v in
+                     getattr(old, '_attribute', {}).items()]
+        new_items = [[_text(k), _text(v)] for k, v in
+                     getattr(new, '_attribute', {}).items()]
+        if old_items != new_items:
+            self.contents.append({'op': 'attributes',
+                                  'id': self.matching.ref(new),
+                                  'items': new_items})
+
+    def _compare_attrib(self, old, new):
+        old_attrib = {_text(k): _text(v) for k, v in old.attrib.items()}
+        new_attrib = {_text(k): _text(v) for k, v in new.attrib.items()}
+        changed = {
+            key: value for key, value in new_attrib.items()
+            if old_attrib.get(key) != value
+        }
+        deleted = [key for key in old_attrib if key not in new_attrib]
+        if changed or deleted:
+            return {'op': 'attrib', 'id': self.matching.ref(new),
+                    'set': changed, 'delete': deleted}
+
+
+def diff(old, new):
+    """Return edit script (list of json-serialisable dicts) that turns
+    old into new when applied with patch(old, script). See module
+    documentation for the script format. Duplicate node IDs within
+    either tree are not supported.
+
+    :param old: pymm element (usually a Mindmap) of previous version
+    :param new: pymm element of new version
+    """
+    observe.track(old)  # so that each element's _parent is exact
+    observe.track(new)
+    return _Differ(old, new).script()
+
+
+def patch(tree, script):
+    """Apply edit script created by diff to tree, modifying it in place.
+
+    :param tree: pymm element to modify (the old tree given to diff, or
+                 an element with the same content)
+    :param script: list of edit operations returned by diff
+    :return: tree
+    """
+    observe.track(tree)  # so that each element's _parent is exact
+    units = {None: tree}
+    stack = [tree]
+    while stack:
+        unit = stack.pop()
+        children = _node_children(unit)
+        units.update((_unit_id(child), child) for child in children)
+        stack.extend(children)
+    pending = {}  # parent: _Children, changed by insert and move ops
+    placed = {}  # unit: parent it was moved or inserted into
+
+    def children_of(parent):
+        if parent not in pending:
+            pending[parent] = _Children(parent.children, _is_unit)
+        return pending[parent]
+
+    # runs of insert and move ops are applied to _Children, and the
+    # changed children lists replaced once the run ends
+    for position, op in enumerate(script):
+        kind = op['op']
+        if kind == 'insert' or kind == 'move':
+            if not pending:  # decode the inserts of the run at once
+                inserted = iter(_load_all(_run_inserts(script, position)))
+            if kind == 'insert':
+                unit = next(inserted)
+                units[_unit_id(unit)] = unit
+            else:
+                unit = units[op['id']]
+                children_of(placed.get(unit, unit._parent)).remove(unit)
+            parent = units[op['parent']]
+            children_of(parent).insert(op['index'], unit)
+            placed[unit] = parent
+            continue
+        for parent, children in pending.items():
+            parent.children[:] = children.children()
+        pending.clear()
+        placed.clear()
+        if kind == 'delete':
+            unit = units[op['id']]
+            unit._parent.children.remove(unit)
+        elif kind == 'details':
+            unit = units[op['id']]
+            loaded = _load_all([payload for _, payload in op['children']])
+            details = [(k, detail) for (k, _), detail in
+                       zip(op['children'], loaded)]
+            unit.children[:] = _lay_out(_node_children(unit), details)
+        elif kind == 'attributes':
+            unit = units[op['id']]
+            for name in list(unit):
+                del unit[name]
+            for name, value in op['items']:
+                unit[name] = value
+        elif kind == 'attrib':
+            unit = units[op['id']]
+            match = factory.DefaultAttribFactory.match_attrib_value_to_spec
+            for key in op['delete']:
+                del unit.attrib[key]
+            for key, value in op['set'].items():
+                unit.attrib[key] = match(key, value, unit.spec, unit.tag)
+            if op['id'] is not None and 'ID' in op['set']:
+                units[unit.attrib['ID']] = units.pop(op['id'])
+        else:
+            raise ValueError('unknown edit operation: ' + str(kind))
+    for parent, children in pending.items():
+        parent.children[:] = children.children()
+    return tree
+
+
+def _run_inserts(script, position):
+    """return payloads of the insert ops in the run of insert and move
+    ops starting at position of script
+    """
+    payloads = []
+    for op in script[position:]:
+        if op['op'] == 'insert':
+            payloads.append(op['node'])
+        elif op['op'] != 'move':
+            break
+    return payloads
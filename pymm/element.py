@@ -34,16 +34,63 @@ from uuid import uuid4
 import warnings
 import re
 import copy
-import html
 import types
+import hashlib
 import collections
 from . import access
-from . import decode
-from . import encode
+from . import observe
+from .convert import decode, encode
 from .registry import ElementRegistry as registry
 # http://freeplane.sourceforge.net/wiki/index.php/Current_Freeplane_File_Format
 
 
+#: element attributes that are part of an element's content hash. Setting
+#: any of them (or attrib / children) invalidates the hash
+_content_attributes = frozenset(('tag', '_text', '_tail', '_attribute'))
+
+#: types of attrib values whose encoded form may be remembered
+_immutable = frozenset((str, int, float, bool))
+
+
+def _digest(elem):
+    """return hash of elem's own content and its children's hashes. The
+    children's hashes must already be computed
+    """
+    def text(value):
+        if isinstance(value, BaseElement):
+            value = value.attrib.get('ID', '')
+        return str(value)
+
+    content = [elem.tag, (elem._text or '').strip(),
+               (elem._tail or '').strip()]
+    for key in sorted(elem.attrib, key=str):
+        content.append(text(key) + '=' + text(elem.attrib[key]))
+    content.append('')  # separate attrib from node attributes
+    for key, value in getattr(elem, '_attribute', {}).items():
+        content.append(text(key) + '=' + text(value))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('\0'.join(content).encode('utf-8', 'surrogatepass'))
+    for child in elem.children:
+        digest.update(child._hash)
+    return digest.digest()
+
+
+def _new_id():
+    """return a new, unique node ID"""
+    return 'ID_' + str(uuid4().time).replace('L', '')
+
+
+def _tag_filter(tag):
+    """return set of tags to match during traversal, or None to match
+    every element. tag may be a string or a collection of strings
+    """
+    if tag is None:
+        return None
+    if isinstance(tag, str):
+        return {tag}
+    return set(tag)
+
+
 class BaseElement(metaclass=registry):
     """pymm's Base Element. All other elements inherit from BaseElement, which
     represents an element in a similar style to xml.etree.ElementTree with
@@ -112,6 +159,31 @@ class BaseElement(metaclass=registry):
     #: entries / types in a list: [str, int, 'thin', etc.]
     spec = {}
 
+    #: watchers (see pymm.observe.Watcher), such as indexes, that are
+    #: notified when this element's text, attrib or children (the latter
+    #: two once tracked) or a Node's attributes are changed. An element
+    #: has no watchers unless one adds itself here
+    _watchers = ()
+
+    #: the element whose children list holds this element, or None. It is
+    #: kept up-to-date by the children list of a tracked parent (see
+    #: pymm.observe.track). Otherwise it is set when the element is decoded,
+    #: encoded, cloned or unpacked, and may be out of date if it has been
+    #: moved since
+    _parent = None
+
+    #: True once self is tracked (see pymm.observe.track): its attrib and
+    #: children are observed, and so are those of all its sub-children
+    _tracked = False
+
+    #: {key: value, or (value, encoded text)} of attrib values that have
+    #: been checked against spec, or None. See _remembered_encoding
+    _encoded = None
+
+    #: cached content_hash of this element, or None if this element or
+    #: any of its sub-children changed since it was last computed
+    _hash = None
+
     def __new__(cls, *args, **attrib):
         """There are a few class-wide mutable attributes that are meant to be
         changed in each instance: children and attrib. Copy children and
@@ -121,29 +193,267 @@ class BaseElement(metaclass=registry):
         instances of that element.
         """
         self = super().__new__(cls)
-        self.children = copy.copy(self.children)
-        self.attrib = copy.deepcopy(self.attrib)
+        state = self.__dict__
+        state['children'] = list(self.children)
+        state['attrib'] = copy.deepcopy(self.attrib)
         return self
 
     def __init__(self, **attrib):
         for key, val in attrib.items():
             self.attrib[key] = val
 
-    def tostring(self):
-        """cast element to full string. html-safe attrib, and
-        include all subchildren. Will raise recursion error if
-        subchildren levels > 1024 levels deep. (VERY unlikely)
+    def __setattr__(self, name, value):
+        """wrap a newly assigned attrib dict or children list of a
+        tracked element, so that changes to them are observed (an
+        untracked element gets a plain copy of another element's observed
+        attrib or children). Invalidate the content hash when content
+        (tag, attrib, children, text) is replaced, and tell watchers when
+        text is
+        """
+        if name == 'attrib':
+            if not self._tracked:
+                if type(value) is observe.ObservedAttrib:
+                    value = dict(value)
+            elif type(value) is not observe.ObservedAttrib or \
+                    value._owner is not self:
+                value = observe.ObservedAttrib(self, value)
+        elif name == 'children':
+            if not self._tracked:
+                if type(value) is observe.ObservedChildren:
+                    value = list(value)
+            elif type(value) is not observe.ObservedChildren or \
+                    value._owner is not self:
+                observe._orphan(self, self.__dict__.get('children', ()))
+                value = observe.ObservedChildren(self, value)
+                super().__setattr__(name, value)
+                observe._adopt(self, value)
+                self._children_changed()
+                return
+        elif name not in _content_attributes:
+            super().__setattr__(name, value)
+            return
+        super().__setattr__(name, value)
+        if self._hash is not None:
+            self._invalidate()
+        if name == '_text':
+            for watcher in self._watchers:
+                watcher.text_changed(self)
+
+    def __reduce__(self):
+        """pickle self and its hierarchy in packed form (see
+        pymm.flat.pack), which does not recurse and is far smaller than
+        pickling each element. The parent and watchers are left out, so
+        that pickling an element pickles only its own hierarchy. Attrib
+        values that are elements outside of it are pickled alone
+        """
+        from . import flat
+        return flat.unpack, (flat.pack(self),)
+
+    def __copy__(self):
+        """return shallow copy of self: a new element whose attrib,
+        children and node attributes hold the same values and child
+        elements as self's. The children are not moved: their parent
+        stays self
         """
-        children = (child.tostring() for child in self.children)
-        end = '/>'
-        if self.children:
-            end = '>' + ''.join(children) + '\n</' + self.tag + '>'
-        htmlsafe = lambda x: html.escape(str(x))
-        attrib = (
-            htmlsafe(k) + '="' + htmlsafe(v) + '"' \
-            for k, v in self.attrib.items()
-        )
-        return '\n<' + self.tag + ' ' + ', '.join(attrib) + end
+        duplicate = object.__new__(type(self))
+        state = duplicate.__dict__
+        for name, value in self.__dict__.items():
+            if name in ('_parent', '_watchers', '_hash', '_tracked',
+                        'attrib', 'children'):
+                continue
+            if name in ('_attribute', '_encoded'):
+                value = value.copy()
+            state[name] = value
+        state['attrib'] = dict(self.attrib)
+        state['children'] = list(self.children)
+        return duplicate
+
+    def __deepcopy__(self, memo):
+        """return copy of self and its hierarchy, made in packed form (as
+        when pickling, but keeping the class of each element, even one
+        that another process could not import). Elements of the
+        hierarchy already copied by this deepcopy (as when copying a
+        list of an element and its parent) are replaced by their copies,
+        and the new copies are recorded in memo
+        """
+        from . import flat
+        top = flat.unpack(flat.pack(self, portable=False))
+        stack = [(self, top)]
+        while stack:
+            original, duplicate = stack.pop()
+            memo[id(original)] = duplicate
+            for position, (child, child_copy) in enumerate(
+                    zip(original.children, duplicate.children)):
+                earlier = memo.get(id(child))
+                if earlier is None:
+                    stack.append((child, child_copy))
+                else:
+                    duplicate.children[position] = earlier
+                    earlier._parent = duplicate
+        return top
+
+    def _attrib_changed(self, key):
+        """called by self.attrib after attrib[key] is set or deleted"""
+        if self._hash is not None:
+            self._invalidate()
+        for watcher in self._watchers:
+            watcher.attrib_changed(self, key)
+
+    def _remembered_encoding(self, key, value):
+        """return the encoded form remembered for value of attrib key, or
+        None if there is none or value is not the object it was
+        remembered for. Since a value is recognised by identity, a
+        changed value is never mistaken for the one remembered
+        """
+        encoded = self._encoded
+        if encoded is None:
+            return None
+        entry = encoded.get(key)
+        if entry is value:  # a str that encodes as itself
+            return value
+        if type(entry) is tuple and entry[0] is value:
+            return entry[1]
+        return None
+
+    def _remember_encoding(self, key, value, text):
+        """remember that value of attrib key encodes as text. Only
+        immutable values are remembered, since a change inside a mutable
+        value would not be noticed
+        """
+        if type(value) not in _immutable:
+            return
+        encoded = self._encoded
+        if encoded is None:
+            encoded = self.__dict__['_encoded'] = {}
+        encoded[key] = value if value is text else (value, text)
+
+    def _children_changed(self):
+        """called by self.children after it is modified"""
+        if self._hash is not None:
+            self._invalidate()
+        for watcher in self._watchers:
+            watcher.children_changed(self)
+
+    def _invalidate(self):
+        """mark content hash of self and its ancestors as out of date.
+        Stops at the first ancestor already out of date, since all of its
+        ancestors must also be out of date
+        """
+        elem = self
+        while elem is not None and elem._hash is not None:
+            elem._hash = None
+            elem = elem._parent
+
+    def content_hash(self):
+        """Return hash (16 bytes) of the content of self and all its
+        sub-children: tag, attrib, node attributes, stripped text, and
+        the hash of each child in order. Hashes are cached on each element
+        and only recomputed for elements that changed (and their
+        ancestors) since the last call, so comparing or re-checking a
+        large, mostly unchanged tree is cheap. The hash does not depend on
+        attrib order, and is stable across processes.
+
+        The first call tracks self (see pymm.observe.track), so that
+        changes beneath it are noticed from then on. Elements that are
+        never hashed do not pay for this.
+        """
+        if self._hash is not None:
+            return self._hash
+        observe.track(self)
+        stack = [(self, False)]
+        while stack:
+            elem, children_hashed = stack.pop()
+            if elem._hash is not None:
+                continue
+            if children_hashed:
+                elem._hash = _digest(elem)
+                continue
+            stack.append((elem, True))
+            stack.extend(
+                (child, False) for child in elem.children
+                if child._hash is None
+            )
+        return self._hash
+
+    def same_content(self, other):
+        """return True if other has the same content (see content_hash)
+        as self
+        """
+        return self.content_hash() == other.content_hash()
+
+    def clone(self, new_ids=True):
+        """Return a copy of self and all its sub-children. Unlike
+        copy.deepcopy, clone does not recurse, and it shares attrib values
+        and text rather than copying them: attrib, children, and node
+        attributes are copied shallowly. If new_ids, each cloned element
+        with an ID gets a new ID, and each Arrow DESTINATION or LINK
+        within the clone that referred to an element within self is
+        updated to refer to the clone of that element. References to
+        elements outside of self are left unchanged.
+
+        :param new_ids: give cloned elements new IDs (default True), so
+                        that the clone can be added to the same mindmap
+        :return: the cloned element
+        """
+        remap = {}  # old ID: new ID
+        clones = {}  # id(old element): cloned element
+        referring = []  # cloned elements with DESTINATION or LINK
+        top = None
+        stack = [(self, None)]
+        while stack:
+            elem, parent = stack.pop()
+            duplicate = object.__new__(type(elem))
+            state = duplicate.__dict__
+            for name, value in elem.__dict__.items():
+                if name in ('_parent', '_watchers', '_tracked', '_hash',
+                            'attrib', 'children'):
+                    continue
+                if name in ('_attribute', '_encoded'):
+                    value = value.copy()
+                state[name] = value
+            attrib = state['attrib'] = dict(elem.attrib)
+            state['children'] = []
+            if new_ids and 'ID' in attrib:
+                new_id = _new_id()
+                remap[attrib['ID']] = new_id
+                attrib['ID'] = new_id
+            clones[id(elem)] = duplicate
+            if 'DESTINATION' in attrib or 'LINK' in attrib:
+                referring.append(duplicate)
+            if parent is None:
+                top = duplicate
+            else:
+                parent.children.append(duplicate)
+                state['_parent'] = parent
+            stack.extend((child, duplicate) for child in
+                         reversed(elem.children))
+        for duplicate in referring:
+            attrib = duplicate.attrib
+            for key in ('DESTINATION', 'LINK'):
+                value = attrib.get(key)
+                if isinstance(value, BaseElement):
+                    value = clones.get(id(value), value)
+                elif isinstance(value, str) and new_ids:
+                    if value in remap:
+                        value = remap[value]
+                    elif value[:1] == '#' and value[1:] in remap:
+                        value = '#' + remap[value[1:]]
+                else:
+                    continue
+                attrib[key] = value
+        return top
+
+    def tostring(self, pretty=False):
+        """cast element to full xml string, including all subchildren.
+        Element is encoded through the normal factories (see
+        pymm.tostring), and does not recurse. Unlike pymm.tostring, no
+        pre_encode or post_encode hooks are run, so the tree is left as
+        it is, and attrib values are not checked against spec
+        """
+        from . import factory, serialize
+        handler = factory.ConversionHandler(validation='off')
+        et_elem = handler.convert_queue(self, True)
+        return serialize.tostring(et_elem, encoding='unicode', pretty=pretty)
 
     def __str__(self):
         """Construct string representation of self. Configured to display
@@ -166,6 +476,97 @@ class BaseElement(metaclass=registry):
             ellipses = ''
         return '<' + shorter + ellipses + ' @' + hex(id(self)) + '>'
 
+    def iter_preorder(self, prune=None, tag=None):
+        """Iterate self and all sub-children, each parent before its
+        children (depth-first). Does not recurse, so works on trees of any
+        depth, keeping only an (element, index) pair per level of the
+        tree.
+
+        Children are read from each element's live children list as they
+        are reached, so the caller may change the children of the element
+        just yielded. Changing the children of its ancestors may skip or
+        repeat elements
+
+        :param prune: optional function called with each element. If it
+                      returns True, the element's children are skipped
+                      (e.g. lambda e: e.attrib.get('FOLDED') skips the
+                      children of folded nodes)
+        :param tag: optional tag or collection of tags. Only elements
+                    with a matching tag are yielded, but all elements are
+                    still traversed
+        :return: generator of (parent, element, depth) tuples. self is
+                 yielded first as (None, self, 0)
+        """
+        tags = _tag_filter(tag)
+        if tags is None or self.tag in tags:
+            yield None, self, 0
+        if prune is not None and prune(self):
+            return
+        stack = [(self, 0)]  # (element, index of its next child)
+        while stack:
+            parent, index = stack[-1]
+            if index >= len(parent.children):
+                stack.pop()
+                continue
+            stack[-1] = (parent, index + 1)
+            elem = parent.children[index]
+            if tags is None or elem.tag in tags:
+                yield parent, elem, len(stack)
+            if prune is None or not prune(elem):
+                stack.append((elem, 0))
+
+    def iter_postorder(self, prune=None, tag=None):
+        """Iterate self and all sub-children, each parent after its
+        children (depth-first). Does not recurse, so works on trees of any
+        depth, keeping only an (element, index) pair per level of the
+        tree. Accepts the same prune and tag arguments as iter_preorder.
+
+        Children are read from each element's live children list as they
+        are reached, so the caller may change the element just yielded,
+        or replace it in its parent's children (its own children have all
+        been yielded already). Inserting or removing children of its
+        ancestors may skip or repeat elements
+
+        :return: generator of (parent, element, depth) tuples. self is
+                 yielded last as (None, self, 0)
+        """
+        tags = _tag_filter(tag)
+        # index is None for a pruned element, whose children are skipped
+        stack = [(self, None if prune is not None and prune(self) else 0)]
+        while stack:
+            elem, index = stack[-1]
+            if index is None or index >= len(elem.children):
+                stack.pop()
+                if tags is None or elem.tag in tags:
+                    parent = stack[-1][0] if stack else None
+                    yield parent, elem, len(stack)
+                continue
+            stack[-1] = (elem, index + 1)
+            child = elem.children[index]
+            pruned = prune is not None and prune(child)
+            stack.append((child, None if pruned else 0))
+
+    def iter_breadth_first(self, prune=None, tag=None):
+        """Iterate self and all sub-children level by level: self, then
+        all children of self, then all of their children, etc. Each
+        element's children are read after the element has been yielded, so
+        the caller may modify them first. Accepts the same prune and tag
+        arguments as iter_preorder. Memory used is proportional to the
+        widest level of the tree
+
+        :return: generator of (parent, element, depth) tuples. self is
+                 yielded first as (None, self, 0)
+        """
+        tags = _tag_filter(tag)
+        queue = collections.deque([(None, [self], 0)])
+        while queue:
+            parent, children, depth = queue.popleft()
+            for elem in children:
+                if tags is None or elem.tag in tags:
+                    yield parent, elem, depth
+                if prune is None or not prune(elem):
+                    queue.append((elem, list(elem.children), depth + 1))
+
     def findall(self, **identifier):
         """Return all child elements matching key parameters.
 
@@ -220,6 +621,9 @@ class ImplicitNodeAttributes:
 
     def __setitem__(self, key, val):
         self._attribute[key] = val
+        self._invalidate()
+        for watcher in self._watchers:
+            watcher.attribute_changed(self, key)
 
     def __getitem__(self, key):
         return self._attribute[key]
@@ -232,6 +636,9 @@ class ImplicitNodeAttributes:
 
     def __delitem__(self, key):
         del self._attribute[key]
+        self._invalidate()
+        for watcher in self._watchers:
+            watcher.attribute_changed(self, key)
 
     def items(self):
         """ Like a dictionary's .items() method, return a list of (key, value)
@@ -286,7 +693,7 @@ class Node(ImplicitNodeAttributes, BaseElement):
         return self
 
     def __init__(self, **attrib):
-        self.attrib['ID'] = 'ID_' + str(uuid4().time).replace('L', '')
+        self.attrib['ID'] = _new_id()
         super().__init__(**attrib)
 
     def __str__(self):
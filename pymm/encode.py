@@ -7,10 +7,11 @@
     allowed is limited but powerful enough to allow custom exporting
     of mindmaps
 """
+from .decode import Unclaimed
 
-# unclaimed is the dictionary of functions decorated, and their
-# keyword-used in decorating them. For example, 'post_encode': fxn
-unclaimed = {}
+# unclaimed holds the functions decorated, and their keyword-used in
+# decorating them. For example, 'post_encode': fxn
+unclaimed = Unclaimed()
 
 
 def pre_encode(fxn):
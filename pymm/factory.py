@@ -4,53 +4,164 @@ where to specify how the encoding and decoding of an element is handled. Attrib
 encoding/decoding is handled here as well
 """
 import xml.etree.ElementTree as ET
+import collections
 import warnings
 import copy
 import re
 import types
 from . import element
+from . import stats as pymm_stats
+from .validate import MODES, SpecWarning, ValidationReport
 from .registry import FactoryRegistry as registry
 
 
-def decode(elem):
+def decode(elem, stats=None, validation='lenient'):
     """This is the general function to call when you wish to decode an
     element and all its children and sub-children.
     Decode in this context means to convert from xml.etree.ElementTree
     elements to pymm elements.
     Typically this is called by pymm.read()
+    Pass a pymm.stats.ConversionStats as stats to record timings/counts.
+    validation is 'lenient', 'strict' or 'off' (see pymm.validate)
     """
-    converter = ConversionHandler()
+    converter = ConversionHandler(stats, validation=validation)
     return converter.convert_element_hierarchy(elem, 'decode')
 
 
-def encode(elem):
+def encode(elem, stats=None, validation='lenient'):
     """This is the general function to call when you wish to encode an
     element and all its children and sub-children.
     Encode in this context means to convert from pymm elements to
     xml.etree.ElementTree elements.
     Typically this is called by pymm.write()
+    Pass a pymm.stats.ConversionStats as stats to record timings/counts.
+    validation is 'lenient', 'strict' or 'off' (see pymm.validate)
     """
-    converter = ConversionHandler()
+    converter = ConversionHandler(stats, validation=validation)
     return converter.convert_element_hierarchy(elem, 'encode')
 
 
+def _label(elem):
+    """return tag of pymm or xml.etree element, with its ID if it has
+    one, for use in a ConversionTrace path
+    """
+    tag = str(getattr(elem, 'tag', type(elem).__name__))
+    element_id = getattr(elem, 'attrib', {}).get('ID')
+    if element_id is None:
+        return tag
+    return tag + '[' + str(element_id) + ']'
+
+
+class TraceRecord(collections.namedtuple(
+        'TraceRecord', ('event', 'factory', 'tag', 'path'))):
+    """one element handled during conversion: the event (decode, encode,
+    pre_encode, post_encode or post_decode), the factory class used, the
+    element's tag, and its path from the top element, such as
+    map/node[ID_1]/edge
+    """
+
+    def __str__(self):
+        return (self.event + ' ' + self.path + ' with ' +
+                getattr(self.factory, '__name__', str(self.factory)))
+
+
+class ConversionTrace:
+    """Fixed-size record of the most recent elements handled during one
+    conversion, so that a conversion error can point at the failing
+    element. Memory use does not depend on the size of the tree: only
+    the last size records are kept, and each record's path is built from
+    the pymm hierarchy when it is read.
+
+    :param size: number of records to keep
+    """
+
+    def __init__(self, size=16):
+        self._records = collections.deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, event, factory_class, tag, anchor, leaf=None):
+        """record that factory_class handled an element for event. The
+        element's path is that of pymm element anchor, followed by leaf
+        (the label of an element not yet decoded) if given
+        """
+        self._records.append((event, factory_class, tag, anchor, leaf))
+
+    @staticmethod
+    def _build(event, factory_class, tag, anchor, leaf):
+        """return TraceRecord of a recorded entry"""
+        labels = [] if leaf is None else [leaf]
+        while anchor is not None:
+            labels.append(_label(anchor))
+            anchor = anchor._parent
+        path = '/'.join(reversed(labels))
+        return TraceRecord(event, factory_class, tag, path)
+
+    def __iter__(self):
+        """iterate TraceRecords, oldest first"""
+        for entry in self._records:
+            yield self._build(*entry)
+
+    @property
+    def last(self):
+        """most recent TraceRecord, or None"""
+        if not self._records:
+            return None
+        return self._build(*self._records[-1])
+
+    def format(self):
+        """return records as text, most recent last"""
+        return '\n'.join(str(record) for record in self)
+
+    def annotate(self, error):
+        """attach this trace to error (as error.conversion_trace) and
+        describe the failing element in the error's notes
+        """
+        error.conversion_trace = self
+        last = self.last
+        if last is not None and hasattr(error, 'add_note'):
+            error.add_note('while converting element: ' + str(last))
+
+
 class ConversionHandler:
     """Handle conversion of element and its children hierarchy. Will
     fully encode or decode a hierarchical tree of elements in a non-
-    recursive manner (to avoid python recursion limits). Keep track of
-    last-used factory-classes during encode/decode so that conversion
+    recursive manner (to avoid python recursion limits). Keep a trace of
+    recently converted elements (see ConversionTrace) so that conversion
     errors may be traceable
     """
-    last_encode = []
-    last_decode = []
 
-    def __init__(self):
+    def __init__(self, stats=None, trace_size=16, validation='lenient'):
         """Lock in set of factories for handling elements. If you
         create another element after instantiating ConversionHandler,
         get another instance to auto-generate a factory for that
-        element. Otherwise, DefaultFactory will be used
+        element. Otherwise, DefaultFactory will be used.
+        All state of a conversion is kept on its ConversionHandler, so
+        separate conversions may run in separate threads at once.
+        If stats (a pymm.stats.ConversionStats) is given, record phase
+        timings and element/hook counts in it.
+        Attrib values that do not match spec are collected in
+        spec_report (a validate.ValidationReport), which is handled
+        according to validation ('lenient', 'strict' or 'off') once the
+        conversion completes
         """
-        self.factories = registry.get_factories()
+        if validation not in MODES:
+            raise ValueError('validation mode must be one of ' +
+                             str(MODES))
+        self.factories = registry.snapshot()
+        self.stats = stats
+        self.trace = ConversionTrace(trace_size)
+        self.validation = validation
+        self.spec_report = ValidationReport(
+            max_locations=0 if validation == 'off' else 10,
+            where=self.location,
+        )
+
+    def location(self):
+        """return path of the element being converted, or None"""
+        last = self.trace.last
+        return None if last is None else last.path
 
     def find_encode_factory(self, elem):
         """return factory to handle given element. Since at init time
@@ -82,23 +193,49 @@ class ConversionHandler:
         will be completely converted before its children begin the
         process
         """
+        stats = self.stats
         is_encoding = False
         if convert == 'encode':
             if not isinstance(elem, element.BaseElement):
                 raise TypeError('cannot encode non-pymm element')
             is_encoding = True
-            self.last_encode.clear()
-            self.convert_notify(elem, 'pre_encode')
         elif convert == 'decode':
             if isinstance(elem, element.BaseElement):
                 raise TypeError('cannot decode pymm element')
-            self.last_decode.clear()
         else:
             raise ValueError('pass in "decode" or "encode"')
-        queue = [(None, [elem])]  # parent, children
+        try:
+            if is_encoding:
+                with pymm_stats.phase(stats, 'pre_encode'):
+                    self.convert_notify(elem, 'pre_encode')
+            with pymm_stats.phase(stats, convert):
+                root = self.convert_queue(elem, is_encoding)
+            if is_encoding:
+                with pymm_stats.phase(stats, 'post_encode'):
+                    self.convert_notify(elem, 'post_encode')
+            else:
+                with pymm_stats.phase(stats, 'post_decode'):
+                    self.convert_notify(root, 'post_decode')
+        except Exception as error:
+            self.trace.annotate(error)
+            raise
+        report = self.spec_report
+        if stats is not None:
+            stats.spec_mismatches += report.count
+        report.handle(self.validation)
+        return root
+
+    def convert_queue(self, elem, is_encoding):
+        """convert element and its hierarchy, breadth-first, returning
+        the converted element
+        """
+        stats = self.stats
+        record = self.trace.record
+        spec_report = self.spec_report
+        queue = collections.deque([(None, [elem])])  # parent, children
         root = None
         while queue:
-            parent, children = queue.pop(0)
+            parent, children = queue.popleft()
             if root is None and parent is not None:
                 root = parent
             for child in children:
@@ -107,23 +244,28 @@ class ConversionHandler:
                         raise TypeError('cannot encode non-pymm element')
                     factory_class = self.find_encode_factory(child)
                     factory = factory_class()
+                    factory.spec_report = spec_report
+                    record('encode', factory_class, child.tag, child)
+                    if stats is not None:
+                        stats.count(child.tag, factory_class)
                     child, grandchildren = factory.encode(parent, child)
-                    self.last_encode.append(factory_class)
                 else:
                     if isinstance(child, element.BaseElement):
                         raise TypeError('cannot decode pymm element')
                     factory_class = self.find_decode_factory(child)
                     factory = factory_class()
+                    factory.spec_report = spec_report
+                    record('decode', factory_class, child.tag, parent,
+                           _label(child))
+                    if stats is not None:
+                        stats.count(child.tag, factory_class)
                     child, grandchildren = factory.decode(parent, child)
-                    self.last_decode.append(factory_class)
+                    if child is not None and parent is not None:
+                        child._parent = parent  # for traces; see _parent
                 # if convert fxn returns no decoded child, drop from hierarchy
                 if child is not None:
                     grandchildren = list(grandchildren)
                     queue.append((child, grandchildren))
-        if is_encoding:
-            self.convert_notify(elem, 'post_encode')
-        else:
-            self.convert_notify(root, 'post_decode')
         return root
 
     def convert_notify(self, elem, alert_type):
@@ -137,20 +279,23 @@ class ConversionHandler:
             pass
         else:
             raise ValueError('must give a post-or-pre encode/decode string')
-        queue = [(None, [elem])]
-        while queue:
-            parent, children = queue.pop(0)
-            for child in children:
-                factory_class = self.find_encode_factory(child)
-                factory = factory_class()
-                default = lambda *x: None
-                conversion_notify = getattr(factory, alert_type, default)
-                conversion_notify(child, parent)
-                # copy prevents .children manipulation from ruining iteration
-                # if child removed itself from .children list, the above
-                # iteration would abort prematurely
-                grandchildren = child.children.copy()
-                queue.append((child, grandchildren))
+        stats = self.stats
+        default = lambda *x: None
+        # each element's children are copied after it is notified, so an
+        # element removing itself from .children does not abort iteration.
+        # Each element is pointed at its parent first, so that traces of
+        # an untracked hierarchy (see BaseElement._parent) are exact
+        for parent, child, _ in elem.iter_breadth_first():
+            if parent is not None:
+                child._parent = parent
+            factory_class = self.find_encode_factory(child)
+            factory = factory_class()
+            conversion_notify = getattr(factory, alert_type, default)
+            if conversion_notify is not default:
+                self.trace.record(alert_type, factory_class, child.tag, child)
+                if stats is not None:
+                    stats.count_hook(alert_type, factory_class)
+            conversion_notify(child, parent)
 
 
 class DefaultElementFactory:
@@ -201,6 +346,11 @@ class DefaultElementFactory:
 class DefaultAttribFactory:
     """expose methods to encode/decode attrib"""
 
+    #: validate.ValidationReport to which attrib values that do not
+    #: match spec are added during a conversion. If None, a SpecWarning is
+    #: issued for each value instead
+    spec_report = None
+
     def decode_attrib(self, attrib, src_element, dst_element_class):
         """Decode attrib (from etree element) to match the spec in
         pymm element. Warn user (but still allow attrib) if attrib
@@ -213,20 +363,24 @@ class DefaultAttribFactory:
             key = self.stringify(key)
             value = self.stringify(value)
             tag = dst_element_class.tag
-            value = self.match_attrib_value_to_spec(key, value, spec, tag)
+            value = self.match_attrib_value_to_spec(
+                key, value, spec, tag, self.spec_report
+            )
             decoded_attrib[key] = value
         return decoded_attrib
 
     @staticmethod
-    def match_attrib_value_to_spec(key, value, spec, tag=''):
+    def match_attrib_value_to_spec(key, value, spec, tag='', report=None):
         """Each pymm element has a .spec dict which specifies expected
         types (such as int or str) or expected values of a given attrib
         key/value pair.  This function attempts to conform the attrib
         value to the expected values/types given by spec.  Aka: convert
         value to expected type or verify that value matches one of
         spec's corresponding values.  If spec does not contain key,
-        return value unaltered.  Generate warning if value matches none
-        of spec's values and/or cannot be cast to available types
+        return value unaltered.  If value matches none of spec's values
+        and/or cannot be cast to available types, add it to report (a
+        validate.ValidationReport), or generate warning if report
+        is None
         """
         if key not in spec:
             return value
@@ -248,8 +402,14 @@ class DefaultAttribFactory:
                 return entry(value)
             except:
                 continue
+        if report is not None:
+            report.add(tag, key, value)
+            return value
         key, val = str(key), str(value)
-        warnings.warn(tag + '-> ' + key + ': ' + val + " doesn't match spec")
+        warnings.warn(
+            tag + '-> ' + key + ': ' + val + " doesn't match spec",
+            SpecWarning
+        )
         return value
 
     def encode_attrib(self, attrib, src_element, dst_element_class):
@@ -258,18 +418,35 @@ class DefaultAttribFactory:
         string. If a particular value in spec is None, the key: value
         will be dropped from the encoded attrib.
 
+        Values that src_element remembers the encoded form of (see
+        BaseElement._remembered_encoding) are not converted again.
+        Values that match spec are remembered for the next encode.
+
         :param mmElement - pymm element containing attrib to be
         encoded
         """
         attrib = {key: val for key, val in attrib.items() if val is not None}
         spec = src_element.spec
+        tag = src_element.tag
+        report = self.spec_report
+        remembered = src_element
+        if report is None or \
+                not isinstance(remembered, element.BaseElement):
+            remembered = None  # mismatches are not tracked; always convert
         encoded_attrib = {}
         for key, value in attrib.items():
-            tag = src_element.tag
-            value = self.match_attrib_value_to_spec(key, value, spec, tag)
-            value = self.stringify(value)
+            text = None
+            if remembered is not None:
+                text = remembered._remembered_encoding(key, value)
+            if text is None:
+                mismatches = report is not None and report.count
+                text = self.stringify(self.match_attrib_value_to_spec(
+                    key, value, spec, tag, report
+                ))
+                if remembered is not None and report.count == mismatches:
+                    remembered._remember_encoding(key, value, text)
             key = self.stringify(key)
-            encoded_attrib[key] = value
+            encoded_attrib[key] = text
         return encoded_attrib
 
     def stringify(self, arg):
@@ -336,14 +513,31 @@ class DefaultFactory(
         get_attrib, decode_attrib, get_children, decode_element
         """
         dst_element = self.decoding_element
+        report = self.spec_report
+        mismatches = report is not None and report.count
         unaltered_attrib = self.decode_getattrib(src_element)
         attrib = self.decode_attrib(unaltered_attrib, src_element, dst_element)
         children = self.decode_getchildren(src_element)
         elem = self.decode_element(
             parent, src_element, dst_element, attrib, children
         )
+        if report is not None and report.count == mismatches:
+            self.remember_decoded(elem, unaltered_attrib)
         return elem, children
 
+    @staticmethod
+    def remember_decoded(elem, unaltered_attrib):
+        """remember, as their encoded form, the attrib values of elem
+        that decoding left as the very string read from file. Those
+        encode back to that same string until they are changed
+        """
+        if not isinstance(elem, element.BaseElement):
+            return
+        attrib = elem.attrib
+        for key, text in unaltered_attrib.items():
+            if type(text) is str and attrib.get(key) is text:
+                elem._remember_encoding(key, text, text)
+
     def encode(self, parent, src_element):
         """control encode order from pymm element to xml.etree element.
         Typical encoding order looks like:
@@ -0,0 +1,321 @@
+"""
+    flat converts a pymm element and its hierarchy to and from a packed,
+    picklable form: arrays of class, parent position, tag, text and tail
+    per element, in preorder, with each distinct string stored once in a
+    string table. Unlike pickling elements directly, packing does not
+    recurse, so trees of any depth can be sent between processes, and
+    unpacking bypasses the factories (as clone does), which makes it far
+    cheaper than decoding the tree again. Packed trees are used when
+    pickling elements, by parallel read and write, and by SharedTree.
+
+    Element classes are pickled by reference, so the receiving process
+    must be able to import them; an element of a class that cannot be
+    (such as one defined within a function) is recorded as its nearest
+    base class that can, unless packed for this process only.
+
+    An attrib value that is an element of the same hierarchy becomes an
+    ElementRef to its position. One that is an element outside of it
+    becomes a Detached copy of that element alone (without parent or
+    children), rather than pulling its whole tree into the packed form.
+"""
+import array
+import collections
+import sys
+
+from . import element
+from . import observe
+
+#: element attributes that are not part of an element's own state
+_excluded = frozenset(('_parent', '_watchers', '_hash', '_tracked', '_encoded',
+                       'attrib', 'children'))
+
+
+class ElementRef:
+    """stands in for an attrib value (such as an Arrow's DESTINATION)
+    that refers to the element at position in the same flat tree
+    """
+    __slots__ = ('position',)
+
+    def __init__(self, position):
+        self.position = position
+
+    def __reduce__(self):
+        return ElementRef, (self.position,)
+
+    def __repr__(self):
+        return 'ElementRef(' + str(self.position) + ')'
+
+
+class Detached:
+    """stands in for an attrib value that is an element outside of the
+    flat tree. record holds the element alone, and is rebuilt into a
+    copy of it without parent or children
+    """
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __reduce__(self):
+        return Detached, (self.record,)
+
+    def __repr__(self):
+        return 'Detached(' + self.record[0].__name__ + ')'
+
+
+def _record(elem, parent, portable=True):
+    """return record of elem, with parent position. If portable, its
+    class is one that another process can import (see _pickled_class)
+    """
+    state = {}
+    for name, value in elem.__dict__.items():
+        # indexes (such as a Mindmap's timestamps) watch the original
+        # tree, so they are left out
+        if name in _excluded or isinstance(value, observe.Watcher):
+            continue
+        if name == '_attribute':
+            value = value.copy()
+        state[name] = value
+    encoded = elem._encoded
+    cls = _pickled_class(type(elem)) if portable else type(elem)
+    return (cls, parent, state, dict(elem.attrib),
+            None if encoded is None else dict(encoded))
+
+
+def _detach(elem, portable=True):
+    """return Detached of elem. Its own element attrib values are
+    dropped, as they may lead anywhere
+    """
+    record = _record(elem, -1, portable)
+    attrib = record[3]
+    for key, value in list(attrib.items()):
+        if isinstance(value, element.BaseElement):
+            del attrib[key]
+    return Detached(record)
+
+
+def _build(cls, state, attrib, encoded):
+    """return new element of cls, without parent or children"""
+    elem = object.__new__(cls)
+    elem_state = elem.__dict__
+    elem_state.update(state)
+    if encoded:
+        elem_state['_encoded'] = encoded
+    elem_state['attrib'] = attrib
+    elem_state['children'] = []
+    return elem
+
+
+_stand_ins = (ElementRef, Detached)
+
+
+#: layout of packed hierarchies, checked when unpacking
+PACK_VERSION = 1
+
+#: element attributes held in the arrays of a packed hierarchy, when
+#: they are strings or None
+_packed_state = ('tag', '_text', '_tail')
+
+_importable = {}  # element class: class it is pickled as
+
+
+def _pickled_class(cls):
+    """return cls, or its nearest base class if cls cannot be pickled by
+    reference (such as a class defined within a function), which another
+    process could not import
+    """
+    try:
+        return _importable[cls]
+    except KeyError:
+        pass
+    for base in cls.__mro__:
+        found = sys.modules.get(base.__module__)
+        for name in base.__qualname__.split('.'):
+            found = getattr(found, name, None)
+        if found is base:
+            break
+    _importable[cls] = base
+    return base
+
+
+def pack(elem, portable=True):
+    """return elem and its hierarchy in packed form: a tuple of arrays
+    and tables that pickles far smaller than the elements themselves.
+    It does not recurse, and attrib values that are elements become
+    ElementRefs or Detached copies. If portable, classes
+    that another process could not import are recorded as their nearest
+    base class that it can (see _pickled_class); otherwise each element
+    keeps its own class, for unpacking in this process
+    """
+    classes = []  # distinct classes
+    class_index = {}  # class: position in classes
+    strings = []  # distinct strings
+    string_index = {}  # string: position in strings
+    class_codes = array.array('i')
+    parents = array.array('i')
+    tags = array.array('i')
+    texts = array.array('i')
+    tails = array.array('i')
+    new_attributes = array.array('b')  # 1: has own empty _attribute
+    attrib_sizes = array.array('i')
+    attrib_items = array.array('i')  # key, value code of each attrib item
+    remembered = array.array('b')  # 1: item's value encodes as itself
+    values = []  # attrib values that are not strings
+    states = {}  # position: other state of an element
+    encodings = {}  # position: other remembered encoded values
+    positions = {}  # id(element): position
+    referring = []  # positions in values of elements
+
+    def code(text):
+        """return string table index of text"""
+        index = string_index.get(text)
+        if index is None:
+            index = string_index[text] = len(strings)
+            strings.append(text)
+        return index
+
+    stack = [(elem, -1)]
+    while stack:
+        current, parent = stack.pop()
+        position = len(parents)
+        positions[id(current)] = position
+        cls = type(current)
+        if portable:
+            cls = _pickled_class(cls)
+        index = class_index.get(cls)
+        if index is None:
+            index = class_index[cls] = len(classes)
+            classes.append(cls)
+        class_codes.append(index)
+        parents.append(parent)
+        state = {}
+        for name, value in current.__dict__.items():
+            if name not in _excluded and \
+                    not isinstance(value, observe.Watcher):
+                state[name] = value
+        # -1: not set on the element (or not a string), -2: None
+        for name, codes in zip(_packed_state, (tags, texts, tails)):
+            value = state.get(name, state)
+            if type(value) is str:
+                codes.append(code(value))
+            elif value is None:
+                codes.append(-2)
+            else:
+                codes.append(-1)
+                continue
+            del state[name]
+        attribute = state.get('_attribute')
+        if type(attribute) is collections.OrderedDict and not attribute:
+            new_attributes.append(1)
+            del state['_attribute']
+        else:
+            new_attributes.append(0)
+            if attribute is not None:
+                state['_attribute'] = attribute.copy()
+        if state:
+            states[position] = state
+        attrib = current.attrib
+        encoded = current._encoded or {}
+        others = {}
+        attrib_sizes.append(len(attrib))
+        for key, value in attrib.items():
+            attrib_items.append(code(key))
+            entry = encoded.get(key)
+            if entry is not None and entry is value:
+                remembered.append(1)
+            else:
+                remembered.append(0)
+                if entry is not None:
+                    others[key] = entry
+            if type(value) is str:
+                attrib_items.append(code(value))
+                continue
+            if isinstance(value, element.BaseElement):
+                referring.append(len(values))
+            attrib_items.append(-1 - len(values))
+            values.append(value)
+        if others:
+            encodings[position] = others
+        stack.extend((child, position) for child in
+                     reversed(current.children))
+    for index in referring:
+        value = values[index]
+        if id(value) in positions:
+            values[index] = ElementRef(positions[id(value)])
+        else:
+            values[index] = _detach(value, portable)
+    return (PACK_VERSION, classes, class_codes, parents, strings, tags,
+            texts, tails, new_attributes, attrib_sizes, attrib_items,
+            remembered, values, states, encodings)
+
+
+def packed_size(packed):
+    """return number of elements in packed"""
+    return len(packed[3])
+
+
+def unpack(packed):
+    """return top element of a hierarchy rebuilt from packed (as
+    returned by pack), or None if it is empty. packed is consumed: its
+    state dicts are used by the new elements
+    """
+    if packed[0] != PACK_VERSION:
+        raise ValueError('cannot unpack elements packed as version ' +
+                         str(packed[0]))
+    (_, classes, class_codes, parents, strings, tags, texts, tails,
+     new_attributes, attrib_sizes, attrib_items, remembered, values,
+     states, encodings) = packed
+    elements = []
+    referring = []
+    items = iter(zip(attrib_items[::2].tolist(), attrib_items[1::2].tolist(),
+                     remembered.tolist()))
+    new = object.__new__
+    for position, (cls, parent, tag, text, tail, new_attribute, size) in \
+            enumerate(zip(class_codes.tolist(), parents.tolist(),
+                          tags.tolist(), texts.tolist(), tails.tolist(),
+                          new_attributes.tolist(), attrib_sizes.tolist())):
+        elem = new(classes[cls])
+        elem_state = elem.__dict__
+        for name, index in zip(_packed_state, (tag, text, tail)):
+            if index >= 0:
+                elem_state[name] = strings[index]
+            elif index == -2:
+                elem_state[name] = None
+        if new_attribute:
+            elem_state['_attribute'] = collections.OrderedDict()
+        state = states.get(position)
+        if state is not None:
+            elem_state.update(state)
+        attrib = {}
+        encoded = encodings.get(position)
+        for _ in range(size):
+            key, code, remember = next(items)
+            key = strings[key]
+            if code >= 0:
+                value = attrib[key] = strings[code]
+            else:
+                value = attrib[key] = values[-1 - code]
+                if type(value) in _stand_ins:
+                    referring.append(elem)
+            if remember:
+                if encoded is None:
+                    encoded = {}
+                encoded[key] = value
+        if encoded:
+            elem_state['_encoded'] = encoded
+        elem_state['attrib'] = attrib
+        elem_state['children'] = []
+        if parent >= 0:
+            parent_elem = elements[parent]
+            parent_elem.children.append(elem)
+            elem_state['_parent'] = parent_elem
+        elements.append(elem)
+    for elem in referring:
+        attrib = elem.attrib
+        for key, value in list(attrib.items()):
+            if type(value) is ElementRef:
+                attrib[key] = elements[value.position]
+            elif type(value) is Detached:
+                cls, _, state, detached_attrib, encoded = value.record
+                attrib[key] = _build(cls, state, detached_attrib, encoded)
+    return elements[0] if elements else None
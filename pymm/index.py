@@ -0,0 +1,347 @@
+"""
+    index holds secondary indexes that can be built over a pymm tree.
+    An index is built once by walking the tree, and afterwards is kept
+    up-to-date by the elements it watches: each indexed element holds a
+    reference to the index in its _watchers, and notifies the index when
+    it is modified through pymm. This allows queries such as "all nodes
+    where status == blocked" to be answered without walking the tree.
+"""
+import bisect
+import collections
+import math
+import time
+from . import observe
+from .element import ImplicitNodeAttributes
+from .observe import Watcher
+
+
+def _hashable(value):
+    """return value if it can be used as a dictionary key, otherwise
+    return its string representation
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return str(value)
+    return value
+
+
+def _as_number(value):
+    """return value as a float if it looks numeric, else None. Booleans
+    and nan are not considered numeric
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    elif isinstance(value, str):
+        try:
+            number = float(value.strip())
+        except ValueError:
+            return None
+    else:
+        return None
+    if math.isnan(number):
+        return None
+    return number
+
+
+class AttributeIndex(Watcher):
+    """Index the (Node) attributes of each node in a tree by name and
+    value. Attributes are the excel-like name/value tables beneath a
+    Node, accessed with node[name] = value. The index supports equality
+    lookup (find), numeric range lookup (find_range) for values that
+    look like numbers, and existence lookup (find_having).
+    The index is updated whenever an indexed node's attributes are set
+    or deleted through node[name] = value or del node[name]. Nodes that
+    are added to the tree after the index was built must be added with
+    index.add(node). Changes made directly to the dictionary returned by
+    node.get_attributes() are not seen; call index.add(node) to re-sync.
+
+    :param element: optional element whose hierarchy will be indexed
+    """
+
+    def __init__(self, element=None):
+        # name: {value: {node: None}}. Dicts are used as ordered sets
+        self._values = collections.defaultdict(dict)
+        # name: {number: {node: None}}, and sorted list of numbers
+        self._numbers = collections.defaultdict(dict)
+        self._sorted = collections.defaultdict(list)
+        # node: {name: value} for all indexed nodes
+        self._nodes = {}
+        if element is not None:
+            self.add(element)
+
+    def __len__(self):
+        """return number of nodes being indexed"""
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def add(self, element):
+        """index element and all of its sub-children that have
+        attributes. If a node is already indexed, its entries are
+        re-synced with its current attributes
+        """
+        for _, elem, _ in element.iter_preorder():
+            if isinstance(elem, ImplicitNodeAttributes):
+                self._watch(elem)
+                self._sync(elem)
+
+    def discard(self, element):
+        """remove element and all of its sub-children from the index"""
+        for _, elem, _ in element.iter_preorder():
+            if elem not in self._nodes:
+                continue
+            for name in list(self._nodes[elem]):
+                self._remove_entry(elem, name)
+            del self._nodes[elem]
+            elem._watchers = tuple(
+                w for w in elem._watchers if w is not self
+            )
+
+    def attribute_changed(self, node, name):
+        """called by a watched node when its attribute name has been set
+        or deleted
+        """
+        if node not in self._nodes:
+            return
+        self._remove_entry(node, name)
+        attributes = node.get_attributes()
+        if name in attributes:
+            self._add_entry(node, name, attributes[name])
+
+    def find(self, name, value):
+        """return list of nodes whose attribute name equals value"""
+        return list(self._values.get(name, {}).get(_hashable(value), ()))
+
+    def find_range(self, name, low=None, high=None):
+        """return list of nodes whose attribute name has a numeric
+        value between low and high, inclusive. Omit low or high to leave
+        that end of the range open. Nodes are ordered by value
+        """
+        numbers = self._sorted.get(name, [])
+        start, end = 0, len(numbers)
+        if low is not None:
+            start = bisect.bisect_left(numbers, low)
+        if high is not None:
+            end = bisect.bisect_right(numbers, high)
+        buckets = self._numbers[name]
+        return [
+            node for number in numbers[start:end] for node in buckets[number]
+        ]
+
+    def find_having(self, name):
+        """return list of nodes that have an attribute called name"""
+        nodes = {}
+        for bucket in self._values.get(name, {}).values():
+            nodes.update(bucket)
+        return list(nodes)
+
+    def names(self):
+        """return list of all attribute names in the index"""
+        return [name for name, values in self._values.items() if values]
+
+    def values(self, name):
+        """return list of distinct values of attribute name"""
+        return list(self._values.get(name, {}))
+
+    def _watch(self, node):
+        if self not in node._watchers:
+            node._watchers = node._watchers + (self,)
+
+    def _sync(self, node):
+        """replace node's index entries with its current attributes"""
+        for name in list(self._nodes.get(node, ())):
+            self._remove_entry(node, name)
+        self._nodes[node] = {}
+        for name, value in node.items():
+            self._add_entry(node, name, value)
+
+    def _add_entry(self, node, name, value):
+        value = _hashable(value)
+        self._nodes[node][name] = value
+        self._values[name].setdefault(value, {})[node] = None
+        number = _as_number(value)
+        if number is None:
+            return
+        buckets = self._numbers[name]
+        if number not in buckets:
+            bisect.insort(self._sorted[name], number)
+            buckets[number] = {}
+        buckets[number][node] = None
+
+    def _remove_entry(self, node, name):
+        entries = self._nodes[node]
+        if name not in entries:
+            return
+        value = entries.pop(name)
+        values = self._values[name]
+        del values[value][node]
+        if not values[value]:
+            del values[value]
+        number = _as_number(value)
+        if number is None:
+            return
+        buckets = self._numbers[name]
+        del buckets[number][node]
+        if not buckets[number]:
+            del buckets[number]
+            numbers = self._sorted[name]
+            del numbers[bisect.bisect_left(numbers, number)]
+
+
+class TimestampIndex(Watcher):
+    """Index nodes by their CREATED and MODIFIED attrib, which Freeplane
+    stores as milliseconds since the epoch. Each field is kept sorted,
+    so range queries and ordered iteration do not walk the tree. The
+    index is updated whenever an indexed node's attrib['CREATED'] or
+    attrib['MODIFIED'] is set or deleted. Nodes added to the tree after
+    the index was built must be added with index.add(node); adding an
+    element tracks it (see pymm.observe.track), so that its attrib
+    changes are seen. If stamp_modified is True, MODIFIED is set to the
+    current time whenever an indexed node's attrib, attributes, children
+    (added, removed or reordered) or text are changed through pymm.
+
+    :param element: optional element whose hierarchy will be indexed
+    :param stamp_modified: automatically stamp MODIFIED on changes
+    :param clock: function returning current time in milliseconds
+    """
+    fields = ('CREATED', 'MODIFIED')
+
+    def __init__(self, element=None, stamp_modified=False, clock=None):
+        self.stamp_modified = stamp_modified
+        if clock is not None:
+            self.clock = clock
+        # field: sorted list of timestamps, and {timestamp: {node: None}}
+        self._sorted = {field: [] for field in self.fields}
+        self._buckets = {field: {} for field in self.fields}
+        # node: {field: timestamp} for all indexed nodes
+        self._nodes = {}
+        if element is not None:
+            self.add(element)
+
+    @staticmethod
+    def clock():
+        """return current time in milliseconds since the epoch"""
+        return int(time.time() * 1000)
+
+    def __len__(self):
+        """return number of nodes being indexed"""
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def add(self, element):
+        """index element and all of its sub-children that are nodes. If
+        a node is already indexed, its entries are re-synced
+        """
+        observe.track(element)
+        for _, elem, _ in element.iter_preorder(tag='node'):
+            if self not in elem._watchers:
+                elem._watchers = elem._watchers + (self,)
+            self._nodes.setdefault(elem, {})
+            for field in self.fields:
+                self._sync(elem, field)
+
+    def discard(self, element):
+        """remove element and all of its sub-children from the index"""
+        for _, elem, _ in element.iter_preorder():
+            if elem not in self._nodes:
+                continue
+            for field in self.fields:
+                self._remove_entry(elem, field)
+            del self._nodes[elem]
+            elem._watchers = tuple(
+                w for w in elem._watchers if w is not self
+            )
+
+    def attrib_changed(self, elem, key):
+        if elem not in self._nodes:
+            return
+        if key in self._buckets:
+            self._sync(elem, key)
+        if self.stamp_modified and key != 'MODIFIED':
+            self.stamp(elem)
+
+    def attribute_changed(self, node, key):
+        if self.stamp_modified and node in self._nodes:
+            self.stamp(node)
+
+    def children_changed(self, elem):
+        if self.stamp_modified and elem in self._nodes:
+            self.stamp(elem)
+
+    def text_changed(self, elem):
+        if self.stamp_modified and elem in self._nodes:
+            self.stamp(elem)
+
+    def stamp(self, node):
+        """set node's MODIFIED attrib to the current time"""
+        node.attrib['MODIFIED'] = self.clock()
+
+    def range(self, field, start=None, end=None):
+        """return list of nodes whose field (CREATED or MODIFIED) is
+        between start and end, inclusive, ordered oldest first. Omit
+        start or end to leave that end of the range open
+        """
+        return [node for _, node in self.iter(field, start, end)]
+
+    def iter(self, field, start=None, end=None, reverse=False):
+        """iterate (timestamp, node) pairs for field in timestamp order,
+        optionally limited to timestamps between start and end,
+        inclusive. Pass reverse=True to iterate newest first
+        """
+        stamps = self._sorted[field]
+        low, high = 0, len(stamps)
+        if start is not None:
+            low = bisect.bisect_left(stamps, start)
+        if end is not None:
+            high = bisect.bisect_right(stamps, end)
+        buckets = self._buckets[field]
+        selected = range(low, high)
+        if reverse:
+            selected = reversed(selected)
+        for i in selected:
+            stamp = stamps[i]
+            nodes = list(buckets[stamp])
+            if reverse:
+                nodes.reverse()
+            for node in nodes:
+                yield stamp, node
+
+    def modified_since(self, timestamp):
+        """return list of nodes modified at or after timestamp"""
+        return self.range('MODIFIED', start=timestamp)
+
+    def created_since(self, timestamp):
+        """return list of nodes created at or after timestamp"""
+        return self.range('CREATED', start=timestamp)
+
+    def _sync(self, node, field):
+        """replace node's entry for field with its current attrib"""
+        self._remove_entry(node, field)
+        try:
+            stamp = int(node.attrib[field])
+        except (KeyError, TypeError, ValueError):
+            return
+        self._nodes[node][field] = stamp
+        buckets = self._buckets[field]
+        if stamp not in buckets:
+            bisect.insort(self._sorted[field], stamp)
+            buckets[stamp] = {}
+        buckets[stamp][node] = None
+
+    def _remove_entry(self, node, field):
+        entries = self._nodes[node]
+        if field not in entries:
+            return
+        stamp = entries.pop(field)
+        buckets = self._buckets[field]
+        del buckets[stamp][node]
+        if not buckets[stamp]:
+            del buckets[stamp]
+            stamps = self._sorted[field]
+            del stamps[bisect.bisect_left(stamps, stamp)]
@@ -0,0 +1,284 @@
+"""
+    lock provides the file locking used by pymm.read and pymm.write. A
+    FileLock on a path is either shared (for reading) or exclusive (for
+    writing), and is held both against other threads of this process (by
+    a per-path reader/writer lock) and against other processes (by an
+    advisory fcntl.flock on a hidden lock file next to the path, named
+    .<filename>.lock). A writer makes the lock file, and removes it again
+    before releasing its lock; whoever was waiting on the removed file
+    finds, once locked, that it is no longer linked, and tries again.
+    Readers only lock a file that has a lock file (files are written
+    atomically, so a reader that finds none cannot see a partly-written
+    file). Where fcntl is not available, only threads of this process
+    are locked out.
+
+    atomic_write writes a file by writing a temporary file in the same
+    directory and renaming it over the target, so that readers never see
+    a partly-written file.
+"""
+import contextlib
+import os
+import threading
+import time
+from . import stats as pymm_stats
+try:
+    import fcntl
+except ImportError:  # not posix: lock threads of this process only
+    fcntl = None
+
+#: seconds between attempts to take a contended OS lock
+_poll_interval = 0.005
+
+
+class LockTimeout(TimeoutError):
+    """raised when a FileLock cannot be acquired within its timeout"""
+
+
+class _PathLock:
+    """reader/writer lock for one path, shared by the threads of this
+    process. Waiting writers hold off new readers, so that a steady
+    stream of readers cannot starve a writer
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.users = 0  # FileLocks using this lock; see _path_lock
+
+    def acquire(self, exclusive, timeout):
+        """return True once acquired, or False if timeout (seconds, or
+        None to wait forever) passed first
+        """
+        with self.condition:
+            if exclusive:
+                self.waiting_writers += 1
+                try:
+                    acquired = self.condition.wait_for(
+                        lambda: not self.writer and not self.readers, timeout
+                    )
+                finally:
+                    self.waiting_writers -= 1
+                if acquired:
+                    self.writer = True
+                else:
+                    self.condition.notify_all()  # readers held off by us
+            else:
+                acquired = self.condition.wait_for(
+                    lambda: not self.writer and not self.waiting_writers,
+                    timeout
+                )
+                if acquired:
+                    self.readers += 1
+            return acquired
+
+    def release(self, exclusive):
+        with self.condition:
+            if exclusive:
+                self.writer = False
+            else:
+                self.readers -= 1
+            self.condition.notify_all()
+
+
+_path_locks = {}  # path: _PathLock in use
+_path_locks_lock = threading.Lock()
+_held = threading.local()  # .paths: {path: _Hold} per thread
+
+
+class _Hold:
+    """a thread's lock on a path: whether it is exclusive, how many
+    FileLocks of the thread hold it, and the OS lock file (or None)
+    """
+
+    def __init__(self, exclusive, file):
+        self.exclusive = exclusive
+        self.count = 1
+        self.file = file
+
+
+def _holds():
+    """return {path: _Hold} of locks held by the current thread"""
+    try:
+        return _held.paths
+    except AttributeError:
+        _held.paths = {}
+        return _held.paths
+
+
+def _path_lock(path, change):
+    """return _PathLock of path, counting change (+1 or -1) users of it.
+    A lock is forgotten when it has no users
+    """
+    with _path_locks_lock:
+        path_lock = _path_locks.get(path)
+        if path_lock is None:
+            path_lock = _path_locks[path] = _PathLock()
+        path_lock.users += change
+        if not path_lock.users:
+            del _path_locks[path]
+        return path_lock
+
+
+def lock_filename(path):
+    """return filename of the OS lock file of path"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.' + name + '.lock')
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def _os_lock(path, exclusive, deadline):
+    """take advisory lock on path's lock file, and return the open lock
+    file, or None if locks are not supported or, for a shared lock, if
+    there is no lock file (no writer has locked the file). Raise
+    LockTimeout after deadline
+    """
+    if fcntl is None:
+        return None
+    filename = lock_filename(path)
+    operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    while True:
+        try:
+            file = open(filename, 'a+b' if exclusive else 'rb')
+        except OSError:
+            if exclusive:
+                raise
+            return None
+        try:
+            while True:
+                try:
+                    fcntl.flock(file.fileno(), operation | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    remaining = _remaining(deadline)
+                    if remaining is not None and remaining <= 0:
+                        raise LockTimeout('timed out locking ' + path)
+                    time.sleep(_poll_interval if remaining is None else
+                               min(_poll_interval, remaining))
+            if _is_linked(file, filename):
+                return file
+        except BaseException:
+            file.close()
+            raise
+        file.close()  # removed by its writer while we waited: try again
+
+
+def _is_linked(file, filename):
+    """return whether the open file is still the file at filename"""
+    try:
+        linked = os.stat(filename)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(file.fileno())
+    return (linked.st_dev, linked.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+class FileLock:
+    """Shared or exclusive lock on a path, against other threads and
+    other processes. May be used as a context manager. A thread that
+    already holds a lock on a path may take a shared lock on it again
+    (or an exclusive lock, if it holds an exclusive lock); the lock is
+    released when the outermost holder releases it.
+
+    :param path: path of file to lock. It need not exist
+    :param exclusive: True for an exclusive (writing) lock, False for a
+                      shared (reading) lock
+    :param timeout: seconds to wait for the lock before raising
+                    LockTimeout, or None to wait forever
+    """
+
+    def __init__(self, path, exclusive=False, timeout=None):
+        self.path = os.path.realpath(os.fsdecode(path))
+        self.exclusive = exclusive
+        self.timeout = timeout
+
+    def acquire(self):
+        """take the lock, waiting at most timeout seconds"""
+        holds = _holds()
+        held = holds.get(self.path)
+        if held is not None:
+            if self.exclusive and not held.exclusive:
+                raise RuntimeError('cannot take exclusive lock on ' +
+                                   self.path + ' while holding shared lock')
+            held.count += 1
+            return self
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+        path_lock = _path_lock(self.path, +1)
+        if not path_lock.acquire(self.exclusive, self.timeout):
+            _path_lock(self.path, -1)
+            raise LockTimeout('timed out locking ' + self.path)
+        try:
+            file = _os_lock(self.path, self.exclusive, deadline)
+        except BaseException:
+            path_lock.release(self.exclusive)
+            _path_lock(self.path, -1)
+            raise
+        holds[self.path] = _Hold(self.exclusive, file)
+        return self
+
+    def release(self):
+        holds = _holds()
+        held = holds[self.path]
+        held.count -= 1
+        if held.count:
+            return
+        del holds[self.path]
+        if held.file is not None:
+            if held.exclusive:
+                # unlinked while still locked, so that anyone who opened
+                # it meanwhile finds it unlinked once they lock it
+                with contextlib.suppress(OSError):
+                    os.unlink(lock_filename(self.path))
+            held.file.close()  # closing releases the flock
+        _path_lock(self.path, 0).release(held.exclusive)
+        _path_lock(self.path, -1)
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *error):
+        self.release()
+
+
+def is_path(file_or_filename):
+    """return True if file_or_filename is a path rather than a file"""
+    return isinstance(file_or_filename, (str, bytes, os.PathLike))
+
+
+@contextlib.contextmanager
+def atomic_write(path, stats=None):
+    """context manager giving a binary file that, on successful exit,
+    atomically replaces path (or the file a symlink at path points to).
+    On error, path is left unchanged. The new file keeps the permissions
+    of the file it replaces. Time spent flushing it to disk and renaming
+    it over path is recorded in stats (if given) as phase sync
+    """
+    path = os.path.realpath(os.fsdecode(path))
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, '.' + name + '.' + str(os.getpid()) +
+                             '.' + str(threading.get_ident()) + '.tmp')
+    file = open(temporary, 'xb')
+    try:
+        yield file
+        with pymm_stats.phase(stats, 'sync'):
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+            try:
+                os.chmod(temporary, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass
+            os.replace(temporary, path)
+    except BaseException:
+        file.close()
+        with contextlib.suppress(OSError):
+            os.unlink(temporary)
+        raise
@@ -0,0 +1,224 @@
+"""
+    memory reports how much memory a pymm tree retains, and where. Call
+    memory_report(mindmap) to attribute bytes to each element class and
+    to the parts of an element (its object, attrib dict, strings,
+    children list, a Node's _attribute, and _text/_tail), along with an
+    estimate of what interning duplicate strings and compacting
+    containers would save. traced_read(file) reads a file with tracemalloc
+    running, and adds what the read allocated to the report.
+
+    Sizes come from sys.getsizeof, so they are estimates: an object
+    shared by several elements (an interned string, for instance) is only
+    counted once, for the first element that holds it.
+"""
+import collections
+import sys
+import tracemalloc
+
+#: instance attributes sized as their own component, not as 'other'
+_accounted = frozenset(('attrib', 'children', '_attribute', '_text', '_tail',
+                        '_parent', '_encoded'))
+
+
+class MemoryReport:
+    """Bytes retained by a pymm tree, per element class and component.
+
+    classes: {class name: Counter of bytes per component}
+    counts: Counter of elements per class name
+    interning: bytes that would be saved if equal strings (attrib keys
+               and values, text) were one shared object
+    compaction: bytes that would be saved if empty children lists and
+                _attribute dicts were shared, and children lists were not
+                over-allocated
+    traced: None, or (for traced_read) a dict of 'allocated' (bytes still
+            allocated after reading), 'peak' (most bytes allocated while
+            reading), and 'top' (list of [location, bytes, allocations]
+            for the source lines that allocated most)
+    """
+
+    def __init__(self):
+        self.classes = collections.defaultdict(collections.Counter)
+        self.counts = collections.Counter()
+        self.interning = 0
+        self.compaction = 0
+        self.traced = None
+
+    @property
+    def total(self):
+        """total bytes retained by the tree"""
+        return sum(sum(parts.values()) for parts in self.classes.values())
+
+    @property
+    def components(self):
+        """Counter of bytes per component, over all element classes"""
+        totals = collections.Counter()
+        for parts in self.classes.values():
+            totals.update(parts)
+        return totals
+
+    def as_dict(self):
+        """return report as a json-serialisable dict"""
+        return {
+            'total': self.total,
+            'elements': sum(self.counts.values()),
+            'components': dict(self.components),
+            'classes': {name: dict(parts) for name, parts in
+                        self.classes.items()},
+            'counts': dict(self.counts),
+            'interning': self.interning,
+            'compaction': self.compaction,
+            'traced': self.traced,
+        }
+
+    def __str__(self):
+        lines = ['%-20s %8s %12s' % ('class', 'count', 'bytes')]
+        by_size = sorted(self.classes.items(),
+                         key=lambda item: -sum(item[1].values()))
+        for name, parts in by_size:
+            lines.append('%-20s %8d %12d' % (
+                name, self.counts[name], sum(parts.values())
+            ))
+        lines.append('%-20s %8d %12d' % (
+            'total', sum(self.counts.values()), self.total
+        ))
+        for component, size in self.components.most_common():
+            lines.append('  %-18s %21d' % (component, size))
+        lines.append('interning would save ' + str(self.interning) +
+                     ' bytes, compaction ' + str(self.compaction) + ' bytes')
+        if self.traced is not None:
+            lines.append('read allocated ' + str(self.traced['allocated']) +
+                         ' bytes, peak ' + str(self.traced['peak']))
+        return '\n'.join(lines)
+
+
+class _Sizer:
+    """count each object's size once, and track equal strings held in
+    separate objects
+    """
+
+    def __init__(self, report):
+        self.report = report
+        self.seen = set()
+        self.strings = {}  # value: id of first object holding it
+        self.overheads = {}  # type: size over its builtin base type
+
+    def overhead(self, obj):
+        """return extra size of an empty obj (such as an ObservedChildren)
+        over an empty instance of its builtin base type
+        """
+        cls = type(obj)
+        if cls not in self.overheads:
+            base = next(t for t in cls.__mro__ if t.__module__ == 'builtins')
+            self.overheads[cls] = \
+                sys.getsizeof(cls.__new__(cls)) - sys.getsizeof(base())
+        return self.overheads[cls]
+
+    def size(self, obj):
+        """return size of obj, or 0 if it was already counted"""
+        if id(obj) in self.seen:
+            return 0
+        self.seen.add(id(obj))
+        return sys.getsizeof(obj)
+
+    def string(self, value):
+        """return size of a str (or other scalar) value, noting
+        duplicates that interning would remove
+        """
+        size = self.size(value)
+        if size and isinstance(value, str):
+            first = self.strings.setdefault(value, id(value))
+            if first != id(value):
+                self.report.interning += size
+        return size
+
+    def items(self, mapping):
+        """return size of the keys and values of mapping"""
+        return sum(self.string(key) + self.string(value)
+                   for key, value in mapping.items())
+
+
+def _account(sizer, elem, parts):
+    """add the memory held by elem to parts, a Counter of components"""
+    report = sizer.report
+    state = vars(elem)
+    parts['object'] += sizer.size(elem) + sizer.size(state)
+    attrib = state.get('attrib')
+    if attrib is not None:
+        parts['attrib'] += sizer.size(attrib)
+        parts['strings'] += sizer.items(attrib)
+        encoded = state.get('_encoded')
+        if encoded:  # remembered encoded forms (see _remembered_encoding)
+            parts['attrib'] += sizer.size(encoded) + sum(
+                sizer.size(entry) + sizer.string(entry[1])
+                for entry in encoded.values() if type(entry) is tuple
+            )
+    children = state.get('children')
+    if children is not None:
+        size = sizer.size(children)
+        parts['children'] += size
+        if size and not children:
+            report.compaction += size
+        elif size:  # over-allocated slots
+            exact = sys.getsizeof(list(children)) + sizer.overhead(children)
+            report.compaction += max(0, size - exact)
+    attribute = state.get('_attribute')
+    if attribute is not None:
+        size = sizer.size(attribute)
+        parts['_attribute'] += size
+        parts['strings'] += sizer.items(attribute)
+        if not attribute:
+            report.compaction += size
+    for name in ('_text', '_tail'):
+        if name in state:
+            parts['text'] += sizer.string(state[name])
+    for name, value in state.items():
+        if name not in _accounted:
+            parts['other'] += sizer.size(value)
+
+
+def memory_report(mindmap):
+    """return a MemoryReport of memory retained by mindmap (or any pymm
+    element) and all its sub-children
+    """
+    report = MemoryReport()
+    sizer = _Sizer(report)
+    for parent, elem, depth in mindmap.iter_preorder():
+        name = type(elem).__name__
+        report.counts[name] += 1
+        _account(sizer, elem, report.classes[name])
+    return report
+
+
+def traced_read(file, top=10, **kwargs):
+    """read file with pymm.read while tracing allocations with
+    tracemalloc, and return (mindmap, report). report is the
+    memory_report of the mindmap, with traced set to what the read
+    allocated. If tracemalloc was not already tracing, it is started for
+    the read only
+
+    :param top: number of allocating source lines to list in report
+    :param kwargs: passed to pymm.read
+    """
+    from .pymm import read
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        before = tracemalloc.take_snapshot()
+        mindmap = read(file, **kwargs)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    differences = after.compare_to(before, 'lineno')
+    report = memory_report(mindmap)
+    report.traced = {
+        'allocated': current - base,
+        'peak': peak - base,
+        'top': [[str(stat.traceback), stat.size_diff, stat.count_diff]
+                for stat in differences[:top]],
+    }
+    return mindmap, report
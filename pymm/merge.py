@@ -0,0 +1,437 @@
+"""
+    merge reconciles two versions of a mindmap (ours and theirs) that
+    were both edited from a common base version. Nodes are identified by
+    their ID attrib, so moves, attrib and (Node) attribute edits, detail
+    changes (clouds, edges, richcontent, etc.) and child reordering made
+    on either side are combined. Only subtrees whose content_hash differs
+    from base are visited, so merging large maps with few edits is cheap.
+    When both sides changed the same thing differently, ours is kept and
+    a Conflict describing the disagreement is reported.
+"""
+import copy
+from . import observe
+from .units import _is_unit, _unit_id, _node_children, _text
+
+
+class Conflict:
+    """Describes a change made by theirs that could not be merged into
+    ours. In all cases ours was kept unchanged.
+
+    :param kind: one of:
+        'attrib': both sides set attrib key of node to different values
+        'attribute': both sides set (Node) attribute key differently
+        'details': both sides changed details (non-node children)
+        'order': both sides reordered children of node differently
+        'move': both sides moved node to different parents
+        'cycle': theirs' move would place node beneath itself
+        'delete': theirs deleted node, but ours modified it
+        'modify': theirs modified node (or its children), but ours
+                  deleted it
+        'insert': both sides inserted node with the same ID, differently
+    :param id: ID of the node in conflict (None for the top element)
+    :param key: attrib or attribute key, if applicable
+    :param base, ours, theirs: the conflicting values, if applicable
+    """
+
+    def __init__(self, kind, id, key=None, base=None, ours=None,
+                 theirs=None):
+        self.kind = kind
+        self.id = id
+        self.key = key
+        self.base = base
+        self.ours = ours
+        self.theirs = theirs
+
+    def __repr__(self):
+        text = 'Conflict(' + repr(self.kind) + ', ' + repr(self.id)
+        if self.key is not None:
+            text += ', key=' + repr(self.key)
+        return text + ')'
+
+    def __eq__(self, other):
+        return isinstance(other, Conflict) and vars(self) == vars(other)
+
+
+def _ref(unit, top):
+    return None if unit is top else _unit_id(unit)
+
+
+def _pair(base, side):
+    """pair units of side with units of base by ID, skipping subtrees
+    whose content is unchanged. Return dicts keyed by ID (None for the
+    top element): pairs of (base unit, side unit) that were visited,
+    base units deleted in side, and side units that are new
+    """
+    pairs, deleted, inserted = {}, {}, {}
+    loose_base, loose_side = [], []
+    stack = [(None, base, side)]
+    while stack:
+        ref, base_unit, side_unit = stack.pop()
+        if base_unit.content_hash() == side_unit.content_hash():
+            continue
+        pairs[ref] = (base_unit, side_unit)
+        base_children = {_unit_id(c): c for c in _node_children(base_unit)}
+        for child in _node_children(side_unit):
+            match = base_children.pop(_unit_id(child), None)
+            if match is None:
+                loose_side.append(child)
+            else:
+                stack.append((_unit_id(child), match, child))
+        loose_base.extend(base_children.values())
+    # units that moved, were inserted, or were deleted. Index all
+    # units beneath them by ID to tell which is which
+    for loose, found in ((loose_base, deleted), (loose_side, inserted)):
+        while loose:
+            unit = loose.pop()
+            found[_unit_id(unit)] = unit
+            loose.extend(_node_children(unit))
+    for ref in list(inserted):
+        if ref in deleted:
+            pairs[ref] = (deleted.pop(ref), inserted.pop(ref))
+    return pairs, deleted, inserted
+
+
+def _attrib(unit):
+    return {_text(k): _text(v) for k, v in unit.attrib.items()}
+
+
+def _attributes(unit):
+    return {_text(k): _text(v) for k, v in
+            getattr(unit, '_attribute', {}).items()}
+
+
+def _anchored(children):
+    """return list of (ID of preceding unit or None, detail) for each
+    detail in children
+    """
+    anchored, anchor = [], None
+    for child in children:
+        if _is_unit(child):
+            anchor = _unit_id(child)
+        else:
+            anchored.append((anchor, child))
+    return anchored
+
+
+def _signature(unit):
+    return [(anchor, detail.content_hash()) for anchor, detail in
+            _anchored(unit.children)]
+
+
+def _arrange(unit, order, details):
+    """set children of unit to its units in order (list of IDs), each
+    followed by the details anchored to it (see _anchored)
+    """
+    units = {_unit_id(child): child for child in _node_children(unit)}
+    following = {}
+    for anchor, detail in details:
+        if anchor not in units:
+            anchor = None
+        following.setdefault(anchor, []).append(detail)
+    children = following.get(None, [])
+    for i in order:
+        children.append(units[i])
+        children.extend(following.get(i, ()))
+    if children != list(unit.children):
+        unit.children[:] = children
+
+
+def _order(unit):
+    return [_unit_id(child) for child in _node_children(unit)]
+
+
+class _Merger:
+    """apply the changes from base to theirs onto ours"""
+
+    def __init__(self, base, ours, theirs):
+        self.base, self.ours, self.theirs = base, ours, theirs
+        self.conflicts = []
+        self.theirs_pairs, self.theirs_deleted, self.theirs_inserted = \
+            _pair(base, theirs)
+        self.ours_pairs, self.ours_deleted, self.ours_inserted = \
+            _pair(base, ours)
+        self.result = {}  # ID: unit of ours (None if deleted in ours)
+        self.reorder = {}  # ID: unit of ours whose children to reorder
+
+    def conflict(self, *args, **kwargs):
+        self.conflicts.append(Conflict(*args, **kwargs))
+
+    def locate(self, ref, base_unit):
+        """return unit of ours with same ID as base_unit, or None if ours
+        deleted it. Must be called before ours is modified
+        """
+        if ref in self.result:
+            return self.result[ref]
+        # units that were not visited in ours are unchanged, and sit at
+        # the same place beneath their nearest visited ancestor
+        chain = []
+        unit, unit_ref = base_unit, ref
+        while unit_ref not in self.ours_pairs and unit is not self.base:
+            if unit_ref in self.ours_deleted:
+                self.result[ref] = None
+                return None
+            chain.append(unit_ref)
+            unit = unit._parent
+            unit_ref = _ref(unit, self.base)
+        if unit_ref in self.ours_pairs:
+            found = self.ours_pairs[unit_ref][1]
+        else:
+            found = self.ours
+        for child_ref in reversed(chain):
+            children = _node_children(found)
+            found = next(
+                (c for c in children if _unit_id(c) == child_ref), None
+            )
+            if found is None:
+                break
+        self.result[ref] = found
+        return found
+
+    def merge(self):
+        if not self.theirs_pairs:
+            return self.conflicts  # theirs is unchanged
+        for ref, (base_unit, _) in self.theirs_pairs.items():
+            self.locate(ref, base_unit)
+        for ref, base_unit in self.theirs_deleted.items():
+            self.locate(ref, base_unit)
+        # ours' child order and details, from before ours is modified
+        self.ours_before = {
+            ref: (_order(self.ours_pairs[ref][1]),
+                  _signature(self.ours_pairs[ref][1]))
+            for ref in self.theirs_pairs if ref in self.ours_pairs
+        }
+        deletes = self.decide_deletes()
+        self.insert()
+        self.move()
+        for unit in deletes:
+            unit._parent.children.remove(unit)
+        for ref, (base_unit, theirs_unit) in self.theirs_pairs.items():
+            self.merge_content(ref, base_unit, theirs_unit)
+        for ref, unit in self.reorder.items():
+            self.merge_order(ref, unit)
+        return self.conflicts
+
+    def decide_deletes(self):
+        """return list of units of ours to delete. A unit is kept if
+        ours modified it or anything beneath it
+        """
+        deletes = []
+        for ref, base_unit in self.theirs_deleted.items():
+            if base_unit._parent is None:
+                continue
+            if _ref(base_unit._parent, self.base) in self.theirs_deleted:
+                continue  # deleted along with its parent
+            unit = self.result[ref]
+            if unit is None:
+                continue  # deleted by both
+            if unit.content_hash() != base_unit.content_hash():
+                self.conflict('delete', ref)
+            else:
+                deletes.append(unit)
+        return deletes
+
+    def parent_in_result(self, theirs_unit):
+        parent_ref = _ref(theirs_unit._parent, self.theirs)
+        return parent_ref, self.result.get(parent_ref)
+
+    def insert(self):
+        """add units new in theirs, without the units beneath them that
+        existed in base (those are moved in afterwards)
+        """
+        inserted = self.theirs_inserted
+        for ref, theirs_unit in inserted.items():
+            parent_ref, parent = self.parent_in_result(theirs_unit)
+            if parent_ref in inserted:
+                continue  # copied along with its parent
+            if ref in self.ours_inserted:
+                ours_unit = self.ours_inserted[ref]
+                self.result[ref] = ours_unit
+                if ours_unit.content_hash() != theirs_unit.content_hash():
+                    self.conflict('insert', ref)
+                continue
+            if parent is None:
+                self.conflict('modify', parent_ref)
+                continue
+            unit = copy.deepcopy(theirs_unit)
+            stack = [unit]
+            while stack:
+                elem = stack.pop()
+                self.result[_unit_id(elem)] = elem
+                for child in _node_children(elem):
+                    if _unit_id(child) in inserted:
+                        stack.append(child)
+                    else:
+                        elem.children.remove(child)
+            parent.children.append(unit)
+            self.reorder[parent_ref] = parent
+
+    def move(self):
+        for ref, (base_unit, theirs_unit) in self.theirs_pairs.items():
+            if ref is None:
+                continue
+            base_parent = _ref(base_unit._parent, self.base)
+            parent_ref, parent = self.parent_in_result(theirs_unit)
+            if parent_ref == base_parent:
+                continue
+            unit = self.result[ref]
+            if unit is None:
+                self.conflict('modify', ref, base=base_parent,
+                              theirs=parent_ref)
+                continue
+            ours_parent = _ref(unit._parent, self.ours)
+            if ref in self.ours_pairs and ours_parent != base_parent:
+                if ours_parent != parent_ref:
+                    self.conflict('move', ref, base=base_parent,
+                                  ours=ours_parent, theirs=parent_ref)
+                continue
+            if parent is None:
+                self.conflict('modify', parent_ref)
+                continue
+            ancestor = parent
+            while ancestor is not None and ancestor is not unit:
+                ancestor = ancestor._parent
+            if ancestor is unit:
+                self.conflict('cycle', ref, ours=ours_parent,
+                              theirs=parent_ref)
+                continue
+            unit._parent.children.remove(unit)
+            parent.children.append(unit)
+            self.reorder[parent_ref] = parent
+
+    def merge_content(self, ref, base_unit, theirs_unit):
+        unit = self.result[ref]
+        if unit is None:
+            if base_unit.content_hash() != theirs_unit.content_hash():
+                self.conflict('modify', ref)
+            return
+        if ref is not None:
+            self.merge_dict(ref, 'attrib', unit.attrib, _attrib(base_unit),
+                            _attrib(unit), theirs_unit.attrib)
+        if hasattr(unit, 'get_attributes'):
+            self.merge_dict(ref, 'attribute', unit, _attributes(base_unit),
+                            _attributes(unit), theirs_unit.get_attributes())
+        self.merge_details(ref, unit, base_unit, theirs_unit)
+        if _order(theirs_unit) != _order(base_unit):
+            self.reorder[ref] = unit
+
+    def merge_details(self, ref, unit, base_unit, theirs_unit):
+        """take details of theirs if theirs changed their content or
+        position, and ours did not
+        """
+        base_signature = _signature(base_unit)
+        theirs_signature = _signature(theirs_unit)
+        if theirs_signature == base_signature:
+            return
+        ours_signature = self.ours_before.get(ref, (None, base_signature))[1]
+        if ours_signature == theirs_signature:
+            return
+        if ours_signature != base_signature:
+            # both changed. If only one side changed content (rather
+            # than position) use that side, otherwise keep ours
+            contents = [[h for _, h in signature] for signature in
+                        (base_signature, ours_signature, theirs_signature)]
+            base_content, ours_content, theirs_content = contents
+            if theirs_content == base_content:
+                return
+            if ours_content != base_content:
+                if ours_content != theirs_content:
+                    self.conflict('details', ref)
+                return
+        details = [(anchor, copy.deepcopy(detail)) for anchor, detail in
+                   _anchored(theirs_unit.children)]
+        _arrange(unit, _order(unit), details)
+
+    def merge_dict(self, ref, kind, target, base, ours, theirs):
+        """three-way merge of attrib or attributes. base and ours are
+        dicts of strings; theirs holds the values to copy into target
+        """
+        for key in list(base) + [k for k in theirs if k not in base]:
+            theirs_value = _text(theirs[key]) if key in theirs else None
+            base_value = base.get(key)
+            if theirs_value == base_value:
+                continue
+            ours_value = ours.get(key)
+            if ours_value == theirs_value:
+                continue
+            if ours_value != base_value:
+                self.conflict(kind, ref, key=key, base=base_value,
+                              ours=ours_value, theirs=theirs_value)
+            elif key in theirs:
+                target[key] = theirs[key]
+            else:
+                del target[key]
+
+    def merge_order(self, ref, unit):
+        """order children of unit by theirs, unless ours reordered them
+        too. Children that only one side has follow the sibling they
+        follow on that side
+        """
+        base_order, theirs_order, ours_order = [], [], []
+        if ref in self.theirs_pairs:
+            base_unit, theirs_unit = self.theirs_pairs[ref]
+            base_order, theirs_order = _order(base_unit), _order(theirs_unit)
+            ours_order = self.ours_before.get(ref, (base_order,))[0]
+        elif ref in self.theirs_inserted:
+            theirs_order = _order(self.theirs_inserted[ref])
+        common = set(base_order) & set(theirs_order) & set(ours_order)
+        relative = lambda order: [i for i in order if i in common]
+        if relative(theirs_order) == relative(base_order):
+            preferred = ours_order
+        elif relative(ours_order) == relative(base_order):
+            preferred = theirs_order
+        else:
+            if relative(ours_order) != relative(theirs_order):
+                self.conflict('order', ref, base=base_order,
+                              ours=ours_order, theirs=theirs_order)
+            preferred = ours_order
+        current = _order(unit)
+        positions = {i: position for position, i in enumerate(current)}
+        theirs_positions = {i: position for position, i in
+                            enumerate(theirs_order)}
+        final = [i for i in preferred if i in positions]
+        placed = set(final)
+        # the placed IDs as a linked list (None: before the first), so
+        # that each remaining ID is placed right after its predecessor
+        # without searching or shifting final
+        following = dict(zip([None] + final, final + [None]))
+        for i in current:
+            if i in placed:
+                continue
+            if i in theirs_positions:
+                source, position = theirs_order, theirs_positions[i]
+            else:
+                source, position = current, positions[i]
+            previous = None
+            while position:
+                position -= 1
+                if source[position] in placed:
+                    previous = source[position]
+                    break
+            following[i] = following[previous]
+            following[previous] = i
+            placed.add(i)
+        final = []
+        i = following[None]
+        while i is not None:
+            final.append(i)
+            i = following[i]
+        _arrange(unit, final, _anchored(unit.children))
+
+
+def merge(base, ours, theirs):
+    """Three-way merge of two versions of a mindmap edited from a common
+    base. The changes theirs made to base are applied to ours, which is
+    modified in place. Nodes are matched by their ID attrib. Where both
+    sides changed the same attrib key, attribute, details, child order,
+    or parent differently, or where one side deleted a node the other
+    modified, ours is kept and a Conflict is reported.
+
+    :param base: common ancestor version (not modified)
+    :param ours: our version, which receives the merged changes
+    :param theirs: their version (not modified)
+    :return: tuple of (ours, list of Conflict)
+    """
+    for tree in (base, ours, theirs):
+        observe.track(tree)  # so that each element's _parent is exact
+    conflicts = _Merger(base, ours, theirs).merge()
+    return ours, conflicts
@@ -0,0 +1,228 @@
+"""
+    observe holds the containers that let a pymm element notice when it
+    is modified. Observing costs time on every change, so elements keep
+    a plain attrib dict and children list until they are tracked (see
+    track), as when their content_hash is computed or an index that
+    needs their changes (such as pymm.index.TimestampIndex) is built.
+
+    A tracked element's attrib is an ObservedAttrib: a dict that tells
+    its owning element which key was set or deleted. The element in turn
+    notifies each Watcher in its _watchers, so that watchers stay
+    up-to-date without re-walking the tree. Its children is an
+    ObservedChildren: a list that tells its owning element when it
+    changes, points each child element back at its parent through
+    child._parent, and tracks each element added to it, so that all
+    sub-children of a tracked element are tracked too.
+"""
+
+
+class Watcher:
+    """Base class for objects that can be placed in an element's
+    _watchers. Override the notifications of interest; the default
+    implementations do nothing
+    """
+
+    def attrib_changed(self, elem, key):
+        """called after elem.attrib[key] has been set or deleted, if
+        elem is tracked (see track)
+        """
+
+    def attribute_changed(self, node, key):
+        """called after node[key] (a Node attribute) has been set or
+        deleted
+        """
+
+    def children_changed(self, elem):
+        """called after children were added to, removed from, or
+        reordered within elem.children, or it was replaced, if elem is
+        tracked (see track)
+        """
+
+    def text_changed(self, elem):
+        """called after elem._text (its xml text) has been set"""
+
+
+class ObservedAttrib(dict):
+    """dict used as the attrib of a tracked element (see track). Behaves
+    exactly like a dict, but after a key is set or deleted, calls
+    owner._attrib_changed(key). Copying or pickling an ObservedAttrib
+    produces a plain dict.
+    """
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owner = owner
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+    def _changed(self, key):
+        self._owner._attrib_changed(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        for key in changes:
+            self._changed(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        had_key = key in self
+        value = super().pop(key, *default)
+        if had_key:
+            self._changed(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._changed(key)
+        return key, value
+
+    def clear(self):
+        keys = list(self)
+        super().clear()
+        for key in keys:
+            self._changed(key)
+
+
+def track(elem):
+    """start observing the attrib and children of elem and all its
+    sub-children, unless they already are: each element's attrib and
+    children are replaced by an ObservedAttrib and ObservedChildren, and
+    each child's _parent is pointed at its parent. Return elem
+    """
+    stack = [elem]
+    while stack:
+        current = stack.pop()
+        state = getattr(current, '__dict__', None)
+        if state is None or state.get('_tracked'):
+            continue  # not an element, or tracked with its sub-children
+        state['attrib'] = ObservedAttrib(current, current.attrib)
+        children = ObservedChildren(current, current.children)
+        state['children'] = children
+        state['_tracked'] = True
+        for child in children:
+            child_state = getattr(child, '__dict__', None)
+            if child_state is not None:
+                child_state['_parent'] = current
+        stack.extend(children)
+    return elem
+
+
+def _adopt(owner, children):
+    """point each child's _parent at owner, and track it"""
+    for child in children:
+        try:
+            child._parent = owner
+        except AttributeError:
+            continue  # not an element. Let encoding report the error
+        track(child)
+
+
+def _orphan(owner, children):
+    """clear _parent of each child that points at owner"""
+    for child in children:
+        if getattr(child, '_parent', None) is owner:
+            child._parent = None
+
+
+class ObservedChildren(list):
+    """list used as the children of a tracked element (see track).
+    Behaves exactly like a list, but sets child._parent of each element
+    added to it (tracking the element), and calls
+    owner._children_changed() after each modification. Copying or
+    pickling an ObservedChildren produces a plain list.
+    """
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner, *args):
+        super().__init__(*args)
+        self._owner = owner
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+    def _changed(self, added=(), removed=()):
+        owner = self._owner
+        _orphan(owner, removed)
+        _adopt(owner, added)
+        owner._children_changed()
+
+    def append(self, child):
+        super().append(child)
+        self._changed(added=(child,))
+
+    def extend(self, children):
+        children = list(children)
+        super().extend(children)
+        self._changed(added=children)
+
+    def insert(self, index, child):
+        super().insert(index, child)
+        self._changed(added=(child,))
+
+    def remove(self, child):
+        super().remove(child)
+        self._changed(removed=(child,))
+
+    def pop(self, index=-1):
+        child = super().pop(index)
+        self._changed(removed=(child,))
+        return child
+
+    def clear(self):
+        removed = list(self)
+        super().clear()
+        self._changed(removed=removed)
+
+    def __setitem__(self, index, value):
+        removed = self[index]
+        if isinstance(index, slice):
+            value = list(value)
+            super().__setitem__(index, value)
+            self._changed(added=value, removed=removed)
+        else:
+            super().__setitem__(index, value)
+            self._changed(added=(value,), removed=(removed,))
+
+    def __delitem__(self, index):
+        removed = self[index]
+        if not isinstance(index, slice):
+            removed = (removed,)
+        super().__delitem__(index)
+        self._changed(removed=removed)
+
+    def __iadd__(self, children):
+        self.extend(children)
+        return self
+
+    def __imul__(self, count):
+        removed = list(self)
+        super().__imul__(count)
+        self._changed(added=list(self), removed=removed)
+        return self
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        super().reverse()
+        self._changed()
@@ -0,0 +1,632 @@
+"""
+    parallel reads and writes one large mindmap using several processes.
+
+    Reading: the xml
+    is split at the nodes directly under the root node (the map's
+    branches): each branch is decoded in a worker process through the
+    normal factories, and sent back packed (see pymm.flat.pack). The
+    rest of the map, with a placeholder in place of each branch, is
+    decoded in this process meanwhile. The branches then replace their
+    placeholders, and post_decode is called on the whole tree in this
+    process, in the usual breadth-first order.
+
+    The result is the same tree that pymm.read gives, as long as the
+    factories decoding a branch's top node do not depend on its parent
+    (which is not yet decoded when the branch is). Maps that cannot be
+    split (that are not a full mindmap, have fewer than two branches, or
+    use an encoding other than utf-8 or ascii) are decoded in this
+    process as pymm.read would.
+
+    Writing: pre_encode is called on the whole tree in this process.
+    The map is then encoded with a placeholder in place of each branch,
+    and each branch is sent packed to a worker process, which
+    encodes it through the normal factories and serialises it to a
+    fragment of xml. The fragments replace the placeholders of the
+    serialised map, in order, and post_encode is called on the whole
+    tree once they are done. The xml is byte for byte what pymm.write
+    writes, under the same condition as for reading (that encoding a
+    branch does not depend on elements outside of it). Maps that cannot
+    be split (that are not a Map, have fewer than two branches, or hold
+    namespaced xml) are encoded in this process as pymm.write would.
+
+    Both pay for themselves on large, wide maps: packing and unpacking
+    branches is far cheaper than encoding or decoding them, but is not
+    free, and neither is starting the worker processes.
+
+        mindmap = pymm.read('huge.mm', workers=8)
+        pymm.write('huge.mm', mindmap, workers=8)
+"""
+import concurrent.futures
+import contextlib
+import gc
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+
+from . import element
+from . import factory
+from . import flat
+from . import lock as pymm_lock
+from . import serialize
+from . import stats as pymm_stats
+from .validate import ValidationReport
+
+#: tag of the elements standing in for branches while the rest of the map
+#: is decoded
+PLACEHOLDER = 'pymm_branch'
+
+#: number of bytes fed to the branch scanner at once
+_scan_chunk = 1 << 20
+
+#: encodings of which a branch may be parsed on its own
+_encodings = ('utf-8', 'utf8', 'us-ascii', 'ascii')
+_declaration = re.compile(rb'<\?xml[^>]*encoding=["\']([^"\']*)["\']')
+
+
+class _CannotSplit(Exception):
+    """raised when a map must be decoded as a whole after all, for
+    instance because its file changed since it was split
+    """
+
+
+def find_branches(data):
+    """return list of (start, end) byte ranges of the xml of each node
+    directly under the root node of mindmap xml data (bytes, or a buffer
+    such as mmap). Return None if data is not a mindmap whose branches
+    can be parsed on their own, or is str (as read from a text-mode
+    file), which has no byte ranges; it is then decoded whole
+    """
+    if isinstance(data, str):
+        return None
+    declared = _declaration.match(bytes(data[:200]))
+    if declared and declared.group(1).decode('ascii').lower() \
+            not in _encodings:
+        return None
+    parser = xml.parsers.expat.ParserCreate()
+    ranges = []
+    open_tags = []  # tags of the map and root node, while open
+    depth = 0
+    start = None  # byte index of the start of the current branch
+    nested = False  # whether current branch has child elements
+
+    def start_element(tag, attrib):
+        nonlocal depth, start, nested
+        if depth == 2 and tag == 'node' and open_tags == ['map', 'node']:
+            start, nested = parser.CurrentByteIndex, False
+        elif depth > 2:
+            nested = True
+        elif depth < 2:
+            open_tags.append(tag)
+        depth += 1
+
+    def end_element(tag):
+        nonlocal depth, start
+        depth -= 1
+        if depth == 2 and start is not None:
+            end = parser.CurrentByteIndex
+            # expat gives the end of an empty element, but the start of
+            # an end tag
+            if nested or data[end - 2:end] != b'/>':
+                end = data.find(b'>', end) + 1
+            ranges.append((start, end))
+            start = None
+        elif depth < 2:
+            open_tags.pop()
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    view = memoryview(data)
+    try:
+        for offset in range(0, len(view), _scan_chunk):
+            parser.Parse(bytes(view[offset:offset + _scan_chunk]), False)
+        parser.Parse(b'', True)
+    except xml.parsers.expat.ExpatError:
+        return None  # left for the normal parser to report
+    finally:
+        view.release()
+    return ranges
+
+
+def _skeleton(data, ranges):
+    """return data with the xml of each branch replaced by a
+    placeholder
+    """
+    pieces = []
+    previous = 0
+    placeholder = b'<' + PLACEHOLDER.encode('ascii') + b' />'
+    for start, end in ranges:
+        pieces.append(data[previous:start])
+        pieces.append(placeholder)
+        previous = end
+    pieces.append(data[previous:])
+    return b''.join(pieces)
+
+
+def _chunks(items, sizes, number):
+    """split items into about number lists of consecutive items, of
+    similar total size
+    """
+    target = sum(sizes) / number
+    chunks = [[]]
+    total = 0
+    for item, size in zip(items, sizes):
+        if total >= target and chunks[-1]:
+            chunks.append([])
+            total = 0
+        chunks[-1].append(item)
+        total += size
+    return chunks
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """pause the cyclic garbage collector. Building a large tree makes
+    the collector run repeatedly over all of it, though none of it is
+    garbage; that would take longer than the building itself
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _identity(stat):
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _decode_branches(source, ranges, validation, count):
+    """decode the branch of each of ranges in a worker process, and
+    return (list of packed branches, ValidationReport, ConversionStats
+    or None). source is (filename, identity of the file split), or
+    (None, list of the bytes of each branch)
+    """
+    filename, identity = source
+    if filename is None:
+        pieces = identity
+    else:
+        with open(filename, 'rb') as file:
+            if _identity(os.fstat(file.fileno())) != identity:
+                raise _CannotSplit(filename + ' changed while reading')
+            with mmap.mmap(file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as data:
+                pieces = [data[start:end] for start, end in ranges]
+    stats = pymm_stats.ConversionStats() if count else None
+    handler = factory.ConversionHandler(stats, validation=validation)
+    branches = []
+    with _gc_paused():
+        for piece in pieces:
+            branches.append(_decode_branch(handler, piece))
+    report = handler.spec_report
+    report.where = None
+    return branches, report, stats
+
+
+def _decode_branch(handler, piece):
+    """return packed branch decoded from xml piece, or None"""
+    try:
+        et_elem = ET.fromstring(piece)
+    except ET.ParseError:
+        raise _CannotSplit('branch cannot be parsed on its own')
+    try:
+        branch = handler.convert_queue(et_elem, False)
+    except Exception as error:
+        handler.trace.annotate(error)
+        del error.conversion_trace  # holds elements of this process
+        raise
+    return None if branch is None else flat.pack(branch)
+
+
+def _path(elem):
+    """return path of pymm element from the top of its tree"""
+    labels = []
+    while elem is not None:
+        labels.append(factory._label(elem))
+        elem = elem._parent
+    return '/'.join(reversed(labels))
+
+
+def _decode_whole(data, stats, validation):
+    from .pymm import decode
+    with pymm_stats.phase(stats, 'parse'):
+        et_elem = serialize.fromstring(data)
+    return decode(et_elem, stats, validation)
+
+
+def _decode_split(data, ranges, source, stats, validation, executor,
+                  workers):
+    """decode data, with each branch in ranges decoded by executor.
+    Phases and counts are added to stats only if the map could be split
+    """
+    futures = []
+    sizes = [end - start for start, end in ranges]
+    for chunk in _chunks(ranges, sizes, workers * 4):
+        if source[0] is None:
+            chunk_source = (None, [bytes(data[start:end])
+                                   for start, end in chunk])
+        else:
+            chunk_source = source
+        futures.append(executor.submit(_decode_branches, chunk_source,
+                                       chunk, validation, stats is not None))
+    split_stats = None if stats is None else pymm_stats.ConversionStats()
+    handler = factory.ConversionHandler(split_stats, validation=validation)
+    report = handler.spec_report
+    try:
+        with _gc_paused(), pymm_stats.phase(split_stats, 'parse'):
+            try:
+                et_elem = ET.fromstring(_skeleton(data, ranges))
+            except ET.ParseError:
+                raise _CannotSplit('map cannot be parsed without branches')
+        with _gc_paused(), pymm_stats.phase(split_stats, 'decode'):
+            top = handler.convert_queue(et_elem, False)
+            placeholders = [
+                (parent, position)
+                for _, parent, _ in top.iter_preorder(tag='node')
+                for position, child in enumerate(parent.children)
+                if child.tag == PLACEHOLDER
+            ]
+            if len(placeholders) != len(ranges):
+                raise _CannotSplit('factories changed the branches')
+            prefix = _path(placeholders[0][0]) + '/'
+            dropped = []  # placeholders of branches decoded to nothing
+            placeholders = iter(placeholders)
+            for future in futures:
+                branches, branch_report, branch_stats = future.result()
+                report.update(branch_report, prefix)
+                if branch_stats is not None:
+                    split_stats.update(branch_stats)
+                for branch in branches:
+                    parent, position = next(placeholders)
+                    if branch is None:
+                        dropped.append((parent, position))
+                        continue
+                    branch = flat.unpack(branch)
+                    branch._tail = parent.children[position]._tail
+                    parent.children[position] = branch
+            for parent, position in reversed(dropped):
+                del parent.children[position]
+        with pymm_stats.phase(split_stats, 'post_decode'):
+            handler.convert_notify(top, 'post_decode')
+    except _CannotSplit:
+        for future in futures:
+            future.cancel()
+        raise
+    except Exception as error:
+        for future in futures:
+            future.cancel()
+        handler.trace.annotate(error)
+        raise
+    if stats is not None:
+        # placeholders were counted as elements of the default factory
+        del split_stats.tags[PLACEHOLDER]
+        split_stats.factories[
+            split_stats.factory_name(factory.DefaultFactory)
+        ] -= len(ranges)
+        split_stats.spec_mismatches = report.count
+        stats.update(split_stats)
+    report.handle(validation)
+    return top
+
+
+def read(file_or_filename, workers=None, executor=None, timestamps=False,
+         stats=None, validation='lenient', timeout=None):
+    """decode the file/filename into a pymm tree, as pymm.read does,
+    decoding the branches of the map in worker processes.
+
+    :param file_or_filename: string path to file or file instance of
+                             mindmap. A text-mode file is decoded in
+                             this process, without splitting
+    :param workers: number of worker processes (default: one per cpu)
+    :param executor: concurrent.futures.ProcessPoolExecutor to decode
+                     branches in. If None, one with workers processes is
+                     started, and shut down once the map is read
+    :param timestamps: build a TimestampIndex (see pymm.read)
+    :param stats: optional pymm.ConversionStats (see pymm.read). Phases
+                  are timed in this process
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+    :param timeout: seconds to wait for a writer of the file to finish
+                    before raising pymm.LockTimeout (see pymm.read)
+    """
+    from .pymm import Mindmap, file_locked
+    workers = workers or os.cpu_count() or 1
+    if pymm_lock.is_path(file_or_filename):
+        file = open(file_or_filename, 'rb')
+        source = None
+    else:
+        file = None
+        source = (None, None)
+    # must lock default_mindmap_filename (see pymm.read)
+    data = None
+    with file_locked(file_or_filename, False, timeout), \
+            file_locked(Mindmap.default_mindmap_filename), \
+            pymm_stats.conversion(stats):
+        try:
+            if file is None:
+                data = file_or_filename.read()
+            elif os.fstat(file.fileno()).st_size:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                source = (os.path.realpath(file_or_filename),
+                          _identity(os.fstat(file.fileno())))
+            else:
+                data = b''
+            with pymm_stats.phase(stats, 'parse'):
+                ranges = find_branches(data)
+            pymm_elem = None
+            if ranges is not None and len(ranges) > 1:
+                own_executor = executor is None
+                if own_executor:
+                    executor = concurrent.futures.ProcessPoolExecutor(
+                        min(workers, len(ranges))
+                    )
+                try:
+                    pymm_elem = _decode_split(data, ranges, source, stats,
+                                              validation, executor, workers)
+                except _CannotSplit:
+                    pass
+                finally:
+                    if own_executor:
+                        executor.shutdown(cancel_futures=True)
+            if pymm_elem is None:
+                pymm_elem = _decode_whole(data, stats, validation)
+        finally:
+            if file is not None:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+                file.close()
+    if timestamps:
+        from .index import TimestampIndex
+        pymm_elem.timestamps = TimestampIndex(pymm_elem)
+    return pymm_elem
+
+
+class _BranchFactory:
+    """stands in for the factory of a branch while the rest of a map is
+    encoded: encodes it as a placeholder, without its children
+    """
+    spec_report = None
+
+    def encode(self, parent, src_element):
+        placeholder = ET.Element(PLACEHOLDER)
+        placeholder.tail = None  # the branch's fragment ends with its tail
+        if parent is not None:
+            parent.append(placeholder)
+        return placeholder, []
+
+
+class _SkeletonHandler(factory.ConversionHandler):
+    """ConversionHandler that encodes each element of branch_ids (ids of
+    pymm elements) as a placeholder, and lists those elements in
+    branches in the order they are encoded
+    """
+
+    def __init__(self, stats=None, validation='lenient'):
+        super().__init__(stats, validation=validation)
+        self.branch_ids = frozenset()
+        self.branches = []
+
+    def find_encode_factory(self, elem):
+        if id(elem) in self.branch_ids:
+            self.branches.append(elem)
+            return _BranchFactory
+        return super().find_encode_factory(elem)
+
+
+def _serialise(et_elem):
+    """return xml of et_element, as pymm.write writes it. Raise
+    _CannotSplit if it has namespaced tags or attrib keys, of which
+    xml.etree declares the namespaces on the top element only
+    """
+    try:
+        pieces = serialize._build(et_elem, False, '')
+    except serialize._NamespacedTag:
+        raise _CannotSplit('namespaced xml must be serialised whole')
+    return ''.join(pieces).encode('us-ascii', 'xmlcharrefreplace')
+
+
+def _encode_branches(branches, validation, count):
+    """encode each of branches (packed) in a worker process, and
+    return (list of xml fragments, ValidationReport, ConversionStats or
+    None)
+    """
+    stats = pymm_stats.ConversionStats() if count else None
+    handler = factory.ConversionHandler(stats, validation=validation)
+    fragments = []
+    with _gc_paused():
+        for packed in branches:
+            branch = flat.unpack(packed)
+            try:
+                et_elem = handler.convert_queue(branch, True)
+            except Exception as error:
+                handler.trace.annotate(error)
+                del error.conversion_trace  # holds elements of this process
+                raise
+            fragments.append(b'' if et_elem is None else _serialise(et_elem))
+    report = handler.spec_report
+    report.where = None
+    return fragments, report, stats
+
+
+def _split_branches(pymm_element):
+    """return list of the branches of a map: the nodes directly under
+    its root node. Return an empty list if pymm_element is not a map
+    """
+    if pymm_element.tag != 'map':
+        return []
+    root = pymm_element.find(tag='node')
+    if root is None:
+        return []
+    return [child for child in root.children if child.tag == 'node']
+
+
+def _encode_split(handler, top, workers, executor, stats):
+    """return xml of top, encoded by handler (after pre_encode) with its
+    branches encoded by executor (an executor, or a function returning
+    one). Counts of converted elements are added to stats
+    """
+    queue_stats = None if stats is None else pymm_stats.ConversionStats()
+    handler.stats = queue_stats
+    with pymm_stats.phase(stats, 'encode'):
+        branches = _split_branches(top)
+        if len(branches) > 1:
+            handler.branch_ids = frozenset(id(branch) for branch in branches)
+        et_elem = handler.convert_queue(top, True)
+        branches = handler.branches
+        handler.branch_ids = frozenset()
+    fragments = None
+    if len(branches) > 1:
+        try:
+            with pymm_stats.phase(stats, 'serialise'):
+                pieces = _serialise(et_elem).split(
+                    b'<' + PLACEHOLDER.encode('ascii') + b' />'
+                )
+            with pymm_stats.phase(stats, 'encode'):
+                fragments = _encode_remote(handler, branches, workers,
+                                           executor, queue_stats)
+        except _CannotSplit:
+            pass
+    if fragments is None:
+        # encode again as a whole, forgetting branch counts and reports
+        handler.spec_report = ValidationReport(
+            max_locations=handler.spec_report.max_locations,
+            where=handler.location,
+        )
+        handler.stats = queue_stats = (
+            None if stats is None else pymm_stats.ConversionStats()
+        )
+        with pymm_stats.phase(stats, 'encode'):
+            et_elem = handler.convert_queue(top, True)
+        with pymm_stats.phase(stats, 'serialise'):
+            data = serialize.tostring(et_elem)
+    else:
+        with pymm_stats.phase(stats, 'serialise'):
+            joined = [pieces[0]]
+            for fragment, piece in zip(fragments, pieces[1:]):
+                joined.append(fragment)
+                joined.append(piece)
+            data = b''.join(joined)
+    handler.stats = stats
+    if stats is not None:
+        stats.update(queue_stats)
+    return data
+
+
+def _encode_remote(handler, branches, workers, executor, queue_stats):
+    """return list of xml fragments of branches, encoded by executor.
+    Their reports and counts are added to handler's and queue_stats
+    """
+    with _gc_paused():
+        packed = [flat.pack(branch) for branch in branches]
+    if callable(executor):
+        executor = executor(min(workers, len(branches)))
+    futures = []
+    sizes = [flat.packed_size(branch) for branch in packed]
+    for chunk in _chunks(packed, sizes, workers * 4):
+        futures.append(executor.submit(_encode_branches, chunk,
+                                       handler.validation,
+                                       queue_stats is not None))
+    prefix = _path(branches[0]._parent) + '/'
+    fragments = []
+    try:
+        for future in futures:
+            branch_fragments, branch_report, branch_stats = future.result()
+            fragments.extend(branch_fragments)
+            handler.spec_report.update(branch_report, prefix)
+            if branch_stats is not None:
+                queue_stats.update(branch_stats)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    if queue_stats is not None:
+        # branch top elements were counted here, and again by workers
+        del queue_stats.factories[queue_stats.factory_name(_BranchFactory)]
+        for branch in branches:
+            queue_stats.tags[branch.tag] -= 1
+    return fragments
+
+
+def _encode(pymm_element, workers, executor, stats, validation):
+    """return xml of pymm_element (see tostring)"""
+    workers = workers or os.cpu_count() or 1
+    started = []
+
+    def start(number):
+        started.append(concurrent.futures.ProcessPoolExecutor(number))
+        return started[0]
+
+    handler = _SkeletonHandler(stats, validation)
+    try:
+        with pymm_stats.phase(stats, 'pre_encode'):
+            handler.convert_notify(pymm_element, 'pre_encode')
+        data = _encode_split(handler, pymm_element, workers,
+                             executor or start, stats)
+        with pymm_stats.phase(stats, 'post_encode'):
+            handler.convert_notify(pymm_element, 'post_encode')
+    except Exception as error:
+        handler.trace.annotate(error)
+        raise
+    finally:
+        for own_executor in started:
+            own_executor.shutdown(cancel_futures=True)
+    report = handler.spec_report
+    if stats is not None:
+        stats.spec_mismatches += report.count
+    report.handle(validation)
+    return data
+
+
+def tostring(pymm_element, workers=None, executor=None, stats=None,
+             validation='lenient'):
+    """return the xml (bytes) that pymm.write writes of pymm_element,
+    encoding the branches of a map in worker processes.
+
+    :param pymm_element: Mindmap or other pymm element
+    :param workers: number of worker processes (default: one per cpu)
+    :param executor: concurrent.futures.ProcessPoolExecutor to encode
+                     branches in. If None, one with workers processes is
+                     started when needed, and shut down once encoded
+    :param stats: optional pymm.ConversionStats (see pymm.write). Phases
+                  are timed in this process
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+    """
+    if not isinstance(pymm_element, element.BaseElement):
+        raise ValueError('pymm.parallel.tostring requires a pymm element')
+    with pymm_stats.conversion(stats):
+        return _encode(pymm_element, workers, executor, stats, validation)
+
+
+def write(file_or_filename, pymm_element, workers=None, executor=None,
+          stats=None, validation='lenient', timeout=None):
+    """write mindmap/element to file, as pymm.write does, encoding the
+    branches of a map in worker processes. The file is written byte for
+    byte as pymm.write writes it.
+
+    :param file_or_filename: string path to file or binary file
+                             instance of mindmap (.mm)
+    :param pymm_element: Mindmap or other pymm element
+    :param workers: number of worker processes (default: one per cpu)
+    :param executor: concurrent.futures.ProcessPoolExecutor (see tostring)
+    :param stats: optional pymm.ConversionStats (see pymm.write)
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read). If
+                       strict, nothing is written when an attrib value
+                       does not match spec
+    :param timeout: seconds to wait for readers and writers of the file
+                    before raising pymm.LockTimeout (see pymm.write)
+    """
+    from .pymm import _write_locked
+    if not isinstance(pymm_element, element.BaseElement):
+        raise ValueError(
+            'pymm.write requires file/filename, then pymm element'
+        )
+    with pymm_stats.conversion(stats):
+        data = _encode(pymm_element, workers, executor, stats, validation)
+        if not pymm_lock.is_path(file_or_filename):
+            with pymm_stats.phase(stats, 'serialise'):
+                file_or_filename.write(data)
+            return
+        _write_locked(file_or_filename, lambda file: file.write(data),
+                      stats, timeout)
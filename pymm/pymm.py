@@ -14,20 +14,25 @@
     new and experienced with Freeplane.
 """
 import xml.etree.ElementTree as ET
+import contextlib
 import os
+import threading
 import warnings
 import types
 from collections import defaultdict
 from . import element
-from . import factory
-from . import decode as _decode
-from . import encode as _encode
+from . import lock as pymm_lock
+from . import serialize
+from . import stats as pymm_stats
+from .validate import validate, ValidationError
+from .convert import decode, encode
 
 # import most-likely to be used Elements
 from .element import Node, Cloud, Icon, Edge, Arrow
 
 
-def read(file_or_filename):
+def read(file_or_filename, timestamps=False, stats=None,
+         validation='lenient', timeout=None, workers=None):
     """decode the file/filename into a pymm tree. User should expect to
     use this module-wide function to decode a freeplane file (.mm) into
     a pymm tree. If file specified is a fully-formed mindmap, the user
@@ -36,22 +41,51 @@ def read(file_or_filename):
 
     :param file_or_filename: string path to file or file instance of
                              mindmap
+    :param timestamps: if True, build a TimestampIndex over the decoded
+                       tree and make it available as .timestamps on the
+                       returned element
+    :param stats: optional pymm.ConversionStats in which to record time
+                  spent per phase and counts of converted elements
+    :param validation: what to do with attrib values that do not match
+                       spec: 'lenient' issues one SpecWarning for all of
+                       them, 'strict' raises pymm.ValidationError, and
+                       'off' ignores them (see pymm.validate)
+    :param timeout: seconds to wait for a writer of the file (in this or
+                    another process) to finish before raising
+                    pymm.LockTimeout. None waits as long as it takes
+    :param workers: if given, decode the branches of a large map in this
+                    many worker processes (see pymm.parallel)
     :return: If the file passed was a full mindmap, will return Mindmap
              instance, otherwise if file represents an incomplete
              mindmap, it will pass the instance of the top-level
              element, which could be BaseElement or any inheriting
              element in the Elements module.
     """
+    if workers is not None:
+        from . import parallel
+        return parallel.read(file_or_filename, workers, None, timestamps,
+                             stats, validation, timeout)
+    # default hierarchy is package data that pymm never writes, so it is
+    # only marked as locked, and no lock file is made beside it
+    exclusive = None
+    if file_or_filename != Mindmap.default_mindmap_filename:
+        exclusive = False
     # must lock default_mindmap_filename
-    with file_locked(file_or_filename), \
-            file_locked(Mindmap.default_mindmap_filename):
-        tree = ET.parse(file_or_filename)
+    with file_locked(file_or_filename, exclusive, timeout), \
+            file_locked(Mindmap.default_mindmap_filename), \
+            pymm_stats.conversion(stats):
+        with pymm_stats.phase(stats, 'parse'):
+            tree = ET.parse(file_or_filename)
         et_elem = tree.getroot()
-        pymm_elem = decode(et_elem)
+        pymm_elem = decode(et_elem, stats, validation)
+    if timestamps:
+        from .index import TimestampIndex
+        pymm_elem.timestamps = TimestampIndex(pymm_elem)
     return pymm_elem
 
 
-def write(file_or_filename, pymm_element):
+def write(file_or_filename, pymm_element, stats=None, validation='lenient',
+          timeout=None, workers=None):
     """Writes mindmap/element to file. Element must be pymm element.
     Will write element and children hierarchy to file.
     Writing any element to file works, but in order to be opened
@@ -60,77 +94,116 @@ def write(file_or_filename, pymm_element):
     :param mm_element: Mindmap or other pymm element
     :param file_or_filename: string path to file or file instance
         of mindmap (.mm)
+    :param stats: optional pymm.ConversionStats in which to record time
+                  spent per phase and counts of converted elements
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read).
+                       If strict, nothing is written when an attrib
+                       value does not match spec
+    :param timeout: seconds to wait for readers and writers of the file
+                    (in this or another process) to finish before
+                    raising pymm.LockTimeout. None waits as long as it
+                    takes. When writing to a filename, the file is
+                    replaced atomically, so it is never seen half-written
+    :param workers: if given, encode the branches of a large map in this
+                    many worker processes (see pymm.parallel). The file
+                    written is the same
     :return:
     """
     if not isinstance(pymm_element, element.BaseElement):
         raise ValueError(
             'pymm.write requires file/filename, then pymm element'
         )
-    et_elem = encode(pymm_element)
-    xmltree = ET.ElementTree(et_elem)
-    xmltree.write(file_or_filename)
-
-
-class decode:
-    """function-like class that allows decorating of functions to
-    configure a pymm element post-decode. If called with an element,
-    instead decode the supplied element and return it's decoded state
+    if workers is not None:
+        from . import parallel
+        return parallel.write(file_or_filename, pymm_element, workers, None,
+                              stats, validation, timeout)
+    with pymm_stats.conversion(stats):
+        et_elem = encode(pymm_element, stats, validation)
+        xmltree = ET.ElementTree(et_elem)
+        if not pymm_lock.is_path(file_or_filename):
+            with pymm_stats.phase(stats, 'serialise'):
+                xmltree.write(file_or_filename)
+            return
+        _write_locked(file_or_filename, xmltree.write, stats, timeout)
+
+
+def _write_locked(path, write, stats, timeout):
+    """call write with a binary file that then atomically replaces the
+    file at path, holding an exclusive lock on path throughout. In stats,
+    waiting for the lock is timed as phase lock, write as serialise, and
+    flushing to disk and renaming as sync (see pymm.lock.atomic_write)
     """
-
-    def __new__(cls, et_element):
-        """decode ElementTree Element to pymm Element.
-
-        :param et_element: Element Tree Element -> generally an element
-                           from python's xml.etree.ElementTree module
-        :return: Pymm hierarchical tree. Usually Mindmap instance but
-                 may return BaseElement-inheriting element if
-                 et_element was not complete mindmap hierarchy.
-        """
-        if isinstance(et_element, element.BaseElement):
-            raise ValueError('cannot decode a pymm element')
-        return factory.decode(et_element)
-
-    @staticmethod
-    def post_decode(fxn):
-        _decode.post_decode(fxn)
-        return fxn
-
-
-class encode:
-    """function-like class that allows decorating of functions to
-    configure a pymm element post-decode. If called with an element,
-    instead decode the supplied element and return it's decoded state
+    with contextlib.ExitStack() as stack:
+        with pymm_stats.phase(stats, 'lock'):
+            stack.enter_context(file_locked(path, True, timeout))
+        file = stack.enter_context(pymm_lock.atomic_write(path, stats))
+        with pymm_stats.phase(stats, 'serialise'):
+            write(file)
+
+
+def tostring(pymm_element, encoding='us-ascii', pretty=False, stats=None,
+             validation='lenient'):
+    """Encode element and its children hierarchy, through the same
+    factories as pymm.write, and return the xml in memory.
+
+    :param pymm_element: Mindmap or other pymm element
+    :param encoding: 'unicode' to return str, otherwise the encoding of
+                     the returned bytes. Defaults to us-ascii bytes,
+                     which is what pymm.write writes to file
+    :param pretty: if True, indent children on their own lines
+    :param stats: optional pymm.ConversionStats (see pymm.write)
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+    :return: str if encoding is 'unicode', otherwise bytes
+    """
+    if not isinstance(pymm_element, element.BaseElement):
+        raise ValueError('pymm.tostring requires a pymm element')
+    with pymm_stats.conversion(stats):
+        et_elem = encode(pymm_element, stats, validation)
+        with pymm_stats.phase(stats, 'serialise'):
+            return serialize.tostring(
+                et_elem, encoding=encoding, pretty=pretty
+            )
+
+
+def fromstring(data, stats=None, validation='lenient'):
+    """decode xml held in memory into a pymm tree, through the same
+    factories as pymm.read.
+
+    :param data: xml as str, bytes, or any buffer such as bytearray,
+                 memoryview or mmap
+    :param stats: optional pymm.ConversionStats (see pymm.read)
+    :param validation: 'lenient', 'strict' or 'off' (see pymm.read)
+    :return: Mindmap instance if data is a full mindmap, otherwise the
+             top-level pymm element
     """
+    with file_locked(Mindmap.default_mindmap_filename), \
+            pymm_stats.conversion(stats):
+        with pymm_stats.phase(stats, 'parse'):
+            et_elem = serialize.fromstring(data)
+        pymm_elem = decode(et_elem, stats, validation)
+    return pymm_elem
 
-    def __new__(cls, pymm_element):
-        """encode pymm Element to ElementTree Element
 
-        :param mm_element: pymm Element from pymm.Elements module
-        :return: xml.etree version of passed pymm tree
-        """
-        if not isinstance(pymm_element, element.BaseElement):
-            raise ValueError('encoding requires a pymm element')
-        return factory.encode(pymm_element)
+class _LockedFiles(threading.local):
+    """files marked as locked by the current thread, as
+    {file: number of file_locked contexts marking it}. Marks are kept per
+    thread, so that one thread reading a file does not change what
+    another thread sees
+    """
 
-    @staticmethod
-    def pre_encode(fxn):
-        _encode.pre_encode(fxn)
-        return fxn
+    def __init__(self):
+        self.counts = defaultdict(int)
 
-    @staticmethod
-    def post_encode(fxn):
-        _encode.post_encode(fxn)
-        return fxn
+    def __getitem__(self, file):
+        return self.counts.get(file, 0) > 0
 
-    @staticmethod
-    def get_attrib(fxn):
-        _encode.get_attrib(fxn)
-        return fxn
+    def items(self):
+        return [(file, count > 0) for file, count in self.counts.items()]
 
-    @staticmethod
-    def get_children(fxn):
-        _encode.get_children(fxn)
-        return fxn
+    def mark(self, file, change):
+        self.counts[file] += change
+        if not self.counts[file]:
+            del self.counts[file]
 
 
 class file_locked:
@@ -138,25 +211,56 @@ class file_locked:
     filename is locked or not. If used as a context manager, file is
     marked as locked until context exit. This is intended to be used by
     pymm.read to signify when reading from file, and by Mindmap to load
-    it's default hierarchy only if a file is not currently loading
+    it's default hierarchy only if a file is not currently loading.
+    Marks only concern the current thread.
+
+    If exclusive is given and file is a path, the context also holds a
+    pymm.FileLock on the file: shared (for reading) if exclusive is
+    False, otherwise exclusive (for writing). timeout is passed on to the
+    FileLock
     """
-    locked = defaultdict(bool)
+    locked = _LockedFiles()
     file_to_lock = None
 
-    def __init__(self, file_to_lock):
+    def __init__(self, file_to_lock, exclusive=None, timeout=None):
         self.file_to_lock = file_to_lock
+        self.file_lock = None
+        if exclusive is not None and pymm_lock.is_path(file_to_lock):
+            self.file_lock = pymm_lock.FileLock(
+                file_to_lock, exclusive, timeout
+            )
 
     def __bool__(self):
         return self.locked[self.file_to_lock]
 
     def __enter__(self, *_):
-        """set lock on file to True"""
-        self.locked[self.file_to_lock] = True
+        """take lock, if any, and mark file as locked"""
+        if self.file_lock is not None:
+            self.file_lock.acquire()
+        self.locked.mark(self.file_to_lock, +1)
         return self
 
     def __exit__(self, *error):
-        """reset lock on file to False"""
-        self.locked[self.file_to_lock] = False
+        """unmark file and release lock"""
+        self.locked.mark(self.file_to_lock, -1)
+        if self.file_lock is not None:
+            self.file_lock.release()
+
+
+#: decoded default hierarchy of each Mindmap class, as
+#: {class: ((filename, snapshot of factories), mindmap)}. Each new
+#: default mindmap is a clone of it (see Mindmap.default_mindmap)
+_default_prototypes = {}
+_default_prototypes_lock = threading.RLock()
+
+
+def _same_prototype_key(cached_key, key):
+    """return whether a prototype cached under cached_key may be used
+    for key, a (filename, snapshot of factories). Snapshots are compared
+    by identity, as each change to the registries builds a new one
+    """
+    return cached_key is not None and cached_key[0] == key[0] and \
+        cached_key[1] is key[1]
 
 
 class Mindmap(element.Map):
@@ -221,10 +325,29 @@ class Mindmap(element.Map):
     @classmethod
     def default_mindmap(cls, **attrib):
         """load default hierarchy for mindmap -- including map_styles
-        and automatic node coloring hook. Loads file by re-initiating
-        class with arguments to load default hierarchy file.
+        and automatic node coloring hook. The default hierarchy file is
+        decoded once (by re-initiating class with arguments to load the
+        file) and kept as a prototype; each call returns a clone of it.
+        The prototype is decoded again if default_mindmap_filename
+        changes or element or factory classes are registered or removed,
+        which gives a new snapshot of factories (see
+        FactoryRegistry.snapshot).
         """
-        return cls.__new__(cls, cls.default_mindmap_filename, **attrib)
+        from . import factory  # factories are built on first use
+        key = (cls.default_mindmap_filename, factory.registry.snapshot())
+        cached_key, prototype = _default_prototypes.get(cls, (None, None))
+        if not _same_prototype_key(cached_key, key):
+            # decode once, even if several threads want it at once
+            with _default_prototypes_lock:
+                cached_key, prototype = _default_prototypes.get(
+                    cls, (None, None)
+                )
+                if not _same_prototype_key(cached_key, key):
+                    prototype = cls.__new__(
+                        cls, cls.default_mindmap_filename, **attrib
+                    )
+                    _default_prototypes[cls] = (key, prototype)
+        return prototype.clone(new_ids=False)
 
     def __enter__(self):
         """allow user to use Mindmap as context-manager, in which
@@ -240,3 +363,15 @@ class Mindmap(element.Map):
         """
         if 'w' in self.mode:
             write(self.filename, self)
+
+    async def __aenter__(self):
+        """allow use as an async context-manager (see pymm.aopen)"""
+        return self
+
+    async def __aexit__(self, *error):
+        """as __exit__, but write with pymm.awrite, so that the event
+        loop is not blocked
+        """
+        if 'w' in self.mode:
+            from .aio import awrite
+            await awrite(self.filename, self)
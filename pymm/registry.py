@@ -3,12 +3,21 @@
     factory.py. These metaclasses are responsible for keeping track of
     each element or factory class created, including any new elements
     created by you. This is done so that newly created elements are
-    automaticallly used when reading from a mindmap
+    automaticallly used when reading from a mindmap.
+
+    Registration is locked, and conversions share an immutable snapshot
+    of the factories (see FactoryRegistry.snapshot), so that pymm may
+    read and write from several threads at once.
 """
 import collections
+import threading
 from uuid import uuid4
-from . import decode
-from . import encode
+from .decode import unclaimed as unclaimed_decoders
+from .encode import unclaimed as unclaimed_encoders
+
+#: held while registering element or factory classes, and while building
+#: a snapshot of factories
+_lock = threading.RLock()
 
 
 class ElementRegistry(type):
@@ -28,7 +37,8 @@ class ElementRegistry(type):
     @classmethod
     def get_decorated_fxns(cls):
         """Return dict of encode/decode-decorated fxns"""
-        return dict(cls._decorated_fxns)
+        with _lock:
+            return dict(cls._decorated_fxns)
 
     def __new__(cls, clsname, bases, attr_dict):
         """Record unaltered class. In addition, identify encode/decode
@@ -38,8 +48,11 @@ class ElementRegistry(type):
         called with the proper arguments during encode/decode.
         """
         ElementClass = super().__new__(cls, clsname, bases, attr_dict)
-        decorated = dict(decode.unclaimed)
-        decorated.update(encode.unclaimed)
+        # claiming erases unclaimed @decode or @encode, but give error if
+        # some fxns went unclaimed
+        decorated = unclaimed_decoders.claim()
+        decorated.update(unclaimed_encoders.claim())
+        class_decorated = {}
         for fxn_name, fxn in attr_dict.items():
             try:
                 hash(fxn)
@@ -47,13 +60,11 @@ class ElementRegistry(type):
                 continue
             if fxn in decorated:
                 event_name = decorated.pop(fxn)
-                class_decorated = cls._decorated_fxns[ElementClass]
                 class_decorated[event_name] = fxn
-        cls._elements.append(ElementClass)
-        #erase unclaimed @decode or @encode, but give error if some fxns
-        #went unclaimed
-        decode.unclaimed.clear()
-        encode.unclaimed.clear()
+        with _lock:
+            if class_decorated:
+                cls._decorated_fxns[ElementClass] = class_decorated
+            cls._elements.append(ElementClass)
         if decorated:
             raise RuntimeError(
                 '@decode or @encode must be used to decorate a function ' +
@@ -66,23 +77,32 @@ class ElementRegistry(type):
     class attribute_searched:
         """class to use in keeping track of which attribute is being
         looked up currently. Used to prevent recursive __getattr__
-        calls
+        calls. Searches are kept per thread, so that a search in one
+        thread does not hide a missing attribute in another
         """
-        _searched = collections.defaultdict(bool)
+        _local = threading.local()  # .searched: set of names per thread
         _name = None
 
         def __init__(self, name):
             self._name = name
 
+        @classmethod
+        def _searched(cls):
+            try:
+                return cls._local.searched
+            except AttributeError:
+                cls._local.searched = set()
+                return cls._local.searched
+
         def __bool__(self):
-            return self._searched[self._name]
+            return self._name in self._searched()
 
         def __enter__(self):
-            self._searched[self._name] = True
+            self._searched().add(self._name)
             return self
 
         def __exit__(self, *errors):
-            self._searched[self._name] = False
+            self._searched().discard(self._name)
 
     @classmethod
     def identify_attribute_error(mcs, element, name):
@@ -151,24 +171,47 @@ class FactoryRegistry(type):
     """
     _factories = []
     verbose = False
-    _skip_registration = ''
     default = None
+    # (elements and factories it was built from, factories)
+    _snapshot = (None, ())
 
     @classmethod
     def get_factories(cls):
-        factories = list(tuple(cls._factories))
-        generated = cls.create_unclaimed_element_factories(factories)
-        return factories + generated
+        return list(cls.snapshot())
+
+    @classmethod
+    def snapshot(cls):
+        """return tuple of registered factories followed by factories
+        generated for unclaimed elements. The tuple is built once, and
+        shared until an element or factory class is registered (or
+        removed from a registry). It is never changed, so conversions
+        running in several threads may use it at once
+        """
+        built_from, factories = cls._snapshot
+        if built_from != (tuple(ElementRegistry._elements),
+                          tuple(cls._factories)):
+            with _lock:
+                key = tuple(ElementRegistry._elements), tuple(cls._factories)
+                built_from, factories = cls._snapshot
+                if built_from != key:
+                    registered = list(key[1])
+                    generated = cls.create_unclaimed_element_factories(
+                        registered
+                    )
+                    factories = tuple(registered + generated)
+                    cls._snapshot = (key, factories)
+        return factories
 
     def __new__(mcs, clsname, bases, attr_dict):
         """create Factory-class, and register it in list of factories
         """
         FactoryClass = super().__new__(mcs, clsname, bases, attr_dict)
         # do not register factory if it was generated by this metaclass
-        if clsname != mcs._skip_registration:
-            if mcs.default is None:
-                mcs.default = FactoryClass  # keep default factory reference
-            mcs._factories.append(FactoryClass)
+        if not attr_dict.get('_generated', False):
+            with _lock:
+                if mcs.default is None:
+                    mcs.default = FactoryClass  # keep default factory
+                mcs._factories.append(FactoryClass)
         return FactoryClass
 
     @classmethod
@@ -218,9 +261,8 @@ class FactoryRegistry(type):
             )
         element_name = getattr(elem, '__name__', elem.tag)
         name = element_name + '-Factory@' + uuid4().hex
-        cls._skip_registration = name
         inherit_from = (closest_matching_factory,)
-        variables = {'decoding_element': elem}
+        variables = {'decoding_element': elem, '_generated': True}
         def simulate_bound_method(event_fxn):
             """wrap function to discard the first argument, thereby
             simulating a method call for the 2nd argument, the element.
@@ -0,0 +1,157 @@
+"""
+    serialize converts between in-memory xml (str, bytes, or any buffer
+    such as memoryview or mmap) and xml.etree elements. Writing is done
+    by a single-pass, non-recursive builder that appends each piece of
+    xml to one list and joins it once, producing the same xml that
+    xml.etree.ElementTree.tostring would. Reading feeds the buffer to
+    xml.etree's parser in chunks so that large buffers are not copied.
+    pymm.tostring and pymm.fromstring use these functions together with
+    the normal encode/decode factories.
+"""
+import xml.etree.ElementTree as ET
+
+#: number of bytes fed to the xml parser at once when parsing a buffer
+CHUNK_SIZE = 1 << 20
+
+
+class _NamespacedTag(Exception):
+    """raised by the builder when it meets a namespaced {uri}tag, which
+    is left to xml.etree to serialize
+    """
+
+
+def _escape_cdata(text):
+    """escape character data, as xml.etree does"""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def _escape_attrib(text):
+    """escape attribute value, as xml.etree does"""
+    text = _escape_cdata(text)
+    if '"' in text:
+        text = text.replace('"', '&quot;')
+    if '\r' in text:
+        text = text.replace('\r', '&#13;')
+    if '\n' in text:
+        text = text.replace('\n', '&#10;')
+    if '\t' in text:
+        text = text.replace('\t', '&#09;')
+    return text
+
+
+def _build(et_element, pretty, indent):
+    """return list of str pieces that make up the xml of et_element and
+    all its children. If pretty, whitespace-only text and tails are
+    replaced with newlines and indent
+    """
+    pieces = []
+    write = pieces.append
+    # stack holds (element, depth, indent-before, is-end-tag)
+    stack = [(et_element, 0, False, False)]
+    while stack:
+        elem, depth, lead, is_end_tag = stack.pop()
+        if is_end_tag:
+            if lead:
+                write('\n' + indent * depth)
+            write('</' + elem.tag + '>')
+            tail = elem.tail
+            if tail and not (pretty and tail.isspace()):
+                write(_escape_cdata(tail))
+            continue
+        tag = elem.tag
+        if lead:
+            write('\n' + indent * depth)
+        if tag is ET.Comment:
+            write('<!--%s-->' % (elem.text,))  # None as xml.etree writes it
+        elif tag is ET.ProcessingInstruction:
+            write('<?%s?>' % (elem.text,))
+        else:
+            if tag[:1] == '{':
+                raise _NamespacedTag(tag)
+            write('<' + tag)
+            for key, value in elem.attrib.items():
+                if key[:1] == '{':
+                    raise _NamespacedTag(key)
+                write(' ' + key + '="' + _escape_attrib(value) + '"')
+            text = elem.text
+            if pretty and text and text.isspace():
+                text = None
+            children = list(elem)
+            if text or children:
+                write('>')
+                if text:
+                    write(_escape_cdata(text))
+                lead_end = False
+                if children:
+                    last_tail = children[-1].tail
+                    lead_end = pretty and not (last_tail and
+                                               not last_tail.isspace())
+                stack.append((elem, depth, lead_end, True))
+                preceding = text
+                starts = []
+                for child in children:
+                    child_lead = pretty and not preceding
+                    starts.append((child, depth + 1, child_lead, False))
+                    preceding = child.tail
+                    if preceding and preceding.isspace():
+                        preceding = None
+                stack.extend(reversed(starts))
+                continue
+            write(' />')
+        tail = elem.tail
+        if tail and not (pretty and tail.isspace()):
+            write(_escape_cdata(tail))
+    return pieces
+
+
+def tostring(et_element, encoding='us-ascii', pretty=False, indent='  '):
+    """serialize an xml.etree element and its children to xml. Without
+    pretty, the output is identical to xml.etree.ElementTree.tostring.
+
+    :param et_element: xml.etree element to serialize
+    :param encoding: 'unicode' to return str, otherwise the encoding of
+                     the returned bytes (us-ascii by default, in which
+                     non-ascii characters become character references)
+    :param pretty: if True, indent children on their own lines
+    :param indent: string used for each level of indentation if pretty
+    :return: str if encoding is 'unicode', otherwise bytes
+    """
+    try:
+        pieces = _build(et_element, pretty, indent)
+    except _NamespacedTag:
+        if pretty:
+            et_element = ET.fromstring(ET.tostring(et_element))
+            ET.indent(et_element, indent)
+        return ET.tostring(et_element, encoding=encoding)
+    xml = ''.join(pieces)
+    if encoding.lower() == 'unicode':
+        return xml
+    if encoding.lower() not in ('utf-8', 'us-ascii'):
+        declaration = "<?xml version='1.0' encoding='" + encoding + "'?>\n"
+        xml = declaration + xml
+    return xml.encode(encoding, 'xmlcharrefreplace')
+
+
+def fromstring(data, chunk_size=CHUNK_SIZE):
+    """parse xml from str, bytes, or any object supporting the buffer
+    protocol (bytearray, memoryview, mmap) into an xml.etree element.
+    Buffers are fed to the parser in chunks through a memoryview, so
+    they are not copied in full
+    """
+    parser = ET.XMLParser()
+    if isinstance(data, str):
+        parser.feed(data)
+        return parser.close()
+    view = memoryview(data).cast('B')
+    try:
+        for start in range(0, len(view), chunk_size):
+            parser.feed(view[start:start + chunk_size])
+    finally:
+        view.release()
+    return parser.close()
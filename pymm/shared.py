@@ -0,0 +1,266 @@
+"""
+    shared lets many threads read a mindmap while one thread at a time
+    changes it. Readers take a Snapshot: a consistent version of the map
+    that no later change is made to, taken without waiting for any
+    writer. Writers change a private copy of the map, and each batch of
+    changes is published at once as a new version, so readers never see
+    half of a batch.
+
+        shared = pymm.SharedMindmap(mindmap)
+        with shared.snapshot() as mindmap:  # in a request thread
+            text = mindmap.root.text
+        with shared.edit() as mindmap:  # in the writer thread
+            mindmap.root.text = 'changed'
+            mindmap.root.nodes.append(pymm.Node(TEXT='added'))
+        # both changes are seen by snapshots taken from here on
+
+    SharedMindmap keeps one private copy of the map for writers, and
+    publishes each batch by path copying: the new version is made of
+    copies of the elements the batch changed (and of their ancestors, up
+    to the top), and shares every unchanged subtree with the previous
+    version. Changed elements are found from their content hash (see
+    BaseElement.content_hash), which a change clears along the path to
+    the top, so publishing costs time in proportion to the changed
+    paths, not to the map. Versions are never changed once published,
+    so readers never wait for writers, and writers never wait for
+    readers.
+
+    Snapshots must not be changed. Since versions share elements, an
+    element of a snapshot may be shared with other versions, and its
+    _parent may be its parent in another version. An element held as an
+    attrib value (such as an Arrow's DESTINATION) is the copy of it
+    published when the referring element last changed.
+"""
+import copy
+import threading
+import weakref
+
+from . import element
+
+
+class _Version:
+    """a published copy of the map"""
+
+    def __init__(self, mindmap, number):
+        self.mindmap = mindmap
+        self.number = number
+
+
+class Snapshot:
+    """a published version of a SharedMindmap, which is never changed.
+    May be used as a context manager, giving the mindmap.
+
+    mindmap: the map of this version. It must not be changed
+    version: number of this version, counting published batches
+    """
+
+    def __init__(self, version):
+        self.mindmap = version.mindmap
+        self.version = version.number
+
+    def close(self):
+        """drop the version, so that it may be garbage collected once no
+        later version shares its elements
+        """
+        self.mindmap = None
+
+    def __enter__(self):
+        return self.mindmap
+
+    def __exit__(self, *error):
+        self.close()
+
+
+class SharedMindmap:
+    """a mindmap read by many threads and changed by one at a time.
+
+    :param mindmap: map to share. It becomes the first published version,
+                    and must not be changed directly afterwards
+    """
+
+    def __init__(self, mindmap):
+        self._published = _Version(mindmap, 0)
+        self._spare = None  # writers' copy, or None to clone one
+        # element of _spare: published element (or unpublished copy) of
+        # the same content as the element had when last hashed
+        self._counterparts = weakref.WeakKeyDictionary()
+        self._hash = None  # content hash of the latest published version
+        self._lock = threading.RLock()  # guards _published and _queue
+        self._writer = threading.Lock()
+        self._editor = None  # ident of thread holding _writer
+        self._queue = []  # [function, event, result, error] of apply
+        self.commits = 0
+        self.clones = 0  # writers' copies cloned from a published version
+
+    @property
+    def version(self):
+        """number of the latest published version"""
+        return self._published.number
+
+    def snapshot(self):
+        """return Snapshot of the latest published version"""
+        with self._lock:
+            return Snapshot(self._published)
+
+    def _acquire(self):
+        """take the writer lock"""
+        if self._editor == threading.get_ident():
+            raise RuntimeError('cannot edit a SharedMindmap while editing it')
+        self._writer.acquire()
+        self._editor = threading.get_ident()
+
+    def _release_writer(self):
+        self._editor = None
+        self._writer.release()
+
+    def _writers_copy(self):
+        """return writers' copy of the map, up to date with the latest
+        published version. Caller must hold the writer lock
+        """
+        if self._spare is not None:
+            return self._spare
+        with self._lock:
+            published = self._published.mindmap
+        spare = published.clone(new_ids=False)
+        counterparts = weakref.WeakKeyDictionary()
+        stack = [(spare, published)]
+        while stack:
+            elem, counterpart = stack.pop()
+            counterparts[elem] = counterpart
+            stack.extend(zip(elem.children, counterpart.children))
+        self._hash = spare.content_hash()
+        self._spare, self._counterparts = spare, counterparts
+        self.clones += 1
+        return spare
+
+    def _copy_changed(self):
+        """return copy of the writers' copy that shares each of its
+        unchanged subtrees with the published versions, recording the
+        new copies in _counterparts. Caller must hold the writer lock
+        """
+        counterparts = self._counterparts
+        changed = []  # changed elements, each before its children
+        stack = [self._spare]
+        while stack:
+            elem = stack.pop()
+            changed.append(elem)
+            stack.extend(child for child in elem.children
+                         if child._hash is None or child not in counterparts)
+        copies = {}  # changed element: its copy
+        for elem in reversed(changed):  # children first
+            duplicate = copies[elem] = copy.copy(elem)
+            children = duplicate.children
+            for position, child in enumerate(elem.children):
+                child_copy = copies.get(child)
+                if child_copy is None:
+                    children[position] = counterparts[child]
+                else:
+                    children[position] = child_copy
+                    child_copy._parent = duplicate
+        counterparts.update(copies)
+        for duplicate in copies.values():
+            attrib = duplicate.attrib
+            for key, value in list(attrib.items()):
+                if isinstance(value, element.BaseElement) and \
+                        value in counterparts:
+                    attrib[key] = counterparts[value]
+        return copies[changed[0]]
+
+    def _publish(self):
+        """publish writers' copy as the next version, if it changed.
+        Caller must hold the writer lock
+        """
+        spare = self._spare
+        if spare._hash is not None:
+            return  # nothing changed since it was last published
+        top = self._copy_changed()
+        content_hash = spare.content_hash()
+        if content_hash == self._hash:
+            return  # changed back: the copies stay as counterparts
+        self._hash = content_hash
+        with self._lock:
+            self._published = _Version(top, self._published.number + 1)
+        self.commits += 1
+
+    def edit(self):
+        """return context manager giving the writers' copy of the map to
+        change. Changes are published together as one version when the
+        with block exits, unless it raises, in which case they are
+        discarded. Writers wait for each other, not for readers
+        """
+        return _Edit(self)
+
+    def apply(self, function):
+        """call function with the writers' copy of the map, and return its
+        result once its changes are published. Calls made by several
+        threads at once are applied together, in the order made, and
+        published as one version. If function raises, its changes are
+        discarded and the error is raised here; the others in its batch
+        are applied again without it
+        """
+        item = [function, threading.Event(), None, None]
+        with self._lock:
+            self._queue.append(item)
+        self._acquire()
+        try:
+            if not item[1].is_set():
+                with self._lock:
+                    batch, self._queue = self._queue, []
+                self._apply_batch(batch)
+        finally:
+            self._release_writer()
+        if item[3] is not None:
+            raise item[3]
+        return item[2]
+
+    def _apply_batch(self, batch):
+        """apply [function, event, result, error] items of batch, and
+        publish them as one version. Caller must hold the writer lock
+        """
+        try:
+            while batch:
+                mindmap = self._writers_copy()
+                for position, item in enumerate(batch):
+                    try:
+                        item[2] = item[0](mindmap)
+                    except Exception as error:
+                        item[3] = error
+                        item[1].set()
+                        self._spare = None  # partly changed
+                        del batch[position]
+                        break
+                else:
+                    self._publish()
+                    break
+        except BaseException as error:
+            self._spare = None
+            for item in batch:
+                item[3] = error
+            raise
+        finally:
+            for item in batch:
+                item[1].set()
+
+
+class _Edit:
+    """context manager of SharedMindmap.edit"""
+
+    def __init__(self, shared):
+        self.shared = shared
+
+    def __enter__(self):
+        self.shared._acquire()
+        try:
+            return self.shared._writers_copy()
+        except BaseException:
+            self.shared._release_writer()
+            raise
+
+    def __exit__(self, error_type, *error):
+        try:
+            if error_type is None:
+                self.shared._publish()
+            else:
+                self.shared._spare = None  # partly changed
+        finally:
+            self.shared._release_writer()
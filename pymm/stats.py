@@ -0,0 +1,138 @@
+"""
+    stats holds ConversionStats, an opt-in record of where the time goes
+    when reading or writing a mindmap. Pass an instance to pymm.read,
+    pymm.write, pymm.fromstring or pymm.tostring (as stats=...) to
+    collect wall time per phase, and counts of elements (per tag and per
+    factory), conversion hook calls, and attrib values that did not
+    match their element's spec. When no stats are passed, conversion
+    does not time or count anything.
+"""
+import collections
+import contextlib
+import time
+
+
+class ConversionStats:
+    """Timings and counters collected during read/write. A single
+    instance may be passed to several calls; its values accumulate.
+
+    phases: {phase: seconds}. Phases are parse, decode, post_decode
+            (reading) and pre_encode, encode, post_encode, serialise
+            (writing). Writing to a filename adds lock, the wait for
+            the file's lock, and sync, flushing the file to disk and
+            renaming it into place
+    tags: Counter of elements converted, per tag
+    factories: Counter of elements converted, per factory
+    hooks: {event: Counter of calls per factory}, where event is
+           pre_encode, post_encode, or post_decode
+    spec_mismatches: number of attrib values that did not match spec
+                     (see pymm.validate)
+    conversions: number of read/write calls recorded
+
+    :param callback: optional function called with this instance after
+                     each read/write completes
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = collections.OrderedDict()
+        self.tags = collections.Counter()
+        self.factories = collections.Counter()
+        self.hooks = collections.defaultdict(collections.Counter)
+        self.spec_mismatches = 0
+        self.conversions = 0
+
+    @property
+    def total(self):
+        """total seconds spent in all phases"""
+        return sum(self.phases.values())
+
+    @property
+    def elements(self):
+        """total number of elements converted"""
+        return sum(self.tags.values())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """time the enclosed block, adding it to phases[name]"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @contextlib.contextmanager
+    def conversion(self):
+        """enclose a whole read/write, then notify the callback"""
+        yield self
+        self.conversions += 1
+        if self.callback is not None:
+            self.callback(self)
+
+    def count(self, tag, factory_class):
+        """count one element with tag converted by factory_class"""
+        self.tags[tag] += 1
+        self.factories[self.factory_name(factory_class)] += 1
+
+    def count_hook(self, event, factory_class):
+        """count one call of an event hook of factory_class"""
+        self.hooks[event][self.factory_name(factory_class)] += 1
+
+    def update(self, other):
+        """add the phase times, counts and spec mismatches of other (a
+        ConversionStats, such as one recorded in another process)
+        """
+        for name, seconds in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.tags.update(other.tags)
+        self.factories.update(other.factories)
+        for event, calls in other.hooks.items():
+            self.hooks[event].update(calls)
+        self.spec_mismatches += other.spec_mismatches
+
+    @staticmethod
+    def factory_name(factory_class):
+        """name of factory, without the unique suffix of factories
+        generated for unclaimed elements
+        """
+        return factory_class.__name__.split('@')[0]
+
+    def as_dict(self):
+        """return stats as a json-serialisable dict"""
+        return {
+            'phases': dict(self.phases),
+            'total': self.total,
+            'elements': self.elements,
+            'tags': dict(self.tags),
+            'factories': dict(self.factories),
+            'hooks': {event: dict(calls) for event, calls in
+                      self.hooks.items()},
+            'spec_mismatches': self.spec_mismatches,
+            'conversions': self.conversions,
+        }
+
+    def __str__(self):
+        lines = ['%-12s %10.3f ms' % (name, seconds * 1000)
+                 for name, seconds in self.phases.items()]
+        lines.append('%-12s %10.3f ms' % ('total', self.total * 1000))
+        lines.append('elements: ' + str(self.elements) +
+                     ', spec mismatches: ' + str(self.spec_mismatches))
+        return '\n'.join(lines)
+
+
+def conversion(stats):
+    """return context manager enclosing a read/write that is recorded in
+    stats. Does nothing if stats is None
+    """
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.conversion()
+
+
+def phase(stats, name):
+    """return context manager timing phase name in stats. Does nothing
+    if stats is None
+    """
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.phase(name)
@@ -0,0 +1,120 @@
+"""
+    transport moves pymm trees between processes through shared memory.
+    A SharedTree pickles a tree once (in packed form, see pymm.flat.pack)
+    into a block of shared memory; any number of processes then attach
+    to the block by name and rebuild their own copy of the tree from it,
+    reading the block in place rather than each receiving the whole
+    pickle through a pipe. A SharedTree itself pickles as just the name
+    of its block, so it is cheap to pass to worker processes.
+
+        def count_nodes(shared):  # called in a worker process
+            mindmap = shared.load()
+            return sum(1 for _ in mindmap.iter_preorder(tag='node'))
+
+        with pymm.SharedTree(mindmap) as shared:
+            futures = [executor.submit(count_nodes, shared)
+                       for _ in range(8)]
+            counts = [future.result() for future in futures]
+
+    The process that created a SharedTree owns its block: the block is
+    removed when the owner closes it (or leaves its with block), so
+    workers must have loaded the tree by then. Other processes only
+    detach from the block when they close it.
+"""
+import pickle
+import struct
+from multiprocessing import shared_memory
+
+from . import element
+
+#: layout of the header before the pickle: its length in bytes
+_header = struct.Struct('<Q')
+
+
+def _attach(name):
+    """return SharedMemory block of name, attached without registering it
+    to be removed when this process exits, where python allows it
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # before python 3.13, attaching is always tracked
+        return shared_memory.SharedMemory(name)
+
+
+class SharedTree:
+    """a pymm element and its hierarchy, pickled into shared memory.
+
+    :param elem: pymm element to share. The tree is pickled at once, so
+                 later changes to elem are not shared
+    """
+
+    def __init__(self, elem):
+        if not isinstance(elem, element.BaseElement):
+            raise ValueError('SharedTree requires a pymm element')
+        data = pickle.dumps(elem, pickle.HIGHEST_PROTOCOL)
+        size = _header.size + len(data)
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        self._memory.buf[:_header.size] = _header.pack(len(data))
+        self._memory.buf[_header.size:size] = data
+        self.name = self._memory.name
+        self.owner = True
+
+    @classmethod
+    def attach(cls, name):
+        """return SharedTree of the block named name, made by another
+        SharedTree (usually in another process). The block is attached
+        when first loaded
+        """
+        self = cls.__new__(cls)
+        self._memory = None
+        self.name = name
+        self.owner = False
+        return self
+
+    def __reduce__(self):
+        return SharedTree.attach, (self.name,)
+
+    @property
+    def size(self):
+        """size in bytes of the pickled tree"""
+        return self._buffer()[1]
+
+    def _buffer(self):
+        """return (shared memory block, size of its pickle), attaching to
+        the block if needed
+        """
+        if self._memory is None:
+            self._memory = _attach(self.name)
+        memory = self._memory
+        return memory, _header.unpack_from(memory.buf)[0]
+
+    def load(self):
+        """return a new copy of the shared tree, rebuilt from the block
+        in place
+        """
+        memory, size = self._buffer()
+        view = memory.buf[_header.size:_header.size + size]
+        try:
+            return pickle.loads(view)
+        finally:
+            view.release()
+
+    def close(self):
+        """detach from the block, and remove it if this is its owner.
+        Copies already loaded are not affected
+        """
+        memory, self._memory = self._memory, None
+        if memory is None:
+            return
+        memory.close()
+        if self.owner:
+            memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        self.close()
+
+    def __repr__(self):
+        return 'SharedTree(' + repr(self.name) + ')'
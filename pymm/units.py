@@ -0,0 +1,28 @@
+"""
+    units holds what diff and merge share about units: nodes with an ID
+    that are matched between versions of a tree (see pymm.diff). It is a
+    module of its own so that merge need not import diff, whose name
+    pymm.diff also names the diff function.
+"""
+from . import element
+
+
+def _is_unit(elem):
+    return elem.tag == 'node' and 'ID' in elem.attrib
+
+
+def _unit_id(elem):
+    return elem.attrib['ID']
+
+
+def _node_children(elem):
+    return [child for child in elem.children if _is_unit(child)]
+
+
+def _text(value):
+    """return attrib or attribute value as a string"""
+    if isinstance(value, element.BaseElement):
+        value = value.attrib.get('ID', '')
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
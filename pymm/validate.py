@@ -0,0 +1,231 @@
+"""
+    validate checks the attrib of a pymm tree against each element's
+    spec (see BaseElement.spec), and reports every mismatch in a single
+    ValidationReport grouped by element tag and attrib key, rather than
+    issuing a warning per value. Each spec is compiled once per class
+    into checking functions, so validating large trees is fast.
+
+    Reading and writing take a validation mode that decides what happens
+    to mismatches found while converting:
+        'lenient': issue one SpecWarning summarising the report (default)
+        'strict': raise ValidationError holding the report
+        'off': ignore mismatches
+"""
+import collections
+import os
+import sys
+import warnings
+
+#: validation modes accepted by read, write and conversion
+MODES = ('strict', 'lenient', 'off')
+
+
+class SpecWarning(UserWarning):
+    """warning issued when an attrib value does not match its element's
+    spec. A warning summarising a conversion has the ValidationReport as
+    .report
+    """
+
+    def __init__(self, message, report=None):
+        super().__init__(message)
+        self.report = report
+
+
+class ValidationError(ValueError):
+    """raised by strict validation when attrib values do not match
+    spec. The ValidationReport is available as .report
+    """
+
+    def __init__(self, report):
+        super().__init__(report.summary())
+        self.report = report
+
+
+class ValidationReport:
+    """Spec mismatches found in a tree, grouped by element tag and
+    attrib key.
+
+    groups: {(element tag, key): {'count': number of mismatches,
+             'locations': [[path, value], ...] of the first mismatches}}
+    count: total number of mismatches
+
+    :param max_locations: number of locations kept per group, so that
+                          memory use does not grow with the tree
+    :param where: function returning the path of the element being
+                  checked, for mismatches added without a location
+    """
+
+    def __init__(self, max_locations=10, where=None):
+        self.max_locations = max_locations
+        self.where = where
+        self.groups = collections.OrderedDict()
+        self.count = 0
+
+    def __bool__(self):
+        """True if there are mismatches"""
+        return self.count > 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, tag, key, value, location=None):
+        """record that value of attrib key does not match the spec of an
+        element with tag. location is the element's path, or a function
+        returning it; it is only used for the first max_locations
+        mismatches of each group
+        """
+        self.count += 1
+        group = self.groups.get((tag, key))
+        if group is None:
+            group = self.groups[(tag, key)] = {'count': 0, 'locations': []}
+        group['count'] += 1
+        locations = group['locations']
+        if len(locations) < self.max_locations:
+            if location is None and self.where is not None:
+                location = self.where
+            if callable(location):
+                location = location()
+            locations.append([location, value])
+
+    def update(self, other, prefix=''):
+        """add the mismatches of other (a ValidationReport, such as one
+        made in another process) to this report. prefix is prepended to
+        the locations of other, so that they are paths from the same
+        element as this report's
+        """
+        self.count += other.count
+        for (tag, key), theirs in other.groups.items():
+            group = self.groups.get((tag, key))
+            if group is None:
+                group = self.groups[(tag, key)] = {'count': 0,
+                                                   'locations': []}
+            group['count'] += theirs['count']
+            room = max(0, self.max_locations - len(group['locations']))
+            for location, value in theirs['locations'][:room]:
+                if location is not None:
+                    location = prefix + location
+                group['locations'].append([location, value])
+
+    def summary(self, groups=5):
+        """return one-line description of the report, listing at most
+        groups of mismatches
+        """
+        if not self:
+            return 'all attrib values match spec'
+        parts = []
+        for (tag, key), group in list(self.groups.items())[:groups]:
+            value = group['locations'][0][1] if group['locations'] else ''
+            parts.append(str(tag) + '-> ' + str(key) + ': ' + str(value) +
+                         ' (' + str(group['count']) + 'x)')
+        if len(self.groups) > groups:
+            parts.append('...')
+        return (str(self.count) + " attrib values don't match spec: " +
+                ', '.join(parts))
+
+    def handle(self, mode):
+        """act on mismatches according to validation mode: raise
+        ValidationError if strict, or issue one SpecWarning if lenient
+        """
+        if mode not in MODES:
+            raise ValueError('validation mode must be one of ' + str(MODES))
+        if not self or mode == 'off':
+            return
+        if mode == 'strict':
+            raise ValidationError(self)
+        warnings.warn(SpecWarning(self.summary(), self),
+                      stacklevel=_caller_level())
+
+    def as_dict(self):
+        """return report as a json-serialisable dict"""
+        return {
+            'count': self.count,
+            'groups': [
+                {'tag': tag, 'key': key, 'count': group['count'],
+                 'locations': [[location, str(value)] for location, value
+                               in group['locations']]}
+                for (tag, key), group in self.groups.items()
+            ],
+        }
+
+    def __str__(self):
+        lines = [str(self.count) + " attrib values don't match spec"]
+        for (tag, key), group in self.groups.items():
+            lines.append('%-20s %-20s %8d' % (tag, key, group['count']))
+            for location, value in group['locations']:
+                lines.append('    ' + str(location) + ': ' + repr(value))
+        return '\n'.join(lines)
+
+
+def _caller_level():
+    """return stacklevel for a warning issued by the caller of this
+    function that points at the first frame outside of pymm, such as a
+    call to pymm.read
+    """
+    package = os.path.dirname(os.path.abspath(__file__)) + os.sep
+    frame = sys._getframe(1)
+    level = 1
+    while frame.f_back is not None and \
+            os.path.abspath(frame.f_code.co_filename).startswith(package):
+        frame = frame.f_back
+        level += 1
+    return level
+
+
+def compile_entries(entries):
+    """return function(value) that is True if value matches spec
+    entries: a list of allowed values and/or types, as
+    DefaultAttribFactory.match_attrib_value_to_spec matches them
+    """
+    from .factory import DefaultAttribFactory
+    if not isinstance(entries, list):
+        raise ValueError('spec value must be a list of choices/types')
+    match = DefaultAttribFactory.match_attrib_value_to_spec
+    spec = {'': entries}
+    kinds = tuple(entry for entry in entries if isinstance(entry, type))
+
+    def check(value):
+        if isinstance(value, kinds):
+            return True  # as conversion to its own type would
+        mismatches = ValidationReport(0)
+        match('', value, spec, report=mismatches)
+        return not mismatches
+    return check
+
+
+def compile_spec(spec):
+    """return {key: check} of compiled spec entries (see
+    compile_entries)
+    """
+    return {key: compile_entries(entries) for key, entries in spec.items()}
+
+
+def validate(tree, max_locations=10):
+    """check the attrib of tree and all its sub-children against their
+    spec, and return a ValidationReport of the values that do not match.
+    Locations are paths from tree, such as map/node[ID_1]/edge
+
+    :param tree: pymm element, such as a Mindmap
+    :param max_locations: number of locations kept per group
+    """
+    from .factory import _label
+    report = ValidationReport(max_locations)
+    compiled = {}  # id(spec): (spec, checks)
+    ancestors = []  # path from tree to the current element
+    for parent, elem, depth in tree.iter_preorder():
+        del ancestors[depth:]
+        ancestors.append(elem)
+        spec = elem.spec
+        entry = compiled.get(id(spec))
+        if entry is None or entry[0] is not spec:
+            entry = compiled[id(spec)] = (spec, compile_spec(spec))
+        checks = entry[1]
+        if not checks:
+            continue
+        for key, value in elem.attrib.items():
+            check = checks.get(key)
+            if check is None or value is None or check(value):
+                continue
+            report.add(elem.tag, key, value, lambda: '/'.join(
+                _label(ancestor) for ancestor in ancestors
+            ))
+    return report
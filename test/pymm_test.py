@@ -12,6 +12,7 @@ from uuid import uuid4
 import unittest
 import inspect
 import os
+import json
 import collections
 try:
     import pymm
@@ -73,6 +74,32 @@ class TestElementRegistry(unittest.TestCase):
             class InnocentElement(pymm.element.BaseElement):
                 pass
 
+    def test_threads_claim_own_functions(self):
+        """element classes declared at once in two threads each claim
+        the functions decorated in their own thread
+        """
+        import threading
+        barrier = threading.Barrier(2)
+        declared = {}
+
+        def declare(name):
+            @pymm.decode.post_decode
+            def fxn(*args):
+                pass
+            barrier.wait()  # both threads have decorated a function
+            declared[name] = (type(name, (pymm.element.BaseElement,),
+                                   {'fxn': fxn}), fxn)
+        threads = [threading.Thread(target=declare, args=(name,))
+                   for name in ('Threaded0x1', 'Threaded0x2')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        decorated = pymm.element.registry.get_decorated_fxns()
+        for element_class, fxn in declared.values():
+            self.assertEqual(decorated[element_class], {'post_decode': fxn})
+            pymm.element.registry._elements.remove(element_class)
+
 
 class TestFactoryRegistry(unittest.TestCase):
     """Factory registry keeps track of all new factories created. Prior
@@ -106,6 +133,24 @@ class TestFactoryRegistry(unittest.TestCase):
         self.assertTrue(test_class == pymm.factory.registry._factories[-1])
         del pymm.factory.registry._factories[-1]
 
+    def test_snapshot(self):
+        """conversions share one tuple of factories until another
+        element class is registered
+        """
+        snapshot = pymm.factory.registry.snapshot()
+        self.assertIsInstance(snapshot, tuple)
+        self.assertIs(snapshot, pymm.factory.registry.snapshot())
+        self.assertIs(pymm.factory.ConversionHandler().factories, snapshot)
+        class Snapshot0x123(pymm.element.BaseElement):
+            pass
+        try:
+            rebuilt = pymm.factory.registry.snapshot()
+            self.assertIsNot(rebuilt, snapshot)
+            self.assertIn(Snapshot0x123,
+                          [f.decoding_element for f in rebuilt])
+        finally:
+            pymm.element.registry._elements.remove(Snapshot0x123)
+
     def test_factories_order(self):
         """test that oldest factory is first in list"""
         factories = pymm.factory.registry.get_factories()
@@ -284,6 +329,12 @@ class TestNodeImplicitAttributes(unittest.TestCase):
         for key, val in self.attributes.items():
             self.node[key] = val
 
+    def tearDown(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
     def test_items(self):
         """Test that attribute.items() matches node's attribute.items()"""
         self.assertTrue(self.node.items() == self.attributes.items())
@@ -340,6 +391,191 @@ class TestNodeImplicitAttributes(unittest.TestCase):
         self.assertTrue(mm.root.items() == self.attributes.items())
 
 
+class TestAttributeIndex(unittest.TestCase):
+    """AttributeIndex indexes node attributes by name and value. Verify
+    that lookups match the tree, and that the index follows changes
+    made through node[key] = value and del node[key]
+    """
+
+    def setUp(self):
+        self.mind_map = pymm.Mindmap()
+        root = self.mind_map.root
+        self.nodes = [mme.Node() for i in range(5)]
+        for i, node in enumerate(self.nodes):
+            node['status'] = 'blocked' if i % 2 else 'open'
+            node['estimate'] = str(i * 10)
+            root.nodes.append(node)
+        self.nodes[0]['owner'] = 'lance'
+        self.index = pymm.AttributeIndex(self.mind_map)
+
+    def test_find(self):
+        """verify equality lookup returns nodes in tree order"""
+        blocked = self.index.find('status', 'blocked')
+        self.assertEqual(blocked, [self.nodes[1], self.nodes[3]])
+        self.assertEqual(self.index.find('status', 'missing'), [])
+        self.assertEqual(self.index.find('missing', 'blocked'), [])
+
+    def test_find_range(self):
+        """verify numeric range lookup is inclusive, ordered by value,
+        and may be open-ended
+        """
+        found = self.index.find_range('estimate', 10, 30)
+        self.assertEqual(found, self.nodes[1:4])
+        self.assertEqual(self.index.find_range('estimate', low=35),
+                         [self.nodes[4]])
+        self.assertEqual(self.index.find_range('status'), [])
+
+    def test_find_having(self):
+        """verify existence lookup"""
+        self.assertEqual(self.index.find_having('owner'), [self.nodes[0]])
+        self.assertEqual(len(self.index.find_having('status')), 5)
+
+    def test_setitem_updates_index(self):
+        """verify that setting an attribute moves the node to its new
+        value within the index
+        """
+        node = self.nodes[0]
+        node['status'] = 'blocked'
+        node['estimate'] = '100'
+        self.assertIn(node, self.index.find('status', 'blocked'))
+        self.assertNotIn(node, self.index.find('status', 'open'))
+        self.assertEqual(self.index.find_range('estimate', 50), [node])
+
+    def test_delitem_updates_index(self):
+        """verify that deleting an attribute removes it from index"""
+        del self.nodes[0]['owner']
+        self.assertEqual(self.index.find_having('owner'), [])
+        self.assertNotIn('owner', self.index.names())
+
+    def test_add_and_discard(self):
+        """verify nodes added after building the index are indexed once
+        added, and that discarded nodes are no longer watched
+        """
+        node = mme.Node()
+        node['status'] = 'blocked'
+        self.mind_map.root.nodes.append(node)
+        self.assertNotIn(node, self.index.find('status', 'blocked'))
+        self.index.add(node)
+        self.assertIn(node, self.index.find('status', 'blocked'))
+        self.index.discard(node)
+        self.assertNotIn(node, self.index)
+        node['status'] = 'open'
+        self.assertNotIn(node, self.index.find('status', 'open'))
+
+    def test_decoded_attributes(self):
+        """verify attributes decoded from file are indexed"""
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        mm_path = os.path.join(this_path, '../docs/input.mm')
+        mind_map = pymm.read(mm_path)
+        index = pymm.AttributeIndex(mind_map)
+        for name in index.names():
+            for node in index.find_having(name):
+                self.assertIn(name, node)
+
+
+class TestTimestampIndex(unittest.TestCase):
+    """TimestampIndex keeps nodes sorted by CREATED and MODIFIED attrib.
+    Verify range queries and ordering, that attrib writes update the
+    index, and that stamp_modified stamps MODIFIED on changes
+    """
+
+    def setUp(self):
+        self.mind_map = pymm.Mindmap()
+        root = self.mind_map.root
+        self.nodes = []
+        for stamp in [30, 10, 20, 40]:
+            node = mme.Node(CREATED=stamp, MODIFIED=stamp + 100)
+            root.nodes.append(node)
+            self.nodes.append(node)
+        self.index = pymm.TimestampIndex(root.nodes[0])
+        self.index.add(root.nodes[1])
+        self.index.add(root.nodes[2])
+        self.index.add(root.nodes[3])
+
+    def test_range(self):
+        """verify inclusive range query, ordered oldest first"""
+        found = self.index.range('CREATED', 10, 30)
+        self.assertEqual(found, [self.nodes[1], self.nodes[2], self.nodes[0]])
+        self.assertEqual(self.index.modified_since(140), [self.nodes[3]])
+        self.assertEqual(self.index.created_since(50), [])
+
+    def test_iter_reverse(self):
+        """verify iteration yields (timestamp, node) newest first"""
+        stamps = [stamp for stamp, _ in self.index.iter('MODIFIED',
+                                                        reverse=True)]
+        self.assertEqual(stamps, [140, 130, 120, 110])
+
+    def test_attrib_write_updates_index(self):
+        """verify writing MODIFIED moves the node within the index, and
+        deleting it removes the node from the field
+        """
+        node = self.nodes[1]
+        node.attrib['MODIFIED'] = 500
+        self.assertEqual(self.index.modified_since(500), [node])
+        del node.attrib['MODIFIED']
+        self.assertEqual(self.index.modified_since(0), [
+            self.nodes[2], self.nodes[0], self.nodes[3]
+        ])
+
+    def test_stamp_modified(self):
+        """verify stamp_modified stamps MODIFIED on attrib and attribute
+        changes of indexed nodes only
+        """
+        now = 10 ** 15
+        index = pymm.TimestampIndex(self.mind_map, stamp_modified=True,
+                                    clock=lambda: now)
+        node = self.nodes[0]
+        node.text = 'changed'
+        self.assertEqual(node.attrib['MODIFIED'], now)
+        self.assertEqual(index.modified_since(now), [node])
+        self.nodes[1]['status'] = 'done'
+        self.assertEqual(index.modified_since(now), [node, self.nodes[1]])
+        loose = mme.Node()
+        loose.text = 'not indexed'
+        self.assertNotIn('MODIFIED', loose.attrib)
+
+    def test_stamp_modified_children_and_text(self):
+        """verify stamp_modified stamps MODIFIED when children are added,
+        removed or reordered, and when text is set
+        """
+        clock = iter(range(10 ** 15, 10 ** 15 + 100))
+        index = pymm.TimestampIndex(self.mind_map, stamp_modified=True,
+                                    clock=lambda: next(clock))
+        root = self.mind_map.root
+        changes = [
+            lambda: self.nodes[0].children.append(mme.Node()),
+            lambda: self.nodes[0].children.pop(),
+            lambda: root.children.reverse(),
+            lambda: setattr(self.nodes[1], '_text', 'changed'),
+        ]
+        changed = [self.nodes[0], self.nodes[0], root, self.nodes[1]]
+        for change, node in zip(changes, changed):
+            before = node.attrib['MODIFIED']
+            change()
+            self.assertGreater(node.attrib['MODIFIED'], before)
+            self.assertEqual(index.modified_since(node.attrib['MODIFIED']),
+                             [node])
+
+    def test_observed_once_indexed(self):
+        """verify attrib is a plain dict until the index adds its node"""
+        from pymm import observe
+        node = mme.Node(CREATED=50)
+        self.assertIs(type(node.attrib), dict)
+        self.index.add(node)
+        self.assertIsInstance(node.attrib, observe.ObservedAttrib)
+        node.attrib['CREATED'] = 60
+        self.assertEqual(self.index.created_since(60), [node])
+
+    def test_read_timestamps(self):
+        """verify pymm.read builds the index when asked to"""
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        mm_path = os.path.join(this_path, '../docs/input.mm')
+        mind_map = pymm.read(mm_path, timestamps=True)
+        stamps = [stamp for stamp, _ in mind_map.timestamps.iter('CREATED')]
+        self.assertTrue(stamps)
+        self.assertEqual(stamps, sorted(stamps))
+
+
 class TestMutableClassVariables(unittest.TestCase):
     """BaseElement and some inheriting elements define some mutable
     variables in their class definition (such as children). This is
@@ -489,6 +725,59 @@ class TestMindmapFeatures(MindmapSetup):
         with pymm.Mindmap(self.filename) as mm:
             self.assertTrue(mm.root.text == self.text)
 
+    def test_default_hierarchy_is_cloned(self):
+        """verify each default mindmap is an independent copy of the same
+        decoded prototype
+        """
+        first, second = pymm.Mindmap(), pymm.Mindmap()
+        self.assertIsNot(first, second)
+        self.assertIsNot(first.root, second.root)
+        self.assertTrue(first.same_content(second))
+        first.root.text = self.text
+        first.root.children.append(pymm.Node())
+        self.assertEqual(pymm.Mindmap().root.text, 'new_mindmap')
+        self.assertTrue(second.same_content(pymm.Mindmap()))
+
+    def test_default_prototype_invalidated(self):
+        """verify the default hierarchy is decoded again if the default
+        filename changes
+        """
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        default = pymm.Mindmap.default_mindmap_filename
+        other = os.path.join(this_path, '../docs/input.mm')
+        try:
+            pymm.Mindmap.default_mindmap_filename = other
+            self.assertTrue(pymm.Mindmap().same_content(pymm.read(other)))
+        finally:
+            pymm.Mindmap.default_mindmap_filename = default
+        self.assertEqual(pymm.Mindmap().root.text, 'new_mindmap')
+
+    def test_default_prototype_after_factory_swap(self):
+        """verify the default hierarchy is decoded again when a factory
+        is swapped for another, which keeps the number of factories
+        """
+        factories = pymm.factory.registry._factories
+        prototypes = pymm.pymm._default_prototypes
+
+        class First0x34(pymm.factory.DefaultFactory):
+            pass
+        try:
+            pymm.Mindmap()
+            first = prototypes[pymm.Mindmap][1]
+            factories.remove(First0x34)
+
+            class Second0x34(pymm.factory.DefaultFactory):
+                pass
+            pymm.Mindmap()
+            self.assertIsNot(prototypes[pymm.Mindmap][1], first)
+        finally:
+            for factory in factories[-2:]:
+                if factory.__name__ in ('First0x34', 'Second0x34'):
+                    factories.remove(factory)
+        second = prototypes[pymm.Mindmap][1]
+        self.assertEqual(pymm.Mindmap().root.text, 'new_mindmap')
+        self.assertIsNot(prototypes[pymm.Mindmap][1], second)
+
 
 class TestPymmModuleFeatures(MindmapSetup):
     """Test various top-level features within the pymm module such as
@@ -504,11 +793,434 @@ class TestPymmModuleFeatures(MindmapSetup):
         """verify that an 2nd argument must be pymm element"""
         self.assertRaises(ValueError, pymm.write, self.filename, [])
 
+    def test_lazy_import(self):
+        """verify importing pymm does not import elements or factories
+        until a pymm name is used, and that all names are still exported
+        """
+        import subprocess
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        code = '; '.join((
+            'import sys, pymm',
+            'assert "pymm.element" not in sys.modules',
+            'assert "pymm.factory" not in sys.modules',
+            'assert callable(pymm.merge) and callable(pymm.patch)',
+            'assert callable(pymm.diff) and callable(pymm.validate)',
+            'assert pymm.decode.post_decode and pymm.encode.get_attrib',
+            'from pymm import *',
+            'assert Mindmap and Node and read and encode.pre_encode',
+        ))
+        subprocess.check_call([sys.executable, '-c', code],
+                              cwd=os.path.join(this_path, '..'))
+
+    def test_import_submodule_first(self):
+        """verify a submodule can be imported before pymm's names are
+        used, and that they are exported afterwards
+        """
+        import subprocess
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        code = '; '.join((
+            'from pymm.element import Node',
+            'import pymm.index, pymm',
+            'assert pymm.Node is Node and callable(pymm.read)',
+            'assert pymm.encode.pre_encode and pymm.index.AttributeIndex',
+        ))
+        subprocess.check_call([sys.executable, '-c', code],
+                              cwd=os.path.join(this_path, '..'))
+
     def test_encode_args_error(self):
         """verify that 2nd arg must be a pymm element"""
         self.assertRaises(ValueError, pymm.encode, [])
 
 
+class TestInMemorySerialisation(MindmapSetup):
+    """pymm.tostring and pymm.fromstring encode and decode mindmaps in
+    memory through the same factories as pymm.write and pymm.read
+    """
+
+    def setUp(self):
+        super().setUp()
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mm_path = os.path.join(this_path, '../docs/input.mm')
+
+    def test_tostring_matches_write(self):
+        """verify tostring produces the same bytes written to file"""
+        mind_map = pymm.read(self.mm_path)
+        pymm.write(self.filename, mind_map)
+        with open(self.filename, 'rb') as written:
+            self.assertEqual(pymm.tostring(mind_map), written.read())
+        text = pymm.tostring(mind_map, encoding='unicode')
+        self.assertTrue(isinstance(text, str))
+
+    def test_fromstring_inputs(self):
+        """verify fromstring accepts str, bytes, memoryview, and mmap,
+        and decodes a full Mindmap
+        """
+        import mmap
+        data = pymm.tostring(pymm.read(self.mm_path))
+        for source in [data, data.decode(), memoryview(data)]:
+            mind_map = pymm.fromstring(source)
+            self.assertTrue(isinstance(mind_map, pymm.Mindmap))
+            self.assertEqual(pymm.tostring(mind_map), data)
+        with open(self.mm_path, 'rb') as mm_file:
+            mapped = mmap.mmap(mm_file.fileno(), 0, access=mmap.ACCESS_READ)
+            mind_map = pymm.fromstring(mapped)
+            mapped.close()
+        self.assertEqual(pymm.tostring(mind_map), data)
+
+    def test_pretty(self):
+        """verify pretty output indents children and decodes the same"""
+        mind_map = Mindmap()
+        mind_map.root.nodes.append(pymm.Node(TEXT=self.text))
+        pretty = pymm.tostring(mind_map, encoding='unicode', pretty=True)
+        self.assertIn('\n  <node', pretty)
+        mind_map = pymm.fromstring(pretty)
+        self.assertEqual(list(mind_map.root.nodes)[-1].text, self.text)
+
+    def test_element_tostring(self):
+        """verify element.tostring returns parseable xml"""
+        node = pymm.Node(TEXT='a & "b"')
+        node.cloud = pymm.Cloud()
+        string = node.tostring()
+        et_elem = pymm.ET.fromstring(string)
+        self.assertEqual(et_elem.attrib['TEXT'], 'a & "b"')
+        self.assertEqual(et_elem[0].tag, 'cloud')
+
+    def test_element_tostring_leaves_tree(self):
+        """verify element.tostring does not run encode hooks"""
+        class Hooked(pymm.element.BaseElement):
+            @pymm.encode.pre_encode
+            def remove_self(self, parent):
+                parent.children.remove(self)
+
+        node = pymm.Node()
+        node.children.append(Hooked())
+        self.assertIn('<BaseElement', node.tostring())
+        self.assertEqual(len(node.children), 1)
+
+    def test_comment_without_text(self):
+        """verify comments and processing instructions without text are
+        written as xml.etree writes them
+        """
+        et_elem = pymm.ET.Element('map')
+        et_elem.append(pymm.ET.Comment())
+        et_elem.append(pymm.ET.ProcessingInstruction('target'))
+        et_elem[-1].text = None
+        self.assertEqual(pymm.serialize.tostring(et_elem),
+                         pymm.ET.tostring(et_elem))
+
+
+class TestConversionStats(unittest.TestCase):
+    """ConversionStats records per-phase timings and counts during read
+    and write when passed as stats=
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mm_path = os.path.join(this_path, '../docs/input.mm')
+
+    def test_read_phases_and_counts(self):
+        """verify reading records parse/decode/post_decode, element and
+        hook counts, and calls the callback once
+        """
+        notified = []
+        stats = pymm.ConversionStats(callback=notified.append)
+        mindmap = pymm.read(self.mm_path, stats=stats)
+        self.assertEqual(notified, [stats])
+        self.assertEqual(list(stats.phases),
+                         ['parse', 'decode', 'post_decode'])
+        nodes = list(mindmap.iter_preorder(tag='node'))
+        self.assertEqual(stats.tags['node'], len(nodes))
+        self.assertEqual(stats.tags['map'], 1)
+        self.assertEqual(stats.elements, sum(stats.factories.values()))
+        self.assertTrue(stats.hooks['post_decode'])
+        self.assertEqual(stats.conversions, 1)
+
+    def test_write_phases_and_spec_mismatches(self):
+        """verify writing records encode phases and counts spec
+        mismatches, while still issuing the warnings
+        """
+        import io
+        mindmap = pymm.read(self.mm_path)
+        mindmap.root.nodes[0].attrib['POSITION'] = 'middle'
+        stats = pymm.ConversionStats()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            pymm.write(io.BytesIO(), mindmap, stats=stats)
+        self.assertEqual(
+            list(stats.phases),
+            ['pre_encode', 'encode', 'post_encode', 'serialise']
+        )
+        self.assertEqual(stats.spec_mismatches, 1)
+        self.assertTrue(any(issubclass(w.category, pymm.factory.SpecWarning)
+                            for w in caught))
+
+    def test_write_filename_phases(self):
+        """verify writing to a filename times the wait for its lock, and
+        flushing and renaming the file, apart from serialise
+        """
+        filename = 'test_stats_phases.mm'
+        stats = pymm.ConversionStats()
+        try:
+            pymm.write(filename, pymm.Mindmap(), stats=stats)
+        finally:
+            os.remove(filename)
+        self.assertEqual(
+            list(stats.phases),
+            ['pre_encode', 'encode', 'post_encode', 'lock', 'serialise',
+             'sync']
+        )
+
+    def test_accumulates_and_serialises(self):
+        """verify stats accumulate across calls and convert to json"""
+        import json
+        stats = pymm.ConversionStats()
+        mindmap = pymm.read(self.mm_path, stats=stats)
+        pymm.fromstring(pymm.tostring(mindmap, stats=stats), stats=stats)
+        self.assertEqual(stats.conversions, 3)
+        self.assertEqual(stats.tags['map'], 3)
+        as_dict = json.loads(json.dumps(stats.as_dict()))
+        self.assertEqual(as_dict['elements'], stats.elements)
+        self.assertAlmostEqual(as_dict['total'], sum(stats.phases.values()))
+
+
+class TestValidate(unittest.TestCase):
+    """validate reports spec mismatches grouped by tag and key, and
+    read/write handle mismatches according to their validation mode
+    """
+
+    def setUp(self):
+        self.mindmap = pymm.Mindmap()
+        self.nodes = [pymm.Node(ID='ID_' + str(i)) for i in range(3)]
+        self.mindmap.root.nodes.extend(self.nodes)
+        for node in self.nodes:
+            node.attrib['POSITION'] = 'middle'
+        self.nodes[0].attrib['HGAP'] = 'wide'
+
+    def test_report_groups(self):
+        """verify mismatches are counted per tag and key, with paths"""
+        report = pymm.validate(self.mindmap, max_locations=2)
+        self.assertEqual(report.count, 4)
+        self.assertEqual(list(report.groups),
+                         [('node', 'POSITION'), ('node', 'HGAP')])
+        group = report.groups[('node', 'POSITION')]
+        self.assertEqual(group['count'], 3)
+        self.assertEqual(len(group['locations']), 2)
+        path, value = group['locations'][0]
+        self.assertTrue(path.startswith('map/node['))
+        self.assertTrue(path.endswith('/node[ID_0]'))
+        self.assertEqual(value, 'middle')
+        self.assertFalse(pymm.validate(pymm.Mindmap()))
+
+    def test_matches_conversion(self):
+        """verify compiled checks accept what conversion accepts"""
+        from pymm.validate import compile_entries, ValidationReport
+        match = pymm.factory.DefaultAttribFactory.match_attrib_value_to_spec
+        entries = [['left', 'right'], [int], [bool], ['thin', int], [str]]
+        values = ['left', 'middle', '10', 10, 'x', 'false', True, None, 2.5]
+        for spec_entries in entries:
+            check = compile_entries(spec_entries)
+            for value in values:
+                report = ValidationReport()
+                match('KEY', value, {'KEY': spec_entries}, 'tag', report)
+                self.assertEqual(check(value), not report, (spec_entries,
+                                                            value))
+
+    def test_lenient_warns_once(self):
+        """verify a lenient write issues one warning for all mismatches"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            data = pymm.tostring(self.mindmap)
+        spec_warnings = [w for w in caught if
+                         issubclass(w.category, pymm.factory.SpecWarning)]
+        self.assertEqual(len(spec_warnings), 1)
+        self.assertEqual(spec_warnings[0].message.report.count, 4)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            pymm.fromstring(data, validation='off')
+        self.assertFalse(caught)
+
+    def test_warning_points_at_caller(self):
+        """verify the warning is reported at the call to pymm, rather
+        than inside it
+        """
+        import io
+        data = pymm.tostring(self.mindmap, validation='off')
+        for convert in (lambda: pymm.read(io.BytesIO(data)),
+                        lambda: pymm.tostring(self.mindmap)):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                convert()
+            self.assertEqual([w.filename for w in caught],
+                             [os.path.abspath(__file__)])
+
+    def test_strict(self):
+        """verify strict read and write raise ValidationError, and that
+        a strict write does not write the file
+        """
+        import io
+        output = io.BytesIO()
+        with self.assertRaises(pymm.ValidationError) as context:
+            pymm.write(output, self.mindmap, validation='strict')
+        self.assertEqual(context.exception.report.count, 4)
+        self.assertFalse(output.getvalue())
+        data = pymm.tostring(self.mindmap, validation='off')
+        with self.assertRaises(pymm.ValidationError):
+            pymm.fromstring(data, validation='strict')
+        with self.assertRaises(ValueError):
+            pymm.tostring(self.mindmap, validation='loose')
+
+
+class TestEncodedAttrib(unittest.TestCase):
+    """elements remember the encoded form of attrib values that matched
+    spec, so that unchanged values are not converted again on encode
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mm_path = os.path.join(this_path, '../docs/input.mm')
+
+    def test_decoded_values_remembered(self):
+        """verify values read from file are remembered until changed,
+        and that output is unchanged
+        """
+        mindmap = pymm.read(self.mm_path)
+        node = list(mindmap.root.nodes)[0]
+        attrib = node.attrib
+        self.assertIs(node._remembered_encoding('ID', attrib['ID']),
+                      attrib['ID'])
+        before = pymm.tostring(mindmap)
+        attrib['ID'] = 'ID_changed'
+        self.assertIsNone(node._remembered_encoding('ID', 'ID_changed'))
+        self.assertIn(b'ID="ID_changed"', pymm.tostring(mindmap))
+        self.assertEqual(node._remembered_encoding('ID', attrib['ID']),
+                         'ID_changed')
+        changed = attrib['ID']
+        attrib.update(ID='ID_again')
+        self.assertIsNone(node._remembered_encoding('ID', attrib['ID']))
+        self.assertEqual(node._remembered_encoding('ID', changed),
+                         'ID_changed')
+        clone = mindmap.clone(new_ids=False)
+        self.assertEqual(pymm.tostring(clone), pymm.tostring(mindmap))
+
+    def test_converted_values_remembered(self):
+        """verify converted values are remembered by identity, and that
+        mismatches are not remembered, so each encode reports them
+        """
+        node = pymm.Node()
+        node.attrib['HGAP'] = 5
+        node.attrib['POSITION'] = 'middle'
+        for _ in range(2):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                pymm.encode(node)
+            self.assertEqual(len(caught), 1)
+            self.assertEqual(caught[0].message.report.count, 1)
+        self.assertEqual(node._remembered_encoding('HGAP', 5), '5')
+        self.assertIsNone(node._remembered_encoding('POSITION', 'middle'))
+        self.assertIsNone(node._remembered_encoding('HGAP', 5.0))
+
+
+class TestMemoryReport(unittest.TestCase):
+    """memory_report attributes retained bytes to element classes and
+    their components
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mm_path = os.path.join(this_path, '../docs/input.mm')
+
+    def test_report_classes_and_components(self):
+        """verify every element is counted once, and component totals
+        add up to the report's total
+        """
+        import json
+        mindmap = pymm.read(self.mm_path)
+        report = pymm.memory_report(mindmap)
+        elements = list(mindmap.iter_preorder())
+        self.assertEqual(sum(report.counts.values()), len(elements))
+        self.assertEqual(report.counts['Node'],
+                         len(list(mindmap.iter_preorder(tag='node'))))
+        self.assertEqual(sum(report.components.values()), report.total)
+        for component in ('object', 'attrib', 'strings', 'children'):
+            self.assertGreater(report.components[component], 0)
+        self.assertGreater(report.classes['Node']['_attribute'], 0)
+        as_dict = json.loads(json.dumps(report.as_dict()))
+        self.assertEqual(as_dict['total'], report.total)
+        self.assertIn('Node', str(report))
+
+    def test_interning_estimate(self):
+        """verify equal strings in separate objects count as savings,
+        and shared strings are counted once
+        """
+        shared = pymm.Node()
+        shared.children = [pymm.Node(TEXT='x' * 100) for i in range(2)]
+        separate = pymm.Node()
+        separate.children = [pymm.Node(TEXT=''.join(['x'] * 100))
+                             for i in range(2)]
+        shared_report = pymm.memory_report(shared)
+        separate_report = pymm.memory_report(separate)
+        self.assertEqual(separate_report.interning - shared_report.interning,
+                         sys.getsizeof('x' * 100))
+        self.assertLess(shared_report.total, separate_report.total)
+
+    def test_traced_read(self):
+        """verify traced_read reports allocations made while reading,
+        and leaves tracemalloc as it was
+        """
+        import tracemalloc
+        mindmap, report = pymm.memory.traced_read(self.mm_path, top=3)
+        self.assertTrue(mindmap.root)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreater(report.traced['allocated'], 0)
+        self.assertGreaterEqual(report.traced['peak'],
+                                report.traced['allocated'])
+        self.assertLessEqual(len(report.traced['top']), 3)
+
+
+class TestBenchmarks(unittest.TestCase):
+    """the benchmark suite generates maps deterministically and flags
+    regressions against a baseline
+    """
+
+    def test_generate_is_deterministic(self):
+        """verify equal options give identical maps that decode without
+        spec warnings, and a different seed gives a different map
+        """
+        from benchmarks import generate
+        data = generate.generate_bytes(depth=2, fanout=4, seed=3)
+        self.assertEqual(data, generate.generate_bytes(depth=2, fanout=4,
+                                                       seed=3))
+        self.assertNotEqual(data, generate.generate_bytes(depth=2, fanout=4,
+                                                          seed=4))
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', pymm.factory.SpecWarning)
+            mindmap = pymm.fromstring(data)
+        nodes = list(mindmap.iter_preorder(tag='node'))
+        self.assertEqual(len(nodes), 1 + 4 + 16)
+
+    def test_run_and_compare(self):
+        """verify results are json-serialisable and compare flags only
+        benchmarks slower than their threshold
+        """
+        import json
+        from benchmarks import suite
+        results = suite.run(['traversal', 'mutation'], runs=1, warmup=0,
+                            depth=2, fanout=3)
+        results = json.loads(json.dumps(results))
+        self.assertEqual(results['meta']['nodes'], 1 + 3 + 9)
+        baseline = {'benchmarks': {
+            'traversal': {'median': results['benchmarks']['traversal']
+                          ['median'] / 2},
+            'mutation': results['benchmarks']['mutation'],
+        }}
+        verdicts = {row[0]: row[-1] for row in
+                    suite.compare(results, baseline, threshold=0.5)}
+        self.assertEqual(verdicts, {'traversal': 'slower',
+                                    'mutation': 'same'})
+        rows = suite.compare(results, baseline, thresholds={'traversal': 2})
+        self.assertEqual(rows[0][-1], 'same')
+
+
 class TestFileLocked(MindmapSetup):
     """file_locked is a special function-like class to handle marking a
     file as "locked" when being read. It is only used by pymm.decode
@@ -539,6 +1251,877 @@ class TestFileLocked(MindmapSetup):
         self.assertFalse(pymm.file_locked(self.filename))
 
 
+class TestFileLock(MindmapSetup):
+    """pymm.read takes a shared FileLock on the file it reads, and
+    pymm.write an exclusive one on the file it writes, against other
+    threads and other processes. Writes replace the file atomically
+    """
+
+    def hold(self, exclusive, release):
+        """take lock on filename in another thread, and hold it until
+        release is set
+        """
+        import threading
+        taken = threading.Event()
+
+        def holder():
+            with pymm.FileLock(self.filename, exclusive):
+                taken.set()
+                release.wait()
+        thread = threading.Thread(target=holder)
+        thread.start()
+        taken.wait()
+        return thread
+
+    def test_exclusive_blocks_threads(self):
+        """while one thread writes, others can neither read nor write"""
+        import threading
+        pymm.write(self.filename, pymm.Mindmap())
+        release = threading.Event()
+        thread = self.hold(True, release)
+        try:
+            with self.assertRaises(pymm.LockTimeout):
+                pymm.read(self.filename, timeout=0.05)
+            with self.assertRaises(pymm.LockTimeout):
+                pymm.write(self.filename, pymm.Mindmap(), timeout=0.05)
+        finally:
+            release.set()
+            thread.join()
+        self.assertIsInstance(pymm.read(self.filename, timeout=1), Mindmap)
+
+    def test_shared_locks(self):
+        """readers share a lock, but keep writers out"""
+        import threading
+        release = threading.Event()
+        thread = self.hold(False, release)
+        try:
+            with pymm.FileLock(self.filename, timeout=0.05):
+                pass
+            with self.assertRaises(pymm.LockTimeout):
+                pymm.FileLock(self.filename, True, timeout=0.05).acquire()
+        finally:
+            release.set()
+            thread.join()
+
+    def test_reentrant(self):
+        """a thread may lock a file it holds again, but not upgrade a
+        shared lock to an exclusive one
+        """
+        with pymm.FileLock(self.filename, True):
+            with pymm.FileLock(self.filename):
+                pymm.write(self.filename, pymm.Mindmap(), timeout=0)
+        with pymm.FileLock(self.filename):
+            self.assertIsInstance(pymm.read(self.filename, timeout=0),
+                                  Mindmap)
+            with self.assertRaises(RuntimeError):
+                pymm.FileLock(self.filename, True).acquire()
+
+    def test_blocks_other_processes(self):
+        """a lock held by another process keeps this one out"""
+        import subprocess
+        import textwrap
+        if pymm.lock.fcntl is None:
+            self.skipTest('os locks are not supported')
+        script = textwrap.dedent('''
+            import sys
+            sys.path.insert(0, sys.argv[2])
+            import pymm
+            with pymm.FileLock(sys.argv[1], True):
+                print('locked', flush=True)
+                sys.stdin.readline()
+        ''')
+        package = os.path.dirname(os.path.dirname(pymm.__file__))
+        process = subprocess.Popen(
+            [sys.executable, '-c', script, self.filename, package],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        try:
+            self.assertEqual(process.stdout.readline().strip(), 'locked')
+            with self.assertRaises(pymm.LockTimeout):
+                pymm.FileLock(self.filename, timeout=0.05).acquire()
+        finally:
+            process.communicate('\n')
+        with pymm.FileLock(self.filename, True, timeout=1):
+            pass
+
+    def test_lock_file_removed(self):
+        """writers remove their lock file on release, so none is left
+        beside the file, and a later writer makes a new one
+        """
+        lock_filename = pymm.lock.lock_filename(
+            os.path.realpath(self.filename)
+        )
+        pymm.write(self.filename, pymm.Mindmap())
+        self.assertFalse(os.path.exists(lock_filename))
+        with pymm.FileLock(self.filename, True):
+            if pymm.lock.fcntl is not None:
+                self.assertTrue(os.path.exists(lock_filename))
+            with pymm.FileLock(self.filename, True):
+                pass
+        self.assertFalse(os.path.exists(lock_filename))
+        with pymm.FileLock(self.filename):
+            self.assertFalse(os.path.exists(lock_filename))
+        self.assertIsInstance(pymm.read(self.filename), Mindmap)
+
+    def test_atomic_write(self):
+        """a failed write leaves the file as it was, and no temporary
+        file. A successful one keeps the file's permissions
+        """
+        pymm.write(self.filename, pymm.Mindmap())
+        os.chmod(self.filename, 0o640)
+        with open(self.filename, 'rb') as file:
+            before = file.read()
+        with self.assertRaises(ValueError):
+            with pymm.lock.atomic_write(self.filename) as file:
+                file.write(b'<map')
+                raise ValueError('interrupted')
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(file.read(), before)
+        directory = os.path.dirname(os.path.realpath(self.filename))
+        self.assertFalse([name for name in os.listdir(directory)
+                          if name.endswith('.tmp')])
+        mindmap = pymm.Mindmap()
+        mindmap.root.text = self.text
+        pymm.write(self.filename, mindmap)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o640)
+        self.assertEqual(pymm.read(self.filename).root.text, self.text)
+
+    def test_concurrent_read_write(self):
+        """readers never see a partly-written file"""
+        from concurrent.futures import ThreadPoolExecutor
+        pymm.write(self.filename, pymm.Mindmap())
+
+        def write(number):
+            mindmap = pymm.Mindmap()
+            mindmap.root.text = str(number)
+            pymm.write(self.filename, mindmap)
+
+        def read(number):
+            return pymm.read(self.filename).root.text
+        with ThreadPoolExecutor(8) as pool:
+            writes = [pool.submit(write, n) for n in range(20)]
+            reads = [pool.submit(read, n) for n in range(40)]
+            for future in writes + reads:
+                future.result()
+
+
+class TestConcurrentConversion(unittest.TestCase):
+    """separate reads and writes may run in several threads at once,
+    and give the same result as when run one at a time
+    """
+
+    def test_thread_pool(self):
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from benchmarks import generate
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for seed in range(4):
+                path = os.path.join(directory, str(seed) + '.mm')
+                generate.write(path, depth=2, fanout=6, seed=seed)
+                paths.append(path)
+            expected = [pymm.tostring(pymm.read(path)) for path in paths]
+
+            def round_trip(number):
+                path = paths[number % len(paths)]
+                out_path = os.path.join(directory, 'out' + str(number))
+                pymm.write(out_path, pymm.read(path))
+                with open(out_path, 'rb') as file:
+                    written = file.read()
+                return number % len(paths), written, pymm.tostring(
+                    pymm.read(out_path)
+                )
+            with ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(round_trip, range(32)))
+        for number, written, reread in results:
+            self.assertEqual(written, expected[number])
+            self.assertEqual(reread, expected[number])
+
+
+class TestAsyncio(MindmapSetup):
+    """pymm.aread, pymm.awrite and pymm.aopen read and write mindmaps
+    from asyncio code, with the same results as pymm.read and pymm.write
+    """
+
+    def setUp(self):
+        super().setUp()
+        from benchmarks import generate
+        self.data = generate.generate_bytes(depth=2, fanout=6)
+        self.source = 'test_asyncio_source.mm'
+        with open(self.source, 'wb') as file:
+            file.write(self.data)
+
+    def tearDown(self):
+        super().tearDown()
+        os.remove(self.source)
+
+    def test_aread_matches_read(self):
+        import asyncio
+        import io
+        expected = pymm.tostring(pymm.read(self.source))
+        mindmap = asyncio.run(pymm.aread(self.source, chunk_size=512))
+        self.assertIsInstance(mindmap, Mindmap)
+        self.assertEqual(pymm.tostring(mindmap), expected)
+        mindmap = asyncio.run(pymm.aread(io.BytesIO(self.data)))
+        self.assertEqual(pymm.tostring(mindmap), expected)
+
+    def test_awrite_matches_write(self):
+        import asyncio
+        import io
+        mindmap = pymm.read(self.source)
+        stats = pymm.ConversionStats()
+        asyncio.run(pymm.awrite(self.filename, mindmap, stats=stats))
+        self.assertEqual(stats.conversions, 1)
+        for name in ('lock', 'serialise', 'sync'):
+            self.assertIn(name, stats.phases)
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(file.read(), pymm.tostring(mindmap))
+        file = io.BytesIO()
+        asyncio.run(pymm.awrite(file, mindmap, chunk_size=100))
+        self.assertEqual(file.getvalue(), pymm.tostring(mindmap))
+
+    def test_aopen(self):
+        """aopen writes on exit in write mode, like Mindmap"""
+        import asyncio
+
+        async def edit():
+            async with pymm.aopen(self.filename, 'w') as mindmap:
+                mindmap.root.text = self.text
+            async with pymm.aopen(self.filename) as mindmap:
+                return mindmap
+        mindmap = asyncio.run(edit())
+        self.assertEqual(mindmap.root.text, self.text)
+        with self.assertRaises(ValueError):
+            pymm.aopen(self.filename, 'rw')
+
+    def test_aread_many(self):
+        """results are in order, and at most concurrency files are read
+        at once
+        """
+        import asyncio
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        reading = []
+        most = []
+        lock = threading.Lock()
+
+        class Counted(ThreadPoolExecutor):
+            def submit(self, function, *args, **kwargs):
+                def counted():
+                    with lock:
+                        reading.append(1)
+                        most.append(len(reading))
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        with lock:
+                            reading.pop()
+                return super().submit(counted)
+        with Counted(8) as executor:
+            mindmaps = asyncio.run(pymm.aread_many(
+                [self.source] * 6, concurrency=2, executor=executor
+            ))
+        self.assertEqual(len(mindmaps), 6)
+        self.assertLessEqual(max(most), 2)
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(pymm.aread_many(['missing_0x123.mm']))
+        errors = asyncio.run(pymm.aread_many(['missing_0x123.mm'],
+                                             return_exceptions=True))
+        self.assertIsInstance(errors[0], FileNotFoundError)
+
+    def test_loop_not_blocked(self):
+        """other tasks keep running while a map is read"""
+        import asyncio
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0)
+
+        async def read():
+            ticker = asyncio.ensure_future(tick())
+            await pymm.aread(self.source, chunk_size=1024)
+            ticker.cancel()
+        asyncio.run(read())
+        self.assertGreater(len(ticks), len(self.data) // 1024)
+
+
+def unpicklable_result(mindmap):
+    """batch function whose results cannot be sent back from a worker"""
+    return lambda: mindmap
+
+
+class TestBatch(unittest.TestCase):
+    """pymm.batch applies a function to many files in worker processes,
+    isolating files that fail
+    """
+
+    def setUp(self):
+        import tempfile
+        from benchmarks import generate
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for seed in range(5):
+            path = os.path.join(self.directory.name, str(seed) + '.mm')
+            generate.write(path, depth=1, fanout=4, seed=seed)
+            self.paths.append(path)
+        self.bad = os.path.join(self.directory.name, 'bad.mm')
+        with open(self.bad, 'w') as file:
+            file.write('<map><node')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_files(self):
+        files = pymm.batch.find_files(self.directory.name)
+        self.assertEqual(files, sorted(self.paths + [self.bad]))
+
+    def test_reduce_in_workers(self):
+        import operator
+        reports = []
+        files = pymm.batch.find_files(self.directory.name)
+        result = pymm.batch.run(pymm.batch.count_elements, files,
+                                reduce=operator.add, workers=2,
+                                chunksize=2, progress=reports.append)
+        self.assertEqual(result.value['node'], 5 * 5)
+        self.assertEqual(list(result.errors), [self.bad])
+        self.assertIn('ParseError', result.errors[self.bad])
+        self.assertEqual((result.stats.done, result.stats.failed), (6, 1))
+        self.assertTrue(reports)
+
+    def test_results_in_order(self):
+        files = list(reversed(self.paths)) + [self.bad]
+        result = pymm.batch.run(pymm.batch.check_spec, files, workers=0)
+        self.assertEqual(list(result.results), files[:-1])
+        self.assertEqual(set(result.results.values()), {0})
+
+    def test_reduce_none_results(self):
+        """None is a result like any other, and is reduced"""
+        reduced = []
+        result = pymm.batch.run(
+            pymm.batch.read_only, self.paths, workers=0,
+            reduce=lambda value, item: reduced.append((value, item))
+        )
+        self.assertEqual(reduced, [(None, None)] * 4)
+        self.assertIsNone(result.value)
+
+    def test_lost_results(self):
+        """files whose results cannot be returned from a worker fail,
+        and do not stop the others
+        """
+        result = pymm.batch.run(unpicklable_result, self.paths, workers=1,
+                                chunksize=2)
+        self.assertEqual(sorted(result.errors), sorted(self.paths))
+        self.assertIn('pickle', result.errors[self.paths[0]])
+        self.assertEqual((result.stats.done, result.stats.failed), (5, 5))
+
+    def test_command_line(self):
+        from pymm.__main__ import main
+        output = os.path.join(self.directory.name, 'out.json')
+        status = main(['batch', self.directory.name, '--task', 'count',
+                       '--workers', '2', '--quiet', '--output', output])
+        self.assertEqual(status, 1)  # bad.mm failed
+        with open(output) as file:
+            self.assertEqual(json.load(file)['value']['node'], 5 * 5)
+
+
+class TestParallelRead(unittest.TestCase):
+    """pymm.read(..., workers=N) decodes a map's branches in worker
+    processes, and gives the same tree as reading it whole
+    """
+
+    def setUp(self):
+        import tempfile
+        from benchmarks import generate
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'wide.mm')
+        generate.write(self.path, depth=2, fanout=6)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_tree(self):
+        import io
+        stats = pymm.ConversionStats()
+        expected = pymm.read(self.path, stats=stats)
+        parallel_stats = pymm.ConversionStats()
+        mindmap = pymm.read(self.path, workers=2, stats=parallel_stats)
+        self.assertIsInstance(mindmap, Mindmap)
+        self.assertEqual(pymm.tostring(mindmap), pymm.tostring(expected))
+        self.assertTrue(mindmap.same_content(expected))
+        self.assertEqual(parallel_stats.tags, stats.tags)
+        self.assertEqual(parallel_stats.factories, stats.factories)
+        self.assertEqual(parallel_stats.hooks, stats.hooks)
+        with open(self.path, 'rb') as file:
+            mindmap = pymm.read(io.BytesIO(file.read()), workers=2)
+        self.assertEqual(pymm.tostring(mindmap), pymm.tostring(expected))
+        with open(self.path, encoding='utf-8') as file:
+            mindmap = pymm.read(io.StringIO(file.read()), workers=2)
+        self.assertEqual(pymm.tostring(mindmap), pymm.tostring(expected))
+
+    def test_branches(self):
+        """branches are the nodes directly under the root node"""
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        ranges = pymm.parallel.find_branches(data)
+        self.assertEqual(len(ranges), 6)
+        for start, end in ranges:
+            branch = pymm.ET.fromstring(data[start:end])
+            self.assertEqual(branch.tag, 'node')
+        single = b'<map><node ID="a"><node ID="b"/><node>x</node></node></map>'
+        ranges = pymm.parallel.find_branches(single)
+        self.assertEqual([single[start:end] for start, end in ranges],
+                         [b'<node ID="b"/>', b'<node>x</node>'])
+        self.assertIsNone(pymm.parallel.find_branches(b'<map><node'))
+
+    def test_cannot_split(self):
+        """maps that cannot be split are read whole"""
+        mindmap = pymm.Mindmap()
+        mindmap.root.nodes.append(pymm.Node(TEXT='only branch'))
+        pymm.write(self.path, mindmap)
+        self.assertEqual(pymm.tostring(pymm.read(self.path, workers=2)),
+                         pymm.tostring(pymm.read(self.path)))
+
+    def test_validation(self):
+        """mismatches found in workers are reported with their paths"""
+        mindmap = pymm.read(self.path)
+        node = list(mindmap.root.nodes)[3].nodes[0]
+        node.attrib['HGAP'] = 'wide'
+        pymm.write(self.path, mindmap, validation='off')
+        with self.assertRaises(pymm.ValidationError) as context:
+            pymm.read(self.path, workers=2, validation='strict')
+        report = context.exception.report
+        self.assertEqual(report.count, 1)
+        location, value = report.groups[('node', 'HGAP')]['locations'][0]
+        self.assertEqual(value, 'wide')
+        self.assertTrue(location.startswith('map/node[ID_0]/node['))
+
+
+class TestParallelWrite(unittest.TestCase):
+    """pymm.write(..., workers=N) encodes a map's branches in worker
+    processes, and writes the same bytes as writing it whole
+    """
+
+    def setUp(self):
+        import tempfile
+        from benchmarks import generate
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'wide.mm')
+        self.mindmap = pymm.fromstring(
+            generate.generate_bytes(depth=2, fanout=6)
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_bytes(self):
+        mindmap = self.mindmap
+        # pre_encode adds an edge to each branch, and an arrow points
+        # from one branch into another
+        mindmap.root.children.append(pymm.element.AutomaticEdgeColor())
+        branches = list(mindmap.root.nodes)
+        arrow = pymm.Arrow(DESTINATION=branches[4])
+        branches[1].children.append(arrow)
+        stats = pymm.ConversionStats()
+        expected = pymm.tostring(mindmap, stats=stats)
+        parallel_stats = pymm.ConversionStats()
+        pymm.write(self.path, mindmap, workers=2, stats=parallel_stats)
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), expected)
+        self.assertEqual(parallel_stats.tags, stats.tags)
+        self.assertEqual(parallel_stats.factories, stats.factories)
+        self.assertEqual(parallel_stats.hooks, stats.hooks)
+        self.assertIs(arrow.attrib['DESTINATION'], branches[4])
+
+    def test_cannot_split(self):
+        """elements that are not maps, and maps holding namespaced xml,
+        are encoded whole
+        """
+        branch = list(self.mindmap.root.nodes)[0]
+        self.assertEqual(pymm.parallel.tostring(branch, workers=2),
+                         pymm.tostring(branch))
+        namespaced = pymm.element.BaseElement()
+        namespaced.tag = '{urn:example}note'
+        branch.nodes[0].children.append(namespaced)
+        self.assertEqual(pymm.parallel.tostring(self.mindmap, workers=2),
+                         pymm.tostring(self.mindmap))
+
+    def test_validation(self):
+        """mismatches found in workers are reported with their paths, and
+        strict validation writes nothing
+        """
+        node = list(self.mindmap.root.nodes)[3].nodes[0]
+        node.attrib['HGAP'] = 'wide'
+        with self.assertRaises(pymm.ValidationError) as expected:
+            pymm.tostring(self.mindmap, validation='strict')
+        with self.assertRaises(pymm.ValidationError) as context:
+            pymm.write(self.path, self.mindmap, workers=2,
+                       validation='strict')
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(context.exception.report.groups,
+                         expected.exception.report.groups)
+
+    def test_flat_detached(self):
+        """elements outside of a packed tree are copied alone"""
+        from pymm import flat
+        branches = list(self.mindmap.root.nodes)
+        arrow = pymm.Arrow(DESTINATION=branches[2])
+        branches[0].children.append(arrow)
+        packed = flat.pack(branches[0])
+        self.assertEqual(flat.packed_size(packed),
+                         sum(1 for _ in branches[0].iter_preorder()))
+        copy = flat.unpack(packed)
+        destination = copy.children[-1].attrib['DESTINATION']
+        self.assertIsInstance(destination, pymm.Node)
+        self.assertIsNone(destination._parent)
+        self.assertEqual(len(destination.children), 0)
+        self.assertEqual(destination.attrib['ID'], branches[2].attrib['ID'])
+
+
+def _shared_tostring(shared):
+    """return xml of the tree shared with a worker process"""
+    return pymm.tostring(shared.load())
+
+
+class TestPickle(unittest.TestCase):
+    """elements pickle in packed form (see pymm.flat.pack), and can be
+    shared between processes through shared memory
+    """
+
+    def setUp(self):
+        from benchmarks import generate
+        self.mindmap = pymm.fromstring(
+            generate.generate_bytes(depth=2, fanout=6)
+        )
+
+    def test_round_trip(self):
+        import pickle
+        copied = pickle.loads(pickle.dumps(self.mindmap))
+        self.assertIsInstance(copied, Mindmap)
+        self.assertTrue(copied.same_content(self.mindmap))
+        self.assertEqual(pymm.tostring(copied), pymm.tostring(self.mindmap))
+        pairs = zip(copied.iter_preorder(), self.mindmap.iter_preorder())
+        for (parent, child, _), (_, original, _) in pairs:
+            self.assertIs(child._parent, parent)
+            self.assertEqual(child._encoded, original._encoded)
+
+    def test_subtree_only(self):
+        """pickling an element leaves out its parent, and copies elements
+        outside of it that its attrib refers to alone
+        """
+        import pickle
+        branches = list(self.mindmap.root.nodes)
+        arrow = pymm.Arrow(DESTINATION=branches[1])
+        branches[0].children.append(arrow)
+        inner = pymm.Arrow(DESTINATION=branches[0].nodes[0])
+        branches[0].children.append(inner)
+        copied = pickle.loads(pickle.dumps(branches[0]))
+        self.assertIsNone(copied._parent)
+        copied_arrow, copied_inner = copied.children[-2:]
+        self.assertIs(copied_inner.attrib['DESTINATION'], copied.nodes[0])
+        outside = copied_arrow.attrib['DESTINATION']
+        self.assertEqual(outside.attrib['ID'], branches[1].attrib['ID'])
+        self.assertEqual(len(outside.children), 0)
+
+    def test_deep_and_compact(self):
+        """pickling does not recurse, and stores each string once"""
+        import pickle
+        top = node = pymm.Node(TEXT='same text')
+        for _ in range(5000):
+            child = pymm.Node(TEXT='same text')
+            node.children.append(child)
+            node = child
+        data = pickle.dumps(top)
+        self.assertLess(len(data), 100 * 5000)
+        copied = pickle.loads(data)
+        self.assertTrue(copied.same_content(top))
+
+    def test_local_class(self):
+        """an element of a class that cannot be imported pickles as its
+        nearest base class that can
+        """
+        import pickle
+
+        class Local(pymm.Node):
+            pass
+        node = Local(TEXT='local')
+        copied = pickle.loads(pickle.dumps(node))
+        self.assertIs(type(copied), pymm.Node)
+        self.assertEqual(copied.attrib['TEXT'], 'local')
+
+    def test_indexes_left_out(self):
+        import pickle
+        self.mindmap.timestamps = pymm.TimestampIndex(self.mindmap)
+        copied = pickle.loads(pickle.dumps(self.mindmap))
+        self.assertNotIn('timestamps', copied.__dict__)
+
+    def test_shallow_copy(self):
+        """copy.copy shares children and attrib values, and leaves the
+        children with their parent
+        """
+        import copy
+        branch = self.mindmap.root.nodes[0]
+        copied = copy.copy(branch)
+        self.assertIsNot(copied, branch)
+        self.assertIsNot(copied.children, branch.children)
+        self.assertEqual(len(copied.children), len(branch.children))
+        for child, original in zip(copied.children, branch.children):
+            self.assertIs(child, original)
+            self.assertIs(child._parent, branch)
+        copied.attrib['TEXT'] = 'copied'
+        self.assertNotEqual(branch.attrib['TEXT'], 'copied')
+
+    def test_deepcopy_keeps_identity(self):
+        """copy.deepcopy of elements within one hierarchy copies each
+        element once
+        """
+        import copy
+        branch = self.mindmap.root.nodes[0]
+        child = branch.nodes[0]
+        copied_branch, copied_child = copy.deepcopy([branch, child])
+        self.assertIs(copied_child, copied_branch.nodes[0])
+        copied_child, copied_branch = copy.deepcopy([child, branch])
+        self.assertIs(copied_branch.nodes[0], copied_child)
+        self.assertIs(copied_child._parent, copied_branch)
+        self.assertIsNot(copied_child, child)
+        self.assertTrue(copied_branch.same_content(branch))
+
+    def test_deepcopy_keeps_local_classes(self):
+        """copy.deepcopy keeps the class of elements that could not be
+        pickled by reference, which pickling replaces by a base class
+        """
+        import copy
+        import pickle
+
+        class LocalNode(pymm.Node):
+            pass
+
+        branch = LocalNode()
+        branch.children.append(LocalNode())
+        copied = copy.deepcopy(branch)
+        self.assertIs(type(copied), LocalNode)
+        self.assertIs(type(copied.children[0]), LocalNode)
+        self.assertIs(type(pickle.loads(pickle.dumps(branch))), pymm.Node)
+
+    def test_shared_tree(self):
+        import concurrent.futures
+        expected = pymm.tostring(self.mindmap)
+        with pymm.SharedTree(self.mindmap) as shared:
+            self.assertTrue(shared.load().same_content(self.mindmap))
+            with concurrent.futures.ProcessPoolExecutor(2) as executor:
+                results = list(executor.map(_shared_tostring, [shared] * 3))
+        self.assertEqual(results, [expected] * 3)
+        with self.assertRaises(FileNotFoundError):
+            pymm.transport.SharedTree.attach(shared.name).load()
+
+
+class TestReadCache(unittest.TestCase):
+    """ReadCache returns clones of cached trees until their file changes"""
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for number in range(3):
+            path = os.path.join(self.directory.name, str(number) + '.mm')
+            mindmap = pymm.Mindmap()
+            mindmap.root.text = 'map ' + str(number)
+            pymm.write(path, mindmap)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hits_return_copies(self):
+        cache = pymm.ReadCache()
+        first = cache.read(self.paths[0])
+        first.root.text = 'changed by caller'
+        second = cache.read(self.paths[0])
+        self.assertEqual(second.root.text, 'map 0')
+        self.assertIsInstance(second, Mindmap)
+        self.assertTrue(second.same_content(pymm.read(self.paths[0])))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIn(self.paths[0], cache)
+        timed = cache.read(self.paths[0], timestamps=True)
+        self.assertIsInstance(timed.timestamps, pymm.TimestampIndex)
+
+    def test_changed_file(self):
+        cache = pymm.ReadCache()
+        cache.read(self.paths[0])
+        mindmap = pymm.read(self.paths[0])
+        mindmap.root.text = 'written again'
+        pymm.write(self.paths[0], mindmap)
+        self.assertEqual(cache.read(self.paths[0]).root.text,
+                         'written again')
+        self.assertEqual(cache.invalidations, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_eviction(self):
+        cache = pymm.ReadCache(max_entries=2)
+        for path in self.paths:
+            cache.read(path)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertNotIn(self.paths[0], cache)
+        cache.read(self.paths[1])  # now most recently used
+        cache.read(self.paths[0])
+        self.assertIn(self.paths[1], cache)
+        self.assertNotIn(self.paths[2], cache)
+        size = pymm.memory_report(pymm.read(self.paths[0])).total
+        cache = pymm.ReadCache(max_bytes=size * 2 + size // 2)
+        for path in self.paths:
+            cache.read(path)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.bytes, cache.max_bytes)
+
+    def test_single_flight(self):
+        """threads reading an uncached file at once share one read"""
+        import threading
+        import time
+        from unittest import mock
+        cache = pymm.ReadCache()
+        started = threading.Event()
+        release = threading.Event()
+        real_read = pymm.read
+        calls = []
+
+        def slow_read(*args, **kwargs):
+            calls.append(args)
+            started.set()
+            release.wait(5)
+            return real_read(*args, **kwargs)
+
+        results = []
+        with mock.patch('pymm.cache.read', slow_read):
+            threads = [threading.Thread(
+                target=lambda: results.append(cache.read(self.paths[0]))
+            ) for _ in range(4)]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            while cache.misses < 4:  # all are waiting for the first
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len({id(result) for result in results}), 4)
+
+
+class TestSharedMindmap(unittest.TestCase):
+    """snapshots of a SharedMindmap do not change while writers publish
+    batches of changes
+    """
+
+    def setUp(self):
+        self.shared = pymm.SharedMindmap(Mindmap())
+
+    def test_isolation(self):
+        shared = self.shared
+        before = shared.snapshot()
+        with shared.edit() as mindmap:
+            mindmap.root.text = 'changed'
+            mindmap.root.nodes.append(pymm.Node(TEXT='added'))
+            self.assertNotEqual(before.mindmap.root.text, 'changed')
+        self.assertEqual(before.version, 0)
+        self.assertEqual(shared.version, 1)
+        self.assertNotEqual(before.mindmap.root.text, 'changed')
+        self.assertEqual(len(before.mindmap.root.nodes), 0)
+        with shared.snapshot() as mindmap:
+            self.assertEqual(mindmap.root.text, 'changed')
+            self.assertEqual(mindmap.root.nodes[0].text, 'added')
+        before.close()
+
+    def test_versions_share_unchanged_subtrees(self):
+        """each version copies only the changed elements and their
+        ancestors, and shares the rest with the previous version
+        """
+        shared = self.shared
+        for number in range(4):
+            with shared.edit() as mindmap:
+                mindmap.root.nodes.append(pymm.Node(TEXT=str(number)))
+        self.assertEqual((shared.commits, shared.clones), (4, 1))
+        held = shared.snapshot()
+        with shared.edit() as mindmap:
+            mindmap.root.nodes[1].text = 'changed'
+            mindmap.root.nodes.append(pymm.Node(TEXT='more'))
+        self.assertEqual(shared.clones, 1)
+        self.assertEqual([node.text for node in held.mindmap.root.nodes],
+                         ['0', '1', '2', '3'])
+        with shared.snapshot() as mindmap:
+            nodes = mindmap.root.nodes
+            self.assertEqual([node.text for node in nodes],
+                             ['0', 'changed', '2', '3', 'more'])
+            self.assertIsNot(mindmap.root, held.mindmap.root)
+            self.assertIs(nodes[0], held.mindmap.root.nodes[0])
+            self.assertIsNot(nodes[1], held.mindmap.root.nodes[1])
+        with shared.edit() as mindmap:  # unchanged: nothing published
+            pass
+        self.assertEqual(shared.version, 5)
+
+    def test_failed_edit(self):
+        with self.assertRaises(KeyError):
+            with self.shared.edit() as mindmap:
+                mindmap.root.text = 'half done'
+                raise KeyError('failed')
+        self.assertEqual(self.shared.version, 0)
+        with self.shared.edit() as mindmap:
+            self.assertNotEqual(mindmap.root.text, 'half done')
+            with self.assertRaises(RuntimeError):
+                with self.shared.edit():
+                    pass
+
+    def test_apply(self):
+        def add(text):
+            def function(mindmap):
+                mindmap.root.nodes.append(pymm.Node(TEXT=text))
+                return text
+            return function
+
+        def fail(mindmap):
+            mindmap.root.text = 'half done'
+            raise ValueError('failed')
+
+        self.assertEqual(self.shared.apply(add('one')), 'one')
+        with self.assertRaises(ValueError):
+            self.shared.apply(fail)
+        with self.shared.snapshot() as mindmap:
+            self.assertEqual([n.text for n in mindmap.root.nodes], ['one'])
+            self.assertNotEqual(mindmap.root.text, 'half done')
+
+    def test_readers_see_whole_batches(self):
+        """each batch adds two nodes, so no snapshot has an odd number"""
+        import threading
+        shared = self.shared
+        counts = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                with shared.snapshot() as mindmap:
+                    counts.append(len(mindmap.root.nodes))
+
+        readers = [threading.Thread(target=read) for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        try:
+            for number in range(30):
+                with shared.edit() as mindmap:
+                    mindmap.root.nodes.append(pymm.Node(TEXT='first'))
+                    mindmap.root.nodes.append(pymm.Node(TEXT='second'))
+        finally:
+            done.set()
+            for reader in readers:
+                reader.join()
+        self.assertTrue(counts)
+        self.assertTrue(all(count % 2 == 0 for count in counts))
+        with shared.snapshot() as mindmap:
+            self.assertEqual(len(mindmap.root.nodes), 60)
+
+
 class TestConversionDecoration(unittest.TestCase):
     """test that certain features of @decode/@encode functions work
     as expected
@@ -628,6 +2211,31 @@ class TestConversionProcess(MindmapSetup):
         with pymm.Mindmap(self.filename) as mm:
             self.assertFalse(mm.root.children)
 
+    def test_error_traces_failing_element(self):
+        """verify a conversion error carries a bounded trace whose last
+        record points at the element that failed
+        """
+        class Fake(pymm.element.BaseElement):
+            @pymm.encode.pre_encode
+            def fail(self, parent):
+                if self.attrib.get('ID') == 'ID_fail':
+                    raise ValueError('cannot encode')
+
+        mm = pymm.Mindmap()
+        node = pymm.Node(ID='ID_parent')
+        node.children = [Fake() for i in range(30)] + [Fake(ID='ID_fail')]
+        mm.root.nodes.append(node)
+        with self.assertRaises(ValueError) as context:
+            pymm.encode(mm)
+        trace = context.exception.conversion_trace
+        self.assertEqual(len(trace), 16)
+        last = trace.last
+        self.assertEqual(last.event, 'pre_encode')
+        self.assertTrue(last.path.endswith('node[ID_parent]/' +
+                                           Fake.tag + '[ID_fail]'))
+        self.assertTrue(last.path.startswith('map/'))
+        self.assertIn('ID_fail', str(context.exception.__notes__))
+
     def tearDown(self):
         """create a new class that inherits from BaseElement so that
         previous "bad" elements created do not interfere with other
@@ -705,7 +2313,10 @@ class TestReadWriteExample(unittest.TestCase):
         self.filename = 'export_test_0x123'
 
     def tearDown(self):
-        os.remove(self.filename)
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
 
     def test_read_and_write_file(self):
         """Test the reading and writing of a mind map. Also (important)
@@ -716,20 +2327,21 @@ class TestReadWriteExample(unittest.TestCase):
         # path to the doc file in a more portable way.
         this_path = os.path.dirname(os.path.realpath(__file__))
         mm_path = os.path.join(this_path, '../docs/input.mm')
-        mind_map = pymm.read(mm_path)
+        decode_stats = pymm.ConversionStats()
+        mind_map = pymm.read(mm_path, stats=decode_stats)
         self.assertTrue(mind_map)
         self.assertTrue(mind_map.root)
-        pymm.write(self.filename, mind_map)
-        self.verify_conversion_traces_match()
-
-    def verify_conversion_traces_match(self):
-        """pymm.factory.ConversionHandler contains a trace of factory
-        classes used in the last encode and decode operation. Call this
-        after reading and then writing to file without modification.
-        The two traces should be very similar or else something is
-        wrong with a factory. Since dynamically-generated factories are
-        part of both traces, the easiest way to compare is with
-        factory.decoding_element (which is the pymm element)
+        encode_stats = pymm.ConversionStats()
+        pymm.write(self.filename, mind_map, stats=encode_stats)
+        self.verify_conversion_traces_match(decode_stats, encode_stats)
+
+    def verify_conversion_traces_match(self, decode_stats, encode_stats):
+        """ConversionStats counts the factories used per encode and
+        decode operation. Call this after reading and then writing to
+        file without modification. The two counts should be very similar
+        or else something is wrong with a factory. Dynamically-generated
+        factories are counted by name, without their unique suffix, so
+        they match between encode and decode
 
         In the past, these have mismatched when an element modifies the
         tree prior to encoding. For example, AutomaticEdgeColor colored
@@ -738,12 +2350,8 @@ class TestReadWriteExample(unittest.TestCase):
         was off by one). To prevent this error from showing up, I
         modified the mindmap to include the missing colored-edge.
         """
-        encode_trace = pymm.factory.ConversionHandler.last_encode
-        decode_trace = pymm.factory.ConversionHandler.last_decode
-        encoded = (factory.decoding_element for factory in encode_trace)
-        decoded = (factory.decoding_element for factory in decode_trace)
-        encode_count = collections.Counter(encoded)
-        decode_count = collections.Counter(decoded)
+        encode_count = encode_stats.factories
+        decode_count = decode_stats.factories
         self.assertTrue(encode_count == decode_count)
 
     def test_write_file(self):
@@ -1119,6 +2727,403 @@ class TestSingleChild(ChildrenSetup):
         self.assertFalse(hasattr(elem, 'rootx'))
 
 
+class TestTraversal(unittest.TestCase):
+    """BaseElement provides non-recursive preorder, postorder, and
+    breadth-first iterators. Verify order, depth, pruning, tag
+    filtering, and that deep trees do not hit the recursion limit
+    """
+
+    def setUp(self):
+        """build tree:  a -> (b -> (d, cloud), c -> (e))"""
+        self.a, self.b, self.c, self.d, self.e = [
+            mme.Node(TEXT=text) for text in 'abcde'
+        ]
+        self.cloud = mme.Cloud()
+        self.a.children.extend([self.b, self.c])
+        self.b.children.extend([self.d, self.cloud])
+        self.c.children.append(self.e)
+
+    def test_preorder(self):
+        walked = list(self.a.iter_preorder())
+        self.assertEqual([elem for _, elem, _ in walked], [
+            self.a, self.b, self.d, self.cloud, self.c, self.e
+        ])
+        self.assertEqual(walked[0], (None, self.a, 0))
+        self.assertEqual(walked[2], (self.b, self.d, 2))
+
+    def test_postorder(self):
+        walked = list(self.a.iter_postorder())
+        self.assertEqual([elem for _, elem, _ in walked], [
+            self.d, self.cloud, self.b, self.e, self.c, self.a
+        ])
+        self.assertEqual(walked[-1], (None, self.a, 0))
+        self.assertEqual(walked[0], (self.b, self.d, 2))
+
+    def test_breadth_first(self):
+        walked = list(self.a.iter_breadth_first())
+        self.assertEqual([elem for _, elem, _ in walked], [
+            self.a, self.b, self.c, self.d, self.cloud, self.e
+        ])
+        self.assertEqual([depth for _, _, depth in walked],
+                         [0, 1, 1, 2, 2, 2])
+
+    def test_prune_and_tag(self):
+        """verify pruned elements are yielded but their children are
+        not, and that tag filtering does not stop traversal
+        """
+        self.b.attrib['FOLDED'] = True
+        folded = lambda elem: elem.attrib.get('FOLDED')
+        for walk in ['iter_preorder', 'iter_postorder',
+                     'iter_breadth_first']:
+            iterate = getattr(self.a, walk)
+            elems = {elem for _, elem, _ in iterate(prune=folded)}
+            self.assertEqual(elems, {self.a, self.b, self.c, self.e})
+            elems = [elem for _, elem, _ in iterate(tag='cloud')]
+            self.assertEqual(elems, [self.cloud])
+            elems = {elem for _, elem, _ in iterate(tag=['cloud', 'node'])}
+            self.assertEqual(len(elems), 6)
+
+    def test_change_while_walking(self):
+        """verify preorder reads the children of the element just
+        yielded after it is yielded, and postorder lets it be replaced
+        """
+        added = mme.Node(TEXT='f')
+        walked = []
+        for _, elem, _ in self.a.iter_preorder():
+            walked.append(elem)
+            if elem is self.c:
+                elem.children.append(added)
+        self.assertEqual(walked[-2:], [self.e, added])
+        replacement = mme.Node(TEXT='g')
+        walked = []
+        for parent, elem, _ in self.a.iter_postorder():
+            walked.append(elem)
+            if elem is self.b:
+                parent.children[0] = replacement
+        self.assertEqual(walked, [self.d, self.cloud, self.b, self.e,
+                                  added, self.c, self.a])
+        self.assertEqual(self.a.children, [replacement, self.c])
+
+    def test_deep_tree(self):
+        """verify traversal of tree deeper than the recursion limit"""
+        depth = sys.getrecursionlimit() + 100
+        top = elem = mme.BaseElement()
+        for i in range(depth):
+            child = mme.BaseElement()
+            elem.children.append(child)
+            elem = child
+        for walk in ['iter_preorder', 'iter_postorder',
+                     'iter_breadth_first']:
+            walked = list(getattr(top, walk)())
+            self.assertEqual(len(walked), depth + 1)
+            self.assertEqual(max(d for _, _, d in walked), depth)
+
+
+class TestContentHash(unittest.TestCase):
+    """content_hash is a per-element hash of content that is cached and
+    recomputed only along the path of elements that changed. Verify that
+    equal trees hash equally and that changes are detected
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mm_path = os.path.join(this_path, '../docs/input.mm')
+        self.first = pymm.read(self.mm_path)
+        self.second = pymm.read(self.mm_path)
+
+    def test_same_content(self):
+        """verify two reads of the same file have the same content, and
+        that a change to either is detected
+        """
+        self.assertTrue(self.first.same_content(self.second))
+        self.first.root.nodes[0]['status'] = 'changed'
+        self.assertFalse(self.first.same_content(self.second))
+        del self.first.root.nodes[0]['status']
+        self.assertTrue(self.first.same_content(self.second))
+
+    def test_mutations_invalidate(self):
+        """verify attrib, children, and tag changes all change the hash"""
+        root = self.first.root
+        before = self.first.content_hash()
+        mutations = [
+            lambda: root.attrib.update(COLOR='#ff0000'),
+            lambda: root.children.append(pymm.Node()),
+            lambda: root.nodes[0].children.pop(),
+            lambda: setattr(root.nodes[1], 'tag', 'other'),
+            lambda: setattr(root.nodes[2], 'children', []),
+        ]
+        for mutate in mutations:
+            mutate()
+            after = self.first.content_hash()
+            self.assertNotEqual(before, after)
+            before = after
+
+    def test_only_dirty_path_recomputed(self):
+        """verify that a change invalidates only the changed element and
+        its ancestors
+        """
+        self.first.content_hash()
+        changed, untouched = self.first.root.nodes[0], self.first.root.nodes[1]
+        changed.text = 'new text'
+        self.assertIsNone(changed._hash)
+        self.assertIsNone(self.first.root._hash)
+        self.assertIsNone(self.first._hash)
+        self.assertIsNotNone(untouched._hash)
+
+    def test_attrib_order(self):
+        """verify hash does not depend on attrib order"""
+        a = mme.Cloud(COLOR='#000000', SHAPE='STAR')
+        b = mme.Cloud(SHAPE='STAR', COLOR='#000000')
+        self.assertTrue(a.same_content(b))
+
+    def test_moved_child_updates_parents(self):
+        """verify moving a child invalidates both old and new parent"""
+        old_parent, new_parent = self.first.root.nodes[0:2]
+        self.first.content_hash()
+        child = old_parent.children.pop()
+        self.assertIsNone(child._parent)
+        self.first.content_hash()
+        new_parent.children.append(child)
+        self.assertIs(child._parent, new_parent)
+        self.assertIsNone(self.first._hash)
+
+    def test_tracked_once_hashed(self):
+        """verify children are observed only once an element is hashed,
+        and that changes beneath it are noticed from then on
+        """
+        from pymm import observe
+        node, child, grandchild = mme.Node(), mme.Node(), mme.Node()
+        node.children.append(child)
+        self.assertIs(type(node.children), list)
+        self.assertIs(type(node.attrib), dict)
+        before = node.content_hash()
+        self.assertIsInstance(child.children, observe.ObservedChildren)
+        self.assertIsInstance(child.attrib, observe.ObservedAttrib)
+        self.assertIs(child._parent, node)
+        child.children.append(grandchild)
+        self.assertIs(grandchild._parent, child)
+        self.assertIsNone(node._hash)
+        self.assertNotEqual(before, node.content_hash())
+
+    def test_deepcopy_copies_subtree_only(self):
+        """verify deepcopy of a child does not copy its parent"""
+        import copy
+        node = self.first.root.nodes[0]
+        duplicate = copy.deepcopy(node)
+        self.assertIsNone(duplicate._parent)
+        self.assertTrue(duplicate.same_content(node))
+        for child in duplicate.children:
+            self.assertIs(child._parent, duplicate)
+
+
+class TestDiffPatch(unittest.TestCase):
+    """diff creates an edit script between two versions of a tree, and
+    patch applies it. Verify patching the old version with the script
+    reproduces the new version
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mm_path = os.path.join(this_path, '../docs/input.mm')
+        self.old = pymm.read(self.mm_path)
+        self.new = pymm.read(self.mm_path)
+
+    def assert_patch_reproduces_new(self):
+        import json
+        script = json.loads(json.dumps(pymm.diff(self.old, self.new)))
+        pymm.patch(self.old, script)
+        self.assertTrue(self.old.same_content(self.new))
+        return script
+
+    def test_identical_trees(self):
+        """verify identical trees produce an empty script"""
+        self.assertEqual(pymm.diff(self.old, self.new), [])
+
+    def test_attrib_and_attributes(self):
+        """verify attrib and node attribute changes are patched"""
+        self.new.root.nodes[0].text = 'changed text'
+        self.new.root.nodes[1]['status'] = 'blocked'
+        script = self.assert_patch_reproduces_new()
+        self.assertEqual(
+            sorted(op['op'] for op in script), ['attrib', 'attributes']
+        )
+
+    def test_insert_delete_move(self):
+        """verify inserted, deleted, and moved nodes are patched"""
+        root = self.new.root
+        inserted = mme.Node(TEXT='inserted')
+        inserted.children.append(mme.Cloud())
+        root.nodes[0].children.insert(0, inserted)
+        root.children.remove(root.nodes[1])
+        moved = list(root.nodes[0].nodes)[-1]
+        root.nodes[0].children.remove(moved)
+        root.children.append(moved)
+        script = self.assert_patch_reproduces_new()
+        kinds = [op['op'] for op in script]
+        self.assertIn('insert', kinds)
+        self.assertIn('move', kinds)
+        self.assertIn('delete', kinds)
+
+    def test_changed_id(self):
+        """verify a node whose ID changed is matched by structure"""
+        self.new.root.nodes[0].attrib['ID'] = 'ID_renamed'
+        script = self.assert_patch_reproduces_new()
+        self.assertEqual([op['op'] for op in script], ['attrib'])
+
+    def test_many_children(self):
+        """verify many inserts and moves beneath one parent, between its
+        details, are patched
+        """
+        import random
+        root = self.new.root
+        for i in range(300):
+            root.children.append(mme.Node(TEXT=str(i)))
+            if i % 50 == 0:
+                root.children.append(mme.Cloud())
+        children = list(root.children)
+        random.Random(3).shuffle(children)
+        root.children[:] = children
+        script = self.assert_patch_reproduces_new()
+        kinds = {op['op'] for op in script}
+        self.assertTrue({'insert', 'move', 'details'} <= kinds)
+
+    def test_unknown_operation(self):
+        """verify an unknown operation raises ValueError"""
+        self.assertRaises(ValueError, pymm.patch, self.old, [{'op': 'x'}])
+
+
+class TestMerge(unittest.TestCase):
+    """merge applies the changes theirs made to base onto ours. Verify
+    independent changes are combined and conflicts are reported
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        mm_path = os.path.join(this_path, '../docs/input.mm')
+        self.base = pymm.read(mm_path)
+        self.ours = pymm.read(mm_path)
+        self.theirs = pymm.read(mm_path)
+
+    def test_unchanged_theirs(self):
+        """verify merging an unchanged theirs leaves ours as is"""
+        self.ours.root.nodes[0].text = 'ours'
+        merged, conflicts = pymm.merge(self.base, self.ours, self.theirs)
+        self.assertIs(merged, self.ours)
+        self.assertEqual(conflicts, [])
+        self.assertEqual(merged.root.nodes[0].text, 'ours')
+
+    def test_independent_changes(self):
+        """verify edits, moves, inserts and reorders of both sides are
+        combined
+        """
+        self.ours.root.nodes[0].text = 'ours'
+        self.ours.root.nodes[1]['owner'] = 'us'
+        first, second = self.theirs.root.nodes[0:2]
+        moved = list(second.nodes)[-1]
+        second.children.remove(moved)
+        first.children.append(moved)
+        self.theirs.root.children.insert(0, mme.Node(TEXT='theirs'))
+        self.theirs.root.nodes[1]['status'] = 'done'
+        merged, conflicts = pymm.merge(self.base, self.ours, self.theirs)
+        self.assertEqual(conflicts, [])
+        root = merged.root
+        self.assertEqual(root.nodes[0].text, 'theirs')
+        self.assertEqual(root.nodes[1].text, 'ours')
+        self.assertEqual(root.nodes[1]['status'], 'done')
+        self.assertEqual(root.nodes[2]['owner'], 'us')
+        self.assertEqual(list(root.nodes[1].nodes)[-1].attrib['ID'],
+                         moved.attrib['ID'])
+
+    def test_theirs_only_reproduces_theirs(self):
+        """verify merging into an unchanged ours gives theirs"""
+        self.theirs.root.nodes[0].children.reverse()
+        self.theirs.root.children.remove(self.theirs.root.nodes[1])
+        self.theirs.root.nodes[0].children.append(mme.Cloud())
+        merged, conflicts = pymm.merge(self.base, self.ours, self.theirs)
+        self.assertEqual(conflicts, [])
+        self.assertTrue(merged.same_content(self.theirs))
+
+    def test_conflicts(self):
+        """verify conflicting changes keep ours and are reported"""
+        self.ours.root.nodes[0].text = 'ours'
+        self.theirs.root.nodes[0].text = 'theirs'
+        deleted = self.ours.root.nodes[1]
+        self.ours.root.children.remove(deleted)
+        self.theirs.root.nodes[1]['status'] = 'done'
+        merged, conflicts = pymm.merge(self.base, self.ours, self.theirs)
+        self.assertEqual(merged.root.nodes[0].text, 'ours')
+        kinds = {(c.kind, c.key) for c in conflicts}
+        self.assertEqual(kinds, {('attrib', 'TEXT'), ('modify', None)})
+        text_conflict = [c for c in conflicts if c.kind == 'attrib'][0]
+        self.assertEqual(text_conflict.ours, 'ours')
+        self.assertEqual(text_conflict.theirs, 'theirs')
+
+    def test_delete_modified(self):
+        """verify theirs cannot delete a node that ours modified"""
+        self.ours.root.nodes[1].text = 'ours'
+        self.theirs.root.children.remove(self.theirs.root.nodes[1])
+        merged, conflicts = pymm.merge(self.base, self.ours, self.theirs)
+        self.assertEqual([c.kind for c in conflicts], ['delete'])
+        self.assertEqual(merged.root.nodes[1].text, 'ours')
+
+
+class TestClone(unittest.TestCase):
+    """clone copies an element hierarchy without recursion, optionally
+    with new IDs. Verify the copy is independent and references within
+    the clone are remapped
+    """
+
+    def setUp(self):
+        this_path = os.path.dirname(os.path.realpath(__file__))
+        self.mindmap = pymm.read(os.path.join(this_path, '../docs/input.mm'))
+
+    def ids(self, elem):
+        return [e.attrib['ID'] for _, e, _ in elem.iter_preorder()
+                if 'ID' in e.attrib]
+
+    def test_same_ids(self):
+        """verify clone without new IDs has the same content"""
+        duplicate = self.mindmap.clone(new_ids=False)
+        self.assertIsInstance(duplicate, Mindmap)
+        self.assertTrue(duplicate.same_content(self.mindmap))
+        self.assertEqual(self.ids(duplicate), self.ids(self.mindmap))
+
+    def test_independent(self):
+        """verify changing the clone does not change the original"""
+        node = self.mindmap.root.nodes[0]
+        node['status'] = 'original'
+        duplicate = node.clone()
+        self.assertIsNone(duplicate._parent)
+        for child in duplicate.children:
+            self.assertIs(child._parent, duplicate)
+        duplicate['status'] = 'clone'
+        duplicate.attrib['TEXT'] = 'clone'
+        duplicate.children.append(mme.Node())
+        self.assertEqual(node['status'], 'original')
+        self.assertNotEqual(node.attrib['TEXT'], 'clone')
+        self.assertEqual(len(node.children) + 1, len(duplicate.children))
+
+    def test_new_ids_and_references(self):
+        """verify all IDs are new, and that arrow destinations and links
+        to elements within the clone point to their clones
+        """
+        duplicate = self.mindmap.clone()
+        old_ids, new_ids = self.ids(self.mindmap), self.ids(duplicate)
+        self.assertEqual(len(old_ids), len(new_ids))
+        self.assertFalse(set(old_ids) & set(new_ids))
+        arrows = [e for _, e, _ in duplicate.iter_preorder(tag='arrowlink')]
+        self.assertTrue(arrows)
+        for arrow in arrows:
+            self.assertIn(arrow.destination, new_ids)
+        node = duplicate.root.nodes[0]
+        node.link = duplicate.root
+        self.assertEqual(node.clone().link, duplicate.root.attrib['ID'])
+        root = duplicate.root
+        root.nodes[0].link = root.nodes[1]
+        clone = root.clone()
+        self.assertEqual(clone.nodes[0].link, clone.nodes[1].attrib['ID'])
+
+
 class TestIconElement(unittest.TestCase):
     """test Icon-specific features"""
 